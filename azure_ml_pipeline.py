@@ -1,139 +1,218 @@
 #!/usr/bin/python3
 import argparse
-from azureml.core import Environment
-from azureml.core import Experiment
-from azureml.core.compute import AmlCompute
-from azureml.core.runconfig import RunConfiguration
-from azureml.pipeline.core import Pipeline
-from azureml.pipeline.core import PipelineData
-from azureml.pipeline.core import StepSequence
-from azureml.pipeline.core.graph import PipelineParameter
-from azureml.pipeline.steps import PythonScriptStep
-from utils.features import get_workspace
-
-# Run this file with command: python -m azure_ml_pipeline --plant <plant_code>
-
-ws = get_workspace()
-print("Found workspace {} at location {}".format(ws.name, ws.location))
-
-# Get resourecs
-def_blob_store = ws.get_default_datastore()  # To store temporary input/output data during pipeline execution
-aml_compute = AmlCompute(workspace=ws, name="vm-compute")  # Compute instance for data preprocessing, training models, etc. (Check compute name: Manage - Compute - Compute clusters)
-env = Environment.get(workspace=ws, name="my-custom-env")  # Environment for Docker settings, packages used by pipeline, and environment variables (Check environment name: Assets - Environments)
-
-aml_run_config = RunConfiguration()
-aml_run_config.target = aml_compute
-aml_run_config.environment = env
-
-# Read parameters from Gitlab-CI yaml
-parser = argparse.ArgumentParser()
-parser.add_argument("--plant", required=True)
-parser.add_argument("--mode", required=True)
-args = parser.parse_args()
-
-# Define pipline parameters
-plant = PipelineParameter(name="plant", default_value=args.plant)
-mode = PipelineParameter(name="mode", default_value=args.mode)
-
-# Define pipeline data
-# PipelineData serves as a pipeline connection between steps. It can be used as a medium for passing intermediate input/output data.
-series_id = PipelineData("series_id", datastore=def_blob_store)
-model = PipelineData("model", datastore=def_blob_store)
-encoding_mappings = PipelineData("encoding_mappings", datastore=def_blob_store)
-
-# Setup pipeline steps
-source_directory = "./"
-
-step_read_data = PythonScriptStep(name="read_data",
-                                    script_name="pipeline/read_data.py",
-                                    arguments=[
-                                        "--series_id", series_id,
-                                        "--plant", plant,
-                                        "--mode", mode,
-                                    ],
-                                    inputs=[],
-                                    outputs=[
-                                        series_id
-                                    ],
-                                    runconfig=aml_run_config,
-                                    source_directory=source_directory,
-                                    allow_reuse=False)
-
-step_train = PythonScriptStep(name="train",
-                              script_name="pipeline/train.py",
-                              arguments=[
-                                  "--series_id", series_id,
-                                  "--plant", plant,
-                                  "--model_file", model,
-                                  "--mode", mode,
-                              ],
-                              inputs=[
-                                  series_id,
-                              ],
-                              outputs=[
-                                  encoding_mappings,
-                                  model,
-                              ],
-                              runconfig=aml_run_config,
-                              source_directory=source_directory,
-                              allow_reuse=False)
-
-step_register_model = PythonScriptStep(name="register_model",
-                                 script_name="pipeline/register_model.py",
-                                 arguments=[
-                                     "--series_id", series_id,
-                                     "--model_file", model,
-                                     "--plant", plant,
-                                 ],
-                                 inputs=[
-                                     series_id,
-                                     encoding_mappings,
-                                     model
-                                 ],
-                                 outputs=[
-                                 ],
-                                 runconfig=aml_run_config,
-                                 source_directory=source_directory,
-                                 allow_reuse=False)
-                                 
-step_predict = PythonScriptStep(name="predict",
-                                script_name="pipeline/predict.py",
-                                arguments=[
-                                    "--series_id", series_id,
-                                    "--plant", plant,
-                                    "--mode", mode,
-                                ],
-                                inputs=[
-                                    series_id,
-                                    encoding_mappings,
-                                    model
-                                ],
-                                outputs=[
-                                ],
-                                runconfig=aml_run_config,
-                                source_directory=source_directory,
-                                allow_reuse=False)
-
-step_upload_db = PythonScriptStep(name="upload_db",
-                                  script_name="pipeline/upload_db.py",
-                                  arguments=[
-                                      "--series_id", series_id,
-                                      "--plant", plant,
-                                      "--mode", mode,
-                                  ],
-                                  inputs=[
-                                      series_id,
-                                  ],
-                                  outputs=[
-                                  ],
-                                  runconfig=aml_run_config,
-                                  source_directory=source_directory,
-                                  allow_reuse=False)
-
-step_sequence = StepSequence(steps=[step_read_data, step_train, step_register_model, step_predict, step_upload_db])
-pipeline = Pipeline(workspace=ws, steps=step_sequence)
-#print(f"pipeline: {pipeline}")
-
-# Submit pipeline experiment
-pipeline_run = Experiment(workspace=ws, name='my_ml_pipeline').submit(config=pipeline, regenerate_outputs=False, tags={"plant": args.plant})
-#print(f"pipeline_run: {pipeline_run}")
\ No newline at end of file
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Run this file with command: python -m azure_ml_pipeline --plant <plant_code> --mode <mode>
+# Several plants: python -m azure_ml_pipeline --plant <plant_1> <plant_2> ... --mode <mode> [--backend local]
+# Fused steps, passing data and models in process: python -m azure_ml_pipeline --plant <plant_code> --mode <mode> --fuse [<steps> ...]
+
+
+# Step scripts of a plant in pipeline order, and the name of their pipeline step
+STEPS = ["read_data", "train", "register_model", "predict", "output_db"]
+STEP_NAMES = {"output_db": "upload_db"}
+
+# Pipeline data read and written by each step script
+STEP_INPUTS = {
+    "read_data": [],
+    "train": ["series_id"],
+    "register_model": ["series_id", "encoding_mappings", "model"],
+    "predict": ["series_id", "encoding_mappings", "model"],
+    "output_db": ["series_id"],
+}
+STEP_OUTPUTS = {
+    "read_data": ["series_id"],
+    "train": ["encoding_mappings", "model"],
+    "register_model": [],
+    "predict": [],
+    "output_db": [],
+}
+
+
+def parse_groups(groups=None) -> list:
+    """
+        Step scripts run by each pipeline step. None: one step per script; []: all scripts fused in one step;
+        else groups of consecutive scripts, e.g. ["read_data,train,register_model", "predict,output_db"]
+    """
+
+    if groups is None:
+        return [[step] for step in STEPS]
+    if not groups:
+        return [STEPS]
+
+    parsed = [[step.strip() for step in group.split(",") if step.strip()] for group in groups]
+    if [step for group in parsed for step in group] != STEPS:
+        raise ValueError(f"Step groups must list {', '.join(STEPS)} once each and in this order, got: {' '.join(groups)}")
+
+    return parsed
+
+
+def step_arguments(step, series_id, plant, mode, model):
+    """Arguments of a step script, the values are paths or pipeline parameters and data"""
+
+    arguments = ["--series_id", series_id, "--plant", plant]
+    if step in ["train", "register_model"]:
+        arguments += ["--model_file", model]
+    if step != "register_model":
+        arguments += ["--mode", mode]
+
+    return arguments
+
+
+def group_command(group, series_id, plant, mode, model):
+    """Script and arguments of a pipeline step running the step scripts of group, fused by pipeline/fused.py if there are several"""
+
+    if len(group) == 1:
+        return f"pipeline/{group[0]}.py", step_arguments(group[0], series_id, plant, mode, model)
+
+    return "pipeline/fused.py", ["--steps", ",".join(group), "--series_id", series_id, "--plant", plant, "--mode", mode, "--model_file", model]
+
+
+def group_name(group) -> str:
+    names = [STEP_NAMES.get(step, step) for step in group]
+    return names[0] if len(names) == 1 else f"{names[0]}_to_{names[-1]}"
+
+
+def build_plant_steps(plant_code, mode, def_blob_store, aml_run_config, multi_plant=False, groups=None):
+    """Steps read_data -> train -> register_model -> predict -> upload_db of one plant, fused as in groups (see parse_groups)"""
+
+    from azureml.pipeline.core import PipelineData
+    from azureml.pipeline.core.graph import PipelineParameter
+    from azureml.pipeline.steps import PythonScriptStep
+
+    # Names of parameters, data and steps must be unique within a pipeline
+    suffix = f"_{plant_code}" if multi_plant else ""
+
+    # Define pipline parameters
+    plant = PipelineParameter(name=f"plant{suffix}", default_value=plant_code)
+
+    # Define pipeline data
+    # PipelineData serves as a pipeline connection between steps. It can be used as a medium for passing intermediate input/output data.
+    data = {name: PipelineData(f"{name}{suffix}", datastore=def_blob_store) for name in ["series_id", "model", "encoding_mappings"]}
+
+    # Setup pipeline steps
+    source_directory = "./"
+
+    steps = []
+    for group in parse_groups() if groups is None else groups:
+        script_name, arguments = group_command(group, data["series_id"], plant, mode, data["model"])
+
+        # Data passed between the scripts of a fused step are outputs of the step only
+        outputs = [name for step in group for name in STEP_OUTPUTS[step]]
+        inputs = [name for name in dict.fromkeys(name for step in group for name in STEP_INPUTS[step]) if name not in outputs]
+
+        steps.append(PythonScriptStep(name=f"{group_name(group)}{suffix}",
+                                      script_name=script_name,
+                                      arguments=arguments,
+                                      inputs=[data[name] for name in inputs],
+                                      outputs=[data[name] for name in outputs],
+                                      runconfig=aml_run_config,
+                                      source_directory=source_directory,
+                                      allow_reuse=False))
+
+    return steps
+
+
+def submit_azure_pipeline(plants, mode_value, groups=None):
+    """Submit one pipeline, with an independent branch of steps per plant"""
+
+    from azureml.core import Environment
+    from azureml.core import Experiment
+    from azureml.core.compute import AmlCompute
+    from azureml.core.runconfig import RunConfiguration
+    from azureml.pipeline.core import Pipeline
+    from azureml.pipeline.core import StepSequence
+    from azureml.pipeline.core.graph import PipelineParameter
+    from utils.features import get_workspace
+
+    ws = get_workspace()
+    print("Found workspace {} at location {}".format(ws.name, ws.location))
+
+    # Get resourecs
+    def_blob_store = ws.get_default_datastore()  # To store temporary input/output data during pipeline execution
+    aml_compute = AmlCompute(workspace=ws, name="vm-compute")  # Compute instance for data preprocessing, training models, etc. (Check compute name: Manage - Compute - Compute clusters)
+    env = Environment.get(workspace=ws, name="my-custom-env")  # Environment for Docker settings, packages used by pipeline, and environment variables (Check environment name: Assets - Environments)
+
+    aml_run_config = RunConfiguration()
+    aml_run_config.target = aml_compute
+    aml_run_config.environment = env
+
+    mode = PipelineParameter(name="mode", default_value=mode_value)
+
+    if len(plants) == 1:
+        step_sequence = StepSequence(steps=build_plant_steps(plants[0], mode, def_blob_store, aml_run_config, groups=groups))
+        pipeline = Pipeline(workspace=ws, steps=step_sequence)
+    else:
+        # Steps of a plant run in order, branches of different plants run in parallel
+        steps = []
+        for plant in plants:
+            plant_steps = build_plant_steps(plant, mode, def_blob_store, aml_run_config, multi_plant=True, groups=groups)
+            for previous_step, step in zip(plant_steps, plant_steps[1:]):
+                step.run_after(previous_step)
+            steps.extend(plant_steps)
+        pipeline = Pipeline(workspace=ws, steps=steps)
+    #print(f"pipeline: {pipeline}")
+
+    # Submit pipeline experiment
+    pipeline_run = Experiment(workspace=ws, name='my_ml_pipeline').submit(config=pipeline, regenerate_outputs=False, tags={"plant": ",".join(plants)})
+    #print(f"pipeline_run: {pipeline_run}")
+
+    return pipeline_run
+
+
+def run_plant_locally(plant, mode, root, groups=None):
+    """Run the step scripts of one plant one after the other, with the local stand-ins of utils/local_backend.py"""
+
+    run_dir = os.path.join(root, "runs", plant)
+    series_id = os.path.join(run_dir, "series_id")
+    model = os.path.join(run_dir, "model")
+    env = {**os.environ, "PIPELINE_BACKEND": "local", "PIPELINE_LOCAL_ROOT": root, "PIPELINE_RUN_ID": f"{plant}_{int(time.time())}"}
+
+    timings = {}
+    start = time.perf_counter()
+    for group in parse_groups() if groups is None else groups:
+        script_name, arguments = group_command(group, series_id, plant, mode, model)
+        step_start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", script_name[:-len(".py")].replace("/", "."), *arguments], env=env, check=True)
+        timings[group_name(group)] = time.perf_counter() - step_start
+    timings["total"] = time.perf_counter() - start
+
+    return plant, timings
+
+
+def run_local_pipelines(plants, mode, root, max_workers=None, groups=None):
+    """Run the pipeline of every plant in a process pool"""
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers or len(plants)) as executor:
+        futures = [executor.submit(run_plant_locally, plant, mode, root, groups) for plant in plants]
+        for future in futures:
+            plant, timings = future.result()
+            print(f"Plant {plant}: " + ", ".join(f"{name} {seconds:.1f} sec" for name, seconds in timings.items()))
+
+    print(f"{len(plants)} plants done in {time.perf_counter() - start:.1f} sec")
+
+
+if __name__ == "__main__":
+    # Read parameters from Gitlab-CI yaml
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plant", required=True, nargs="+")  # One or more plant codes
+    parser.add_argument("--mode", required=True)
+    parser.add_argument("--backend", default="azure", choices=["azure", "local"])  # local: run the step scripts in a local process pool
+    parser.add_argument("--max_workers", type=int, default=None)  # Plants run at the same time with the local backend
+    parser.add_argument("--local_root", default="./local_backend")  # Workspace stand-in folder of the local backend
+    parser.add_argument("--fuse", nargs="*", default=None)  # Step scripts run in one process: --fuse (all of them) or groups, e.g. --fuse read_data,train,register_model predict,output_db
+    args = parser.parse_args()
+
+    try:
+        groups = parse_groups(args.fuse)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.backend == "local":
+        run_local_pipelines(args.plant, args.mode, os.path.abspath(args.local_root), args.max_workers, groups)
+    else:
+        submit_azure_pipeline(args.plant, args.mode, groups)
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+import time
+from argparse import ArgumentParser
+from benchmark.synthetic import make_mrp_frame
+from utils.connection import Connection
+
+# Run this file with command: python -m benchmark.bench_db_upload --mode qas --rows 10000 100000
+# The database of the mode (config.ini) must allow creating the benchmark table
+
+parser = ArgumentParser()
+parser.add_argument("--mode", required=True)
+parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+parser.add_argument("--table", default="public.bench_upload")
+parser.add_argument("--row_by_row_limit", type=int, default=100_000)  # Skip row-by-row inserts above this size
+args = parser.parse_args()
+
+conn = Connection(args.mode)
+table = Connection._identifier(args.table)
+
+
+def row_by_row(cursor, df, table, columns, chunksize):
+    command = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(df.columns))})"
+    for row in df.astype(object).itertuples(index=False, name=None):
+        cursor.execute(command, row)
+
+
+loaders = {
+    "row_by_row": row_by_row,
+    "execute_values": Connection._execute_values_rows,
+    "copy": Connection._copy_rows,
+}
+
+raw_conn = conn.conn_engine.raw_connection()
+try:
+    for n_rows in args.rows:
+        df = make_mrp_frame(n_rows)
+        df["series_id"] = 1
+        columns = Connection._projection(list(df.columns))
+
+        with raw_conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"CREATE TABLE {table} ({', '.join(f'{c} text' for c in df.columns[:-1])}, series_id integer)")
+        raw_conn.commit()
+
+        results = {}
+        for name, loader in loaders.items():
+            if name == "row_by_row" and n_rows > args.row_by_row_limit:
+                continue
+
+            with raw_conn.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {table}")
+                start = time.perf_counter()
+                loader(cursor, df, table, columns, 100_000)
+            raw_conn.commit()
+            results[name] = time.perf_counter() - start
+
+        # Staging table upsert as used by pipeline/output_db.py
+        start = time.perf_counter()
+        conn.upsert_dataframe(df, table, key="series_id", method="copy")
+        results["upsert_copy"] = time.perf_counter() - start
+
+        print(f"rows: {n_rows}, " + ", ".join(f"{name}: {sec:.3f} sec ({n_rows / sec:,.0f} rows/sec)" for name, sec in results.items()))
+
+    with raw_conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    raw_conn.commit()
+finally:
+    raw_conn.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+# Run this file with command: python -m benchmark.bench_fused --rows 100000 --latency 0.5 --bandwidth 50 --mode qas
+# One process per step script vs. the scripts fused in one process (pipeline/fused.py), with the local stand-ins of utils/local_backend.py.
+# Starts from train with synthetic registered data (read_data needs the source table), the status updates go to the database of --mode.
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, default=100_000)
+parser.add_argument("--classes", type=int, default=20)
+parser.add_argument("--latency", type=float, default=0.5)  # Seconds per transfer or registration
+parser.add_argument("--bandwidth", type=float, default=50)  # MB/s, 0: unlimited
+parser.add_argument("--steps", default="train,register_model,predict")
+parser.add_argument("--mode", default="qas")
+parser.add_argument("--train_args", default="--search staged --force_retrain")  # The same models are trained by both runs
+parser.add_argument("--repeat", type=int, default=1)  # Best of repeat runs
+args = parser.parse_args()
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+steps = args.steps.split(",")
+
+root = tempfile.mkdtemp()
+work = os.path.join(root, "work")  # Working directory of the steps, for their ./data, ./logs and ./label_encoding
+os.makedirs(work)
+shutil.copy(os.path.join(repo, "config.ini"), work)
+
+# The stand-ins read these at import
+os.environ.update({"PIPELINE_BACKEND": "local", "PIPELINE_LOCAL_ROOT": os.path.join(root, "workspace"),
+                   "PIPELINE_LOCAL_LATENCY": str(args.latency), "PIPELINE_LOCAL_BANDWIDTH": str(args.bandwidth),
+                   "PYTHONPATH": os.pathsep.join([repo, os.environ.get("PYTHONPATH", "")])})
+
+from azure_ml_pipeline import step_arguments
+from benchmark.synthetic import make_mrp_frame
+from utils.data_io import local_path
+from utils.data_io import register_frame
+from utils.data_io import write_frame
+from utils.local_backend import Workspace
+
+ws = Workspace()
+datastore = ws.get_default_datastore()
+
+# Training and inference data of a plant, as read_data.py registers them
+frame = make_mrp_frame(args.rows, n_classes=args.classes, skew=1.0, empty_ratio=0.3)
+for kind, name, df in [("train", "BENCH_training_data", frame[frame["sourcer_code"] != '']),
+                       ("inference", "BENCH_inference_data", frame[frame["sourcer_code"] == ''])]:
+    path = os.path.join(work, local_path(kind, "BENCH"))
+    write_frame(df, path)
+    register_frame(ws, datastore, path, kind, name)
+
+series_id = os.path.join(root, "series_id")
+model = os.path.join(root, "model")
+os.makedirs(series_id)
+with open(os.path.join(series_id, "series_id.txt"), "w") as f:
+    f.write("1")
+
+
+def run(module, arguments) -> (float, str):
+    """Wall time and log output of a step process"""
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-m", module, *arguments], cwd=work, check=True, capture_output=True, text=True)
+    return time.perf_counter() - start, process.stderr
+
+
+def fused_timings(log: str) -> dict:
+    """Seconds of each step in the "Fused steps done" line of pipeline/fused.py"""
+
+    line = [line for line in log.splitlines() if "Fused steps done:" in line][-1]
+    return {step: float(seconds) for step, seconds in re.findall(r"(\w+) ([\d.]+) sec", line.split("Fused steps done:")[1])}
+
+
+def extra(step):
+    return args.train_args.split() if step == "train" else []
+
+
+separate, fused = None, None
+for _ in range(args.repeat):
+    # Current graph: one process per step, every step downloads its inputs
+    timings = {step: run(f"pipeline.{step}", step_arguments(step, series_id, "BENCH", args.mode, model) + extra(step))[0] for step in steps}
+    timings["total"] = sum(timings.values())
+    if separate is None or timings["total"] < separate["total"]:
+        separate = timings
+
+    # Fused: one process, models and mappings handed over in memory
+    seconds, log = run("pipeline.fused", ["--steps", args.steps, "--series_id", series_id, "--plant", "BENCH", "--mode", args.mode, "--model_file", model,
+                                          "--step_args", f"train={args.train_args}"])
+    timings = {**fused_timings(log), "total": seconds}  # Process wall time, with the interpreter start
+    if fused is None or timings["total"] < fused["total"]:
+        fused = timings
+
+# Per step, as training time varies from run to run
+print(f"rows: {args.rows}, latency: {args.latency} sec, bandwidth: {args.bandwidth} MB/s")
+print(f"{'step':>15} {'separate':>10} {'fused':>10} {'saved':>10}")
+for step in [*steps, "total"]:
+    print(f"{step:>15} {separate[step]:>9.2f}s {fused[step]:>9.2f}s {separate[step] - fused[step]:>9.2f}s")
+
+shutil.rmtree(root, ignore_errors=True)
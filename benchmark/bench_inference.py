@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+import joblib
+import numpy as np
+import os
+import tempfile
+import time
+import xgboost as xgb
+from argparse import ArgumentParser
+from benchmark.synthetic import make_mrp_frame
+from utils.label_encoding import frequency_encoding
+from utils.model import BoosterPredictor
+from utils.model import save_model
+
+# Run this file with command: python -m benchmark.bench_inference --rows 1000000
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, default=1_000_000)  # Inference rows
+parser.add_argument("--train_rows", type=int, default=20_000)
+parser.add_argument("--classes", type=int, default=50)
+parser.add_argument("--n_estimators", type=int, default=50)
+parser.add_argument("--n_threads", type=int, default=None)
+args = parser.parse_args()
+
+features = ["colA", "colB", "colC", "colD", "colE"]  # Model 1
+columns = features + ["sourcer_code"]
+
+# A small model on encoded synthetic data, inference rows encoded with the same mappings
+train, encoding_mappings = frequency_encoding(make_mrp_frame(args.train_rows, cardinality=100, n_classes=args.classes, seed=1)[columns], columns=columns)
+model = xgb.XGBClassifier(n_estimators=args.n_estimators, max_depth=5, n_jobs=args.n_threads or os.cpu_count())
+model.fit(train[features], train["sourcer_code"])
+
+inference, _ = frequency_encoding(make_mrp_frame(args.rows, cardinality=100, n_classes=args.classes, seed=2)[features], columns=features)
+inference = inference[features].astype(np.int64)
+
+with tempfile.TemporaryDirectory() as tmp:
+    save_model(model, tmp, "model.joblib")
+
+    start = time.perf_counter()
+    joblib_model = joblib.load(os.path.join(tmp, "model.joblib"))
+    joblib_load_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictor = BoosterPredictor.load(os.path.join(tmp, "model.joblib"), n_threads=args.n_threads)
+    native_load_sec = time.perf_counter() - start
+
+# Current path: sklearn wrapper on a DataFrame slice
+start = time.perf_counter()
+sklearn_proba = joblib_model.predict_proba(inference)
+sklearn_sec = time.perf_counter() - start
+
+# Native path: booster on a contiguous float32 array
+start = time.perf_counter()
+native_proba = predictor.predict_proba(inference)
+native_sec = time.perf_counter() - start
+
+assert np.allclose(sklearn_proba, native_proba, atol=1e-6), "Native predictions differ from predict_proba"
+print(f"load: joblib {joblib_load_sec * 1000:.1f} ms, native {native_load_sec * 1000:.1f} ms")
+print(f"rows: {args.rows}, predict_proba: {sklearn_sec:.3f} sec, native: {native_sec:.3f} sec, speedup: {sklearn_sec / native_sec:.1f}x")
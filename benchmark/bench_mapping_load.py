@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import time
+from argparse import ArgumentParser
+from benchmark.synthetic import make_mrp_frame
+from utils.label_encoding import EncodingMappings
+from utils.label_encoding import frequency_encoding
+
+# Run this file with command: python -m benchmark.bench_mapping_load --cardinality 1000 100000 --rows 1000000
+
+parser = ArgumentParser()
+parser.add_argument("--cardinality", type=int, nargs="+", default=[1000, 100_000])  # Categories per feature column
+parser.add_argument("--rows", type=int, default=1_000_000)  # Inference rows encoded after loading
+parser.add_argument("--repeat", type=int, default=5)
+args = parser.parse_args()
+
+columns = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
+
+
+def best_time(function, repeat):
+    """Fastest of repeat calls, and the last result"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, file)) for file in os.listdir(directory))
+
+
+for cardinality in args.cardinality:
+    # Every category appears in the fitting frame, so the mappings have about cardinality entries per column
+    _, encoding_mappings = frequency_encoding(make_mrp_frame(max(args.rows, 4 * cardinality), cardinality=cardinality, seed=1), columns=columns)
+    inference = make_mrp_frame(args.rows, cardinality=cardinality, seed=2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.npy")
+        compact_path = os.path.join(tmp, "compact")
+        np.save(legacy_path, encoding_mappings)
+        EncodingMappings.from_dict(encoding_mappings).save(compact_path)
+
+        legacy_sec, legacy = best_time(lambda: np.load(legacy_path, allow_pickle=True).item(), args.repeat)
+        compact_sec, compact = best_time(lambda: EncodingMappings.load(compact_path), args.repeat)
+
+        # Load and encode, as predict.py does
+        legacy_encode_sec, legacy_encoded = best_time(lambda: EncodingMappings.from_dict(np.load(legacy_path, allow_pickle=True).item()).transform(inference.copy(), columns=columns), args.repeat)
+        compact_encode_sec, compact_encoded = best_time(lambda: EncodingMappings.load(compact_path).transform(inference.copy(), columns=columns), args.repeat)
+
+        pd.testing.assert_frame_equal(legacy_encoded, compact_encoded, check_dtype=False)  # Codes use compact dtypes
+        assert compact.to_dict() == legacy, "Compact mappings differ from the legacy mappings"
+
+        print(f"cardinality: {cardinality}, size: legacy {os.path.getsize(legacy_path) / 1e6:.1f} MB, compact {directory_size(compact_path) / 1e6:.1f} MB")
+        print(f"  load: legacy {legacy_sec * 1000:.1f} ms, compact (mmap) {compact_sec * 1000:.1f} ms")
+        print(f"  load + encode {args.rows} rows: legacy {legacy_encode_sec:.3f} sec, compact {compact_encode_sec:.3f} sec")
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+import numpy as np
+from argparse import ArgumentParser
+from benchmark.synthetic import FEATURE_COLUMNS
+from benchmark.synthetic import make_mrp_frame
+from sklearn.model_selection import train_test_split
+from utils.dtypes import categorical
+from utils.dtypes import memory_mb
+from utils.label_encoding import frequency_encoding
+
+# Run this file with command: python -m benchmark.bench_memory --rows 1000000
+# Memory of the frames of read_data.py and train.py with int64/object dtypes (former) vs. the dtype policy of utils/dtypes.py
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, default=1_000_000)
+parser.add_argument("--cardinality", type=int, default=1000)
+parser.add_argument("--classes", type=int, default=2000)
+parser.add_argument("--empty_ratio", type=float, default=0.1)  # Share of rows without colA, encoded as NaN
+args = parser.parse_args()
+
+columns = FEATURE_COLUMNS + ["sourcer_code"]
+frame = make_mrp_frame(args.rows, cardinality=args.cardinality, n_classes=args.classes, skew=1.0).astype(object)  # Strings as read from the DB
+frame.loc[np.random.default_rng(0).random(args.rows) < args.empty_ratio, "colA"] = None
+
+results = {"raw": (memory_mb(frame), memory_mb(categorical(frame.copy(), FEATURE_COLUMNS)))}
+
+encoded, _ = frequency_encoding(frame.copy(), columns=columns)
+former = encoded.astype({col: "float64" if encoded[col].isna().any() else "int64" for col in columns})  # Dtypes of the former encoding
+results["encoded"] = (memory_mb(former), memory_mb(encoded))
+
+# Former sequential training: X1, X2 and their four splits held at once; now one split of one model at a time
+train_index, val_index = train_test_split(np.arange(len(encoded)), test_size=0.1, random_state=597)
+x1, x2 = former[FEATURE_COLUMNS[:5]], former[FEATURE_COLUMNS[2:]]
+former_splits = memory_mb(x1) + memory_mb(x2) + sum(memory_mb(x.iloc[index]) for x in [x1, x2] for index in [train_index, val_index])
+compact_split = max(sum(memory_mb(encoded.iloc[index, encoded.columns.get_indexer(cols)]) for index in [train_index, val_index])
+                    for cols in [FEATURE_COLUMNS[:5], FEATURE_COLUMNS[2:]])
+results["training splits"] = (former_splits, compact_split)
+
+print(f"rows: {args.rows}, cardinality: {args.cardinality}, classes: {args.classes}")
+for name, (before, after) in results.items():
+    print(f"{name:>16}: {before:8.1f} MB -> {after:8.1f} MB ({before / max(after, 1e-9):.1f}x smaller)")
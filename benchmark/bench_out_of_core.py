@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+# Run this file with command: python -m benchmark.bench_out_of_core --rows 4000000 --chunksize 200000
+# Model 1 (colA-colE) trained on a CSV file loaded whole (in-memory XGBClassifier) vs. out of core (train.py --train_mode external):
+# encoded chunks saved to disk and fed to an external memory DMatrix. Same hyperparameters, hist tree method.
+# Each case runs in its own process, for its peak RSS: raise --rows past the memory of the machine and the in-memory case fails.
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, default=4_000_000)
+parser.add_argument("--cardinality", type=int, default=1000)
+parser.add_argument("--classes", type=int, default=20)
+parser.add_argument("--noise", type=float, default=0.2)  # Share of rows with a random label, the others depend on colA
+parser.add_argument("--chunksize", type=int, default=200_000)
+parser.add_argument("--n_estimators", type=int, default=50)
+parser.add_argument("--cases", nargs="+", default=["memory", "external"])
+parser.add_argument("--case", default=None)  # Internal: run one case on --path and print its result
+parser.add_argument("--path", default=None)
+args = parser.parse_args()
+
+columns = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
+features = slice(0, 5)
+params = {"max_depth": 5, "learning_rate": 0.1, "n_estimators": args.n_estimators}
+
+if args.case is not None:
+    import numpy as np
+    import pandas as pd
+    from utils.data_io import iter_frames
+    from utils.dtypes import categorical
+    from utils.instrumentation import peak_rss_mb
+    from utils.label_encoding import FrequencyEncoder
+    from utils.label_encoding import frequency_encoding
+
+    start = time.perf_counter()
+    if args.case == "memory":
+        import xgboost as xgb
+        from sklearn.model_selection import train_test_split
+
+        encoded, mappings = frequency_encoding(pd.read_csv(args.path, usecols=columns), columns=columns)
+        x = encoded[columns[features]].to_numpy(dtype=np.float32)
+        y = encoded["sourcer_code"].to_numpy()
+        del encoded
+        x_train, x_val, y_train, y_val = train_test_split(x, y, test_size=0.1, random_state=597)
+        del x
+        model = xgb.XGBClassifier(**params, tree_method="hist", n_jobs=os.cpu_count())
+        model.fit(x_train, y_train)
+        accuracy = float((model.predict(x_val) == y_val).mean())
+    else:
+        from utils.model import external_memory_model
+        from utils.model import save_chunk
+
+        encoder = FrequencyEncoder(columns)
+        for chunk in iter_frames(args.path, fmt="csv", columns=columns, chunksize=args.chunksize):
+            encoder.partial_fit(categorical(chunk, columns))
+        encoder.finalize()
+
+        # Validation rows drawn as train.py --train_mode external does
+        rng = np.random.default_rng(597)
+        files = {"train": [], "val": []}
+        chunk_dir = tempfile.mkdtemp(dir=os.path.dirname(args.path))
+        for i, chunk in enumerate(iter_frames(args.path, fmt="csv", columns=columns, chunksize=args.chunksize)):
+            encoded = encoder.transform(categorical(chunk, columns))
+            x, y = encoded[columns[:-1]].to_numpy(dtype=np.float32), encoded["sourcer_code"].to_numpy()
+            val = rng.random(len(encoded)) < 0.1
+            for kind, rows in [("train", ~val), ("val", val)]:
+                files[kind].append(save_chunk(os.path.join(chunk_dir, f"{kind}_{i:05d}.npz"), x[rows], y[rows]))
+
+        model, accuracy = external_memory_model(files["train"], files["val"], features, columns[features], len(encoder.encoding_mappings["sourcer_code"]),
+                                                params, os.path.join(chunk_dir, "cache"))
+
+    print(json.dumps({"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb(), "accuracy": accuracy}))
+    sys.exit(0)
+
+import numpy as np
+from benchmark.synthetic import make_mrp_frame
+
+with tempfile.TemporaryDirectory() as tmp:
+    # Written chunk by chunk, so the file can be larger than the memory; the label is a range of colA categories, with noise
+    path = os.path.join(tmp, "train.csv")
+    for i, start in enumerate(range(0, args.rows, args.chunksize)):
+        frame = make_mrp_frame(min(args.chunksize, args.rows - start), cardinality=args.cardinality, n_classes=args.classes, seed=i, skew=1.0)
+        rng = np.random.default_rng(i)
+        signal = frame["colA"].str.split("_").str[1].astype(int) * args.classes // args.cardinality
+        noise = rng.random(len(frame)) < args.noise
+        frame["sourcer_code"] = np.where(noise, frame["sourcer_code"], "S" + signal.astype(str).str.zfill(5))
+        frame.to_csv(path, mode="a", header=i == 0, index=False)
+    file_mb = os.path.getsize(path) / 1024 ** 2
+
+    results = {}
+    for case in args.cases:
+        process = subprocess.run([sys.executable, "-m", "benchmark.bench_out_of_core", "--case", case, "--path", path, "--chunksize", str(args.chunksize),
+                                  "--n_estimators", str(args.n_estimators)], capture_output=True, text=True)
+        results[case] = json.loads(process.stdout.splitlines()[-1]) if process.returncode == 0 else None
+
+print(f"rows: {args.rows}, CSV: {file_mb:.0f} MB, classes: {args.classes}, chunksize: {args.chunksize}, n_estimators: {args.n_estimators}")
+for case, result in results.items():
+    if result is None:
+        print(f"{case:>10}: failed (out of memory?)")
+    else:
+        print(f"{case:>10}: {result['seconds']:7.1f} sec, peak RSS {result['peak_rss_mb']:7.0f} MB, accuracy {result['accuracy']:.4f}")
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+# Run this file with command: python -m benchmark.bench_startup --repeat 3 [--output startup.json]
+# Cold start of the step scripts on the no-new-data path (series_id -1), with python -X importtime
+
+parser = ArgumentParser()
+parser.add_argument("--steps", nargs="+", default=["train", "register_model", "predict", "output_db"])
+parser.add_argument("--repeat", type=int, default=3)  # Best of repeat runs
+parser.add_argument("--top", type=int, default=5)  # Slowest top-level imports shown per step
+parser.add_argument("--output", default=None)  # JSON result
+args = parser.parse_args()
+
+
+def top_level_imports(stderr: str) -> dict:
+    """Cumulative microseconds of each top-level import in the -X importtime output"""
+
+    imports = {}
+    for line in stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if m is not None and len(m[3]) == 1:  # One space: imported by the script itself
+            imports[m[4]] = int(m[2])
+
+    return imports
+
+
+results = {}
+with tempfile.TemporaryDirectory() as tmp:
+    series_id = os.path.join(tmp, "series_id")
+    os.makedirs(series_id)
+    with open(os.path.join(series_id, "series_id.txt"), "w") as f:
+        f.write("-1")
+
+    for step in args.steps:
+        arguments = ["--series_id", series_id, "--plant", "BENCH"]
+        if step != "register_model":
+            arguments += ["--mode", "qas"]
+        if step in ["train", "register_model"]:
+            arguments += ["--model_file", os.path.join(tmp, "model")]
+
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, "-X", "importtime", "-m", f"pipeline.{step}", *arguments], capture_output=True, text=True)
+            wall = time.perf_counter() - start
+            if process.returncode != 0:
+                raise RuntimeError(f"{step} failed: {process.stderr[-2000:]}")
+            if best is None or wall < best["wall_sec"]:
+                imports = top_level_imports(process.stderr)
+                best = {"wall_sec": wall, "import_sec": sum(imports.values()) / 1e6, "imports": imports}
+
+        results[step] = best
+        slowest = sorted(best["imports"].items(), key=lambda item: -item[1])[:args.top]
+        print(f"{step:>15}: {best['wall_sec']:.2f} sec wall, {best['import_sec']:.2f} sec imports, slowest: "
+              + ", ".join(f"{name} {us / 1e3:.0f} ms" for name, us in slowest))
+
+if args.output is not None:
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
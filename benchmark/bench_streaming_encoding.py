@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+# Run this file with command: python -m benchmark.bench_streaming_encoding --rows 2000000 --jobs 1 4
+# Training data encoded from a CSV file: loaded whole and frequency_encoding vs. chunked FrequencyEncoder (train.py --encoding_mode chunked).
+# Each case runs in its own process, for its peak RSS.
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, default=2_000_000)
+parser.add_argument("--cardinality", type=int, default=1000)
+parser.add_argument("--classes", type=int, default=2000)
+parser.add_argument("--chunksize", type=int, default=100_000)
+parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4])  # Threads of the chunked cases
+parser.add_argument("--case", default=None)  # Internal: run one case on --path and print its result
+parser.add_argument("--path", default=None)
+args = parser.parse_args()
+
+columns = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
+
+if args.case is not None:
+    import hashlib
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+    from utils.data_io import iter_frames
+    from utils.dtypes import categorical
+    from utils.instrumentation import peak_rss_mb
+    from utils.label_encoding import fit_frequency_encoder
+    from utils.label_encoding import frequency_encoding
+
+    start = time.perf_counter()
+    if args.case == "full":
+        encoded, mappings = frequency_encoding(pd.read_csv(args.path, usecols=columns), columns=columns)
+    else:
+        n_jobs = int(args.case.split("_")[1])
+        chunks = [categorical(chunk, columns) for chunk in iter_frames(args.path, fmt="csv", columns=columns, chunksize=args.chunksize)]
+        encoder = fit_frequency_encoder(chunks, columns, n_jobs=n_jobs)
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            encoded = pd.concat(executor.map(encoder.transform, chunks), ignore_index=True)
+        mappings = encoder.encoding_mappings
+
+    seconds = time.perf_counter() - start
+    digest = hashlib.sha256(pd.util.hash_pandas_object(encoded[columns], index=True).to_numpy().tobytes() + str(encoded.dtypes.tolist()).encode() + repr(mappings).encode())
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": peak_rss_mb(), "digest": digest.hexdigest()}))
+    sys.exit(0)
+
+from benchmark.synthetic import make_mrp_frame
+
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "train.csv")
+    make_mrp_frame(args.rows, cardinality=args.cardinality, n_classes=args.classes, skew=1.0).to_csv(path, index=False)
+
+    results = {}
+    for case in ["full"] + [f"chunked_{jobs}" for jobs in args.jobs]:
+        process = subprocess.run([sys.executable, "-m", "benchmark.bench_streaming_encoding", "--case", case, "--path", path, "--chunksize", str(args.chunksize)],
+                                 capture_output=True, text=True, check=True)
+        results[case] = json.loads(process.stdout.splitlines()[-1])
+
+print(f"rows: {args.rows}, cardinality: {args.cardinality}, classes: {args.classes}, chunksize: {args.chunksize}")
+for case, result in results.items():
+    same = "same output" if result["digest"] == results["full"]["digest"] else "OUTPUT DIFFERS"
+    print(f"{case:>12}: {result['seconds']:6.2f} sec, peak RSS {result['peak_rss_mb']:7.0f} MB, {same}")
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+
+# Run this file with command: python -m benchmark.bench_upload_pipeline --rows 1000000 --latency 0.5 --bandwidth 50
+# Uses the local datastore stand-in (utils/local_backend.py) with a simulated latency and bandwidth
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, default=1_000_000)
+parser.add_argument("--latency", type=float, default=0.5)  # Seconds per upload or registration
+parser.add_argument("--bandwidth", type=float, default=50)  # Upload MB/s, 0: unlimited
+parser.add_argument("--workers", type=int, default=3)
+parser.add_argument("--format", default="csv", choices=["csv", "parquet"])
+args = parser.parse_args()
+
+# The stand-ins read these at import
+root = tempfile.mkdtemp()
+os.environ.update({"PIPELINE_BACKEND": "local", "PIPELINE_LOCAL_ROOT": root,
+                   "PIPELINE_LOCAL_LATENCY": str(args.latency), "PIPELINE_LOCAL_BANDWIDTH": str(args.bandwidth)})
+
+from benchmark.synthetic import make_mrp_frame
+from utils.data_io import UploadPipeline
+from utils.data_io import register_frame
+from utils.data_io import write_frame
+from utils.local_backend import Workspace
+
+ws = Workspace(root)
+datastore = ws.get_default_datastore()
+
+# Preprocessed data and its split, as read_data.py exports them
+preprocessed = make_mrp_frame(args.rows, empty_ratio=0.3)
+frames = {
+    "preprocessed": preprocessed,
+    "train": preprocessed[preprocessed["sourcer_code"] != ''],
+    "inference": preprocessed[preprocessed["sourcer_code"] == ''],
+}
+ext = "csv" if args.format == "csv" else "parquet"
+
+# Current path: write, upload and register one file after the other
+start = time.perf_counter()
+for kind, df in frames.items():
+    path = os.path.join(root, "data", kind, f"seq_{kind}.{ext}")
+    write_frame(df, path, args.format)
+    register_frame(ws, datastore, path, kind, f"seq_{kind}", args.format)
+sequential_sec = time.perf_counter() - start
+
+# Upload pipeline: the three files are written, uploaded and registered concurrently
+start = time.perf_counter()
+with UploadPipeline(ws, datastore, max_workers=args.workers, fmt=args.format) as uploads:
+    for kind, df in frames.items():
+        uploads.write_and_register(df, os.path.join(root, "data", kind, f"par_{kind}.{ext}"), kind, f"par_{kind}")
+    uploads.wait()
+pipeline_sec = time.perf_counter() - start
+
+print(f"rows: {args.rows}, latency: {args.latency} sec, bandwidth: {args.bandwidth} MB/s")
+print(f"sequential: {sequential_sec:.2f} sec, upload pipeline ({args.workers} workers): {pipeline_sec:.2f} sec, speedup: {sequential_sec / pipeline_sec:.1f}x")
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import sys
+import tempfile
+import time
+import xgboost as xgb
+from argparse import ArgumentParser
+from datetime import datetime
+from benchmark.synthetic import FEATURE_COLUMNS
+from benchmark.synthetic import make_mrp_frame
+from utils.data_io import write_frame
+from utils.label_encoding import EncodingMappings
+from utils.label_encoding import frequency_encoding
+from utils.model import BoosterPredictor
+from utils.model import xgboost_model
+from utils.prediction import top_k_frame
+
+# Run this file with command: python -m benchmark.suite --rows 10000 100000 1000000 10000000 --output bench_results.json
+# Compare with a previous result: python -m benchmark.suite --rows 10000 100000 --baseline bench_results.json
+
+parser = ArgumentParser()
+parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000])
+parser.add_argument("--cardinality", type=int, default=1000)  # Categories per feature column
+parser.add_argument("--classes", type=int, default=2000)  # sourcer_code classes
+parser.add_argument("--skew", type=float, default=1.0)  # Zipf exponent of the category frequencies (0: uniform)
+parser.add_argument("--empty_ratio", type=float, default=0.3)  # Share of rows without sourcer_code
+parser.add_argument("--fit_rows", type=int, default=10_000)  # Rows and classes of xgboost_model and of the model used by the predict case,
+parser.add_argument("--fit_classes", type=int, default=20)  # the hyperparameter search does not scale to millions of rows and thousands of classes
+parser.add_argument("--search", default="staged", choices=["grid", "staged"])
+parser.add_argument("--chunksize", type=int, default=100_000)  # Predict in batches as predict.py --inference_mode chunked
+parser.add_argument("--top_k", type=int, default=3)
+parser.add_argument("--repeat", type=int, default=1)  # Best of repeat runs
+parser.add_argument("--cases", nargs="+", default=["encoding", "fit", "predict", "csv_export"])
+parser.add_argument("--output", default=None)  # JSON result, default: bench_results_<time>.json
+parser.add_argument("--baseline", default=None)  # JSON result of a previous run to compare with
+parser.add_argument("--tolerance", type=float, default=0.2)  # Slowdown reported as a regression, 0.2: 20% slower
+args = parser.parse_args()
+
+columns = FEATURE_COLUMNS + ["sourcer_code"]
+features = ["colA", "colB", "colC", "colD", "colE"]  # Model 1
+
+
+def best_time(function, repeat):
+    """Fastest of repeat calls"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def make_frame(n_rows, seed, n_classes=args.classes):
+    return make_mrp_frame(n_rows, cardinality=args.cardinality, n_classes=n_classes, seed=seed, skew=args.skew, empty_ratio=args.empty_ratio)
+
+
+def fit_frame():
+    """Encoded training rows (with a sourcer_code) of fit_rows rows and fit_classes classes, and their mappings"""
+
+    train = make_frame(2 * args.fit_rows, seed=1, n_classes=args.fit_classes)
+    train = train[train["sourcer_code"] != ''].head(args.fit_rows).reset_index(drop=True)
+
+    return frequency_encoding(train, columns=columns)
+
+
+def predict_path(inference, mappings, predictor, lookup):
+    """Encode, predict and decode the top k in batches, as predict_batch of predict.py does for model 1"""
+
+    results = []
+    for start in range(0, len(inference), args.chunksize):
+        batch = mappings.transform(inference.iloc[start:start + args.chunksize][features].copy(), columns=features)
+        proba = predictor.predict_proba(batch)
+        results.append(top_k_frame(proba, lookup, classes=predictor.classes_, k=args.top_k))
+
+    return pd.concat(results, ignore_index=True)
+
+
+results = []
+
+def record(case, n_rows, seconds):
+    results.append({"case": case, "rows": n_rows, "seconds": seconds, "rows_per_sec": n_rows / max(seconds, 1e-9)})
+    print(f"{case:>12} {n_rows:>10} rows: {seconds:8.3f} sec ({n_rows / max(seconds, 1e-9):,.0f} rows/sec)")
+
+
+# The model and mappings of the predict case, fitted once
+if "predict" in args.cases or "fit" in args.cases:
+    train, encoding_mappings = fit_frame()
+    mappings = EncodingMappings.from_dict(encoding_mappings)
+    model = xgb.XGBClassifier(n_estimators=50, max_depth=5).fit(train[features], train["sourcer_code"])
+    predictor = BoosterPredictor.from_classifier(model)
+    lookup = mappings.label_lookup("sourcer_code")
+
+for n_rows in args.rows:
+    frame = make_frame(n_rows, seed=2)
+
+    if "encoding" in args.cases:
+        record("encoding", n_rows, best_time(lambda: frequency_encoding(frame.copy(), columns=columns), args.repeat))
+
+    if "fit" in args.cases and n_rows == min(args.rows):
+        # Same training set at every size, timed once
+        x = train[features]
+        y = train["sourcer_code"]
+        split = int(len(train) * 0.9)
+        record("fit", len(train), best_time(lambda: xgboost_model(x[:split], y[:split], x[split:], y[split:], search=args.search), args.repeat))
+
+    if "predict" in args.cases:
+        record("predict", n_rows, best_time(lambda: predict_path(frame, mappings, predictor, lookup), args.repeat))
+
+    if "csv_export" in args.cases:
+        with tempfile.TemporaryDirectory() as tmp:
+            record("csv_export", n_rows, best_time(lambda: write_frame(frame, os.path.join(tmp, "result.csv"), fmt="csv"), args.repeat))
+
+    del frame
+
+output = {
+    "created": datetime.now().isoformat(timespec="seconds"),
+    "environment": {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "xgboost": xgb.__version__,
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+    },
+    "parameters": {k: v for k, v in vars(args).items() if k not in ["output", "baseline"]},
+    "results": results,
+}
+
+path = args.output or f"bench_results_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+with open(path, "w") as f:
+    json.dump(output, f, indent=2)
+print(f"Results saved to {path}")
+
+# Compare the cases and sizes measured in both runs
+if args.baseline is not None:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    changed = [k for k in ["cardinality", "classes", "skew", "empty_ratio", "fit_rows", "fit_classes", "search", "chunksize", "top_k"]
+               if baseline["parameters"].get(k) != output["parameters"][k]]
+    if changed:
+        print(f"Warning: parameters differ from the baseline: {', '.join(changed)}")
+
+    previous = {(r["case"], r["rows"]): r["seconds"] for r in baseline["results"]}
+    regressions = 0
+    for r in results:
+        if (r["case"], r["rows"]) in previous:
+            ratio = r["seconds"] / max(previous[(r["case"], r["rows"])], 1e-9)
+            regression = ratio > 1 + args.tolerance
+            regressions += regression
+            print(f"{r['case']:>12} {r['rows']:>10} rows: {ratio:5.2f}x baseline{'  REGRESSION' if regression else ''}")
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic mrp_sourcer_code-like data for benchmarks
+
+FEATURE_COLUMNS = ["colA", "colB", "colC", "colD", "colE", "colF", "colG"]
+
+def _draw(rng, n_categories: int, n_rows: int, skew: float) -> np.ndarray:
+    """Category positions, uniform if skew is 0, else Zipf-like: category i is drawn with a weight of 1 / (i + 1) ** skew"""
+
+    if skew == 0:
+        return rng.integers(0, n_categories, n_rows)
+
+    weights = 1 / np.arange(1, n_categories + 1) ** skew
+    return rng.choice(n_categories, size=n_rows, p=weights / weights.sum())
+
+def make_mrp_frame(n_rows: int, cardinality: int = 1000, n_classes: int = 2000, seed: int = 597,
+                   skew: float = 0.0, empty_ratio: float = 0.0, categorical: bool = False) -> pd.DataFrame:
+    """
+        Create a frame with string categories in colA-colG and sourcer_code.
+        skew: Zipf exponent of the category and class frequencies (0: uniform)
+        empty_ratio: share of rows whose sourcer_code is '' (inference rows of read_data.py)
+        categorical: colA-colG as category dtype (as read from Parquet) instead of object
+    """
+
+    rng = np.random.default_rng(seed)
+    data = {}
+
+    for col in FEATURE_COLUMNS:
+        categories = np.array([f"{col}_{i}" for i in range(cardinality)], dtype=object)
+        data[col] = categories[_draw(rng, cardinality, n_rows, skew)]
+        if categorical:
+            data[col] = pd.Categorical(data[col])
+
+    classes = np.array([f"S{i:05d}" for i in range(n_classes)], dtype=object)
+    data["sourcer_code"] = classes[_draw(rng, n_classes, n_rows, skew)]
+    if empty_ratio > 0:
+        data["sourcer_code"][rng.random(n_rows) < empty_ratio] = ''
+
+    return pd.DataFrame(data)
@@ -1,27 +1,85 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+from configparser import ConfigParser
+
+# Loggers write to a queue, a background thread (QueueListener) writes the records to the console and a size-rotated file,
+# whose tail Connection.read_log_file_and_upload_to_DB ships to the DB.
+
+# Read config
+config = ConfigParser()
+config.read('config.ini')
+
+LOG_DIR = './logs'
+MAX_BYTES = config.getint('logging', 'max_bytes', fallback=10 * 1024 * 1024)
+BACKUP_COUNT = config.getint('logging', 'backup_count', fallback=5)
+
+fmt = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'  #'[%(asctime)s] [%(process)d] [%(levelname)s] [%(name)s] %(message)s'
+datefmt = '%Y-%m-%d %H:%M:%S %z'
+
+
+_lock = threading.Lock()
+_queue_handlers = {}  # filename -> QueueHandler feeding the listener of that file
+_listeners = []
+
+
+def _queue_handler(filename: str) -> logging.Handler:
+    """QueueHandler of a log file, created with its listener thread on first use"""
+
+    with _lock:
+        if filename not in _queue_handlers:
+            formatter = logging.Formatter(fmt, datefmt)
+
+            ch = logging.StreamHandler()
+            ch.setLevel(logging.DEBUG)
+
+            os.makedirs(LOG_DIR, exist_ok=True)
+            fh = logging.handlers.RotatingFileHandler(filename=os.path.join(LOG_DIR, filename + '.log'), maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+            fh.setLevel(logging.DEBUG)
+
+            for handler in [ch, fh]:
+                handler.setFormatter(formatter)
+
+            log_queue = queue.Queue(-1)
+            listener = logging.handlers.QueueListener(log_queue, ch, fh, respect_handler_level=True)
+            listener.start()
+            _listeners.append(listener)
+
+            _queue_handlers[filename] = logging.handlers.QueueHandler(log_queue)
+
+        return _queue_handlers[filename]
+
 
 def getLogger(name:str, filename="predict_classification"):
-    """Create a logger with the given name and filename."""
-    
-    logger = logging.getLogger(__name__)
+    """Create a logger with the given name and filename, calling it again returns the same logger without adding handlers."""
+
+    logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
+    logger.propagate = False  # Written once, by the queue listener, not again by the handlers of the root logger
+
+    handler = _queue_handler(filename)
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+
+    return logger
 
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
 
-    os.makedirs('./logs', exist_ok=True)
-    fh = logging.FileHandler(filename='./logs/' + filename + '.log')
-    fh.setLevel(logging.DEBUG)
+def flush():
+    """Wait until the listeners have written every queued record"""
 
-    fmt = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'  #'[%(asctime)s] [%(process)d] [%(levelname)s] [%(name)s] %(message)s'
-    datefmt = '%Y-%m-%d %H:%M:%S %z'
-    formatter = logging.Formatter(fmt, datefmt)
+    for handler in list(_queue_handlers.values()):
+        handler.queue.join()  # The listener marks each record done once handled
 
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
 
-    logger.addHandler(ch)
-    logger.addHandler(fh)
+@atexit.register
+def shutdown():
+    """Stop the listener threads, writing the remaining records"""
 
-    return logger
\ No newline at end of file
+    with _lock:
+        for listener in _listeners:
+            listener.stop()
+        _listeners.clear()
+        _queue_handlers.clear()
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+import logger
+import runpy
+import sys
+import time
+from argparse import ArgumentParser
+from azure_ml_pipeline import STEPS
+from azure_ml_pipeline import step_arguments
+from utils.handoff import clear
+from utils.handoff import enable
+
+# Run this file with command: python -m pipeline.fused --steps read_data,train,register_model,predict,output_db --plant <plant_code> --series_id <dir> --model_file <dir> --mode <mode>
+# Runs several step scripts one after the other in this process: the environment, imports, workspace and DB engine are set up once,
+# and frames, models and encoding mappings are handed over in memory (utils/handoff.py) instead of being downloaded again
+
+myLogger = logger.getLogger(__name__)
+
+# Read parameters
+parser = ArgumentParser()
+parser.add_argument("--steps", default=",".join(STEPS))  # Step scripts to run, comma-separated, in pipeline order
+parser.add_argument('--plant', required=True)
+parser.add_argument("--series_id", required=True)
+parser.add_argument("--model_file", default=None)  # Required by train and register_model
+parser.add_argument("--mode", default=None)  # Required by all steps but register_model
+parser.add_argument("--step_args", nargs="*", default=[])  # Further arguments of a step, e.g. --step_args "train=--search staged" "predict=--engine sklearn"
+args = parser.parse_args()
+
+steps = [step.strip() for step in args.steps.split(",") if step.strip()]
+unknown = [step for step in steps if step not in STEPS]
+if unknown:
+    parser.error(f"Unknown steps: {', '.join(unknown)}")
+
+extra_arguments = {}
+for item in args.step_args:
+    step, _, arguments = item.partition("=")
+    extra_arguments[step] = arguments.split()
+
+enable()
+
+timings = {}
+start = time.perf_counter()
+for step in steps:
+    myLogger.info(f"Running step {step}...")
+    step_start = time.perf_counter()
+
+    # Run the script as python -m pipeline.<step> would, its early exit (no new data) ends the step only
+    sys.argv = [f"pipeline/{step}.py", *step_arguments(step, args.series_id, args.plant, args.mode, args.model_file), *extra_arguments.get(step, [])]
+    try:
+        runpy.run_module(f"pipeline.{step}", run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        if e.code not in [None, 0]:
+            raise
+
+    timings[step] = time.perf_counter() - step_start
+
+clear()
+timings["total"] = time.perf_counter() - start
+myLogger.info("Fused steps done: " + ", ".join(f"{name} {seconds:.1f} sec" for name, seconds in timings.items()))
@@ -1,35 +1,24 @@
 #!/usr/bin/python3
 import logger
-import psycopg2
-import psycopg2.extras as extras
+import sys
 from argparse import ArgumentParser
-from azureml.core import Dataset
-from azureml.core.run import Run
-from configparser import ConfigParser
 from datetime import datetime
-from utils.connection import Connection
 
-# Run this file with command: python -m pipeline.upload_db --plant <plant_code>
+# Run this file with command: python -m pipeline.output_db --plant <plant_code>
 
 myLogger = logger.getLogger(__name__)
 
 cur_time = datetime.now()
 myLogger.info(f"Start uploading data to DB, current_time: {cur_time}")
 
-# Connect to Workspace
-run = Run.get_context().parent
-ws = run.experiment.workspace
-
 # Read parameters
 parser = ArgumentParser()
 parser.add_argument('--plant', required=True)
 parser.add_argument("--series_id", required=True)
 parser.add_argument("--mode", required=True)
+parser.add_argument('--profile', default="none", choices=["none", "cprofile", "pyinstrument"])  # Profile the step, saved in ./logs/profiles
 args = parser.parse_args()
 
-# Connect to DB
-conn = Connection(args.mode)
-
 # Load series ID
 with open(args.series_id + "/series_id.txt") as f:
     for i, line in enumerate(f):
@@ -37,23 +26,59 @@ with open(args.series_id + "/series_id.txt") as f:
         series_id = int(line.split("\n")[0])
         break
 
-# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process
-if series_id != -1:
-    # Read config
-    config = ConfigParser()
-    config.read('config.ini')
+# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process,
+# so the no-new-data path exits before the heavy imports and the workspace and DB connections
+if series_id == -1:
+    myLogger.info("There is no new data.")
+    sys.exit(0)
+
+from configparser import ConfigParser
+from utils.backend import Run
+from utils.connection import shared_connection
+from utils.data_io import load_frame
+from utils.instrumentation import StepMetrics
+from utils.instrumentation import frame_memory
+from utils.instrumentation import phase
+
+# Connect to Workspace
+run = Run.get_context().parent
+ws = run.experiment.workspace
+
+# Connect to DB
+conn = shared_connection(args.mode)
+
+# Read config
+config = ConfigParser()
+config.read('config.ini')
+
+# Phase metrics of this step
+metrics = StepMetrics("output_db", args.plant, run=Run.get_context(), profile=args.profile).start()
 
-    conn.update_ai_process(series_id, "Upload to DB")
+conn.open_session()  # Hold one DB connection for all status updates of this step
+conn.update_ai_process(series_id, "Upload to DB", critical=False)  # Progress, written in the background
 
-    # Read result
-    myLogger.info("Reading predicting result...")
-    dataset = Dataset.get_by_name(workspace=ws, name=f"{args.plant}_result")
-    pred_result = dataset.to_pandas_dataframe()
+# Read result
+myLogger.info("Reading predicting result...")
+def_blob_store = ws.get_default_datastore()
+with phase("load_data") as p:
+    pred_result = load_frame(ws, def_blob_store, f"{args.plant}_result", "result", args.plant)
+    p["rows"] = len(pred_result)
+frame_memory("pred_result", pred_result)
 
-    # Upload data to DB
-    # ...
+# Upload data to DB, replacing the rows of a previous upload of the same series_id
+myLogger.info(f"Uploading {len(pred_result)} rows...")
+pred_result["series_id"] = series_id
+with phase("db_upload", rows=len(pred_result)):
+    uploaded = conn.upsert_dataframe(pred_result,
+                                     table=config.get('output', 'result_table'),
+                                     key="series_id",
+                                     method=config.get('output', 'upload_method', fallback="copy"),
+                                     chunksize=config.getint('output', 'upload_chunksize', fallback=100000))
 
-    conn.update_ai_process(series_id, "Y")
-    conn.update_analysis_console(series_id, "data_ready", "Y")
-    conn.update_analysis_console(series_id, "ai_process_end_datetime", datetime.now())
-    myLogger.info("DB connecting closed...")
\ No newline at end of file
+if uploaded is None:
+    conn.update_ai_process(series_id, "Upload to DB failed")
+else:
+    conn.update_status(series_id, ai_process="Y", data_ready="Y", ai_process_end_datetime=datetime.now())
+conn.close_session()
+myLogger.info("DB connecting closed...")
+metrics.finish()
@@ -1,14 +1,7 @@
 #!/usr/bin/python3
-import joblib
 import logger
-import numpy as np
-import os
-import pandas as pd
-from azureml.core import Dataset
-from azureml.core.model import Model
-from azureml.core.run import Run
+import sys
 from argparse import ArgumentParser
-from utils.connection import Connection
 
 # Run this file with command: python -m pipeline.predict --plant <plant_code>
 
@@ -19,11 +12,14 @@ parser = ArgumentParser()
 parser.add_argument('--plant', required=True)
 parser.add_argument("--series_id", required=True)
 parser.add_argument("--mode", required=True)
+parser.add_argument("--top_k", type=int, default=3)  # Number of predictions per row
+parser.add_argument("--inference_mode", default="full", choices=["full", "chunked"])  # Predict the whole inference data at once or in batches
+parser.add_argument("--chunksize", type=int, default=100000)  # Rows per batch in chunked mode
+parser.add_argument("--engine", default="native", choices=["native", "sklearn"])  # native: predict with the XGBoost booster on float32 arrays, sklearn: XGBClassifier.predict_proba
+parser.add_argument("--n_threads", type=int, default=None)  # Prediction threads of the native engine (default: all cores)
+parser.add_argument('--profile', default="none", choices=["none", "cprofile", "pyinstrument"])  # Profile the step, saved in ./logs/profiles
 args = parser.parse_args()
 
-# Connect to DB
-conn = Connection(args.mode)
-
 # Load series ID
 with open(args.series_id + "/series_id.txt") as f:
     for i, line in enumerate(f):
@@ -31,96 +27,185 @@ with open(args.series_id + "/series_id.txt") as f:
         series_id = int(line.split("\n")[0])
         break
 
-# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process
-if series_id != -1:
-    # Connect to Workspace
-    run = Run.get_context().parent
-    ws = run.experiment.workspace
+# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process,
+# so the no-new-data path exits before the heavy imports and the workspace and DB connections
+if series_id == -1:
+    myLogger.info("There is no new data.")
+    sys.exit(0)
 
-    # Connect to Azure Blob Storage
-    def_blob_store = ws.get_default_datastore()
+import pandas as pd
+import time
+from configparser import ConfigParser
+from utils.artifact_cache import cached_mappings
+from utils.artifact_cache import cached_model
+from utils.artifact_cache import cached_predictor
+from utils.artifact_cache import get_cache
+from utils.backend import Run
+from utils.connection import shared_connection
+from utils.data_io import FEATURE_COLUMNS
+from utils.data_io import FrameWriter
+from utils.data_io import download_frame
+from utils.data_io import iter_frames
+from utils.data_io import load_frame
+from utils.data_io import local_path
+from utils.data_io import register_frame
+from utils.data_io import write_frame
+from utils.dtypes import categorical
+from utils.handoff import hand_over
+from utils.handoff import take
+from utils.instrumentation import StepMetrics
+from utils.instrumentation import frame_memory
+from utils.instrumentation import phase
+from utils.model import BoosterPredictor
+from utils.prediction import prediction_columns
+from utils.prediction import top_k_frame
+
+# Read config
+config = ConfigParser()
+config.read('config.ini')
 
-    conn.update_ai_process(series_id, "Predicting inference")
+# Connect to DB
+conn = shared_connection(args.mode)
+
+# Connect to Workspace
+run = Run.get_context().parent
+ws = run.experiment.workspace
+
+# Connect to Azure Blob Storage
+def_blob_store = ws.get_default_datastore()
+
+# Phase metrics of this step
+metrics = StepMetrics("predict", args.plant, run=Run.get_context(), profile=args.profile).start()
+
+conn.open_session()  # Hold one DB connection for all status updates of this step
+try:
+    conn.update_ai_process(series_id, "Predicting inference", critical=False)  # Progress, written in the background
+
+    # Read label encoding mappings (memory-mapped), from the local artifact cache if they did not change since the last run
+    with phase("load_mappings"):
+        mappings = take(f"{args.plant}_encoding_mappings")  # Fused steps: the mappings train.py just used
+        if mappings is None:
+            mappings = cached_mappings(ws, def_blob_store, args.plant)
+
+    # Lookup table from encoded to original sourcer_code
+    sourcer_code_lookup = mappings.label_lookup("sourcer_code")
+
+    # Models are loaded on first use and kept for all batches (and for the next plants predicted in this process)
+    models = {}
+
+    def load_model(model_name):
+        if model_name not in models:
+            with phase("load_model"):
+                model = take(model_name)  # Fused steps: the model train.py just saved
+                if model is not None:
+                    models[model_name] = BoosterPredictor.from_classifier(model, n_threads=args.n_threads) if args.engine == "native" else model
+                elif args.engine == "native":
+                    models[model_name] = cached_predictor(ws, model_name, n_threads=args.n_threads)
+                else:
+                    models[model_name] = cached_model(ws, model_name)
+
+        return models[model_name]
+
+    def predict_batch(inference_raw: pd.DataFrame) -> pd.DataFrame:
+        """Encode a batch of inference data, route its rows to model 1 or model 2 and return them with the top k predictions"""
+
+        # Apply label encoding using the loaded mappings, if not mapped then apply -1 (only the features, the raw batch is kept as is)
+        with phase("encoding", rows=len(inference_raw)):
+            categorical(inference_raw, FEATURE_COLUMNS)  # Raw features kept in the result as categoricals, encoded once per category
+            inference = mappings.transform(inference_raw[FEATURE_COLUMNS].copy(), columns=FEATURE_COLUMNS)
+        frame_memory("inference_raw", inference_raw)
+        frame_memory("inference", inference)
+
+        # Split inference if columns colA, colB are NAs
+        inference_1 = inference[(inference["colA"]!=-1) & (inference["colB"]!=-1)]
+        inference_2 = inference[(inference["colA"]==-1) & (inference["colB"]==-1)]
+
+        # Create empty dataframe
+        result_1 = pd.DataFrame()
+        result_2 = pd.DataFrame()
+
+        # Predict: case 1 - with colA, colB
+        if not inference_1.empty:
+            myLogger.info("Loading model with component types...")
+            model = load_model(f"{args.plant}_model.joblib")
+
+            myLogger.info("Predicting case 1 - with colA, colB...")
+            inference_1 = inference_1[["colA", "colB", "colC", "colD", "colE"]]  # Features of model 1
+
+            # Top k predictions, decoded to the original sourcer_code
+            with phase("predict", rows=len(inference_1)):
+                pred_y = model.predict_proba(inference_1)
+            with phase("top_k", rows=len(inference_1)):
+                pred_top_k = top_k_frame(pred_y, sourcer_code_lookup, classes=model.classes_, k=args.top_k)
+            result = inference_raw.loc[inference_1.index, :].reset_index(drop=True)
+
+            result_1 = pd.concat([result, pred_top_k], axis=1)
+
+        # Predict: case 2 - no colA, colB
+        if not inference_2.empty:
+            myLogger.info("Loading model without component types...")
+            model_no_comp = load_model(f"{args.plant}_model_no_comp.joblib")
+
+            myLogger.info("Predicting case 2 - no colA, colB...")
+            inference_2 = inference_2[["colC", "colD", "colE", "colF", "colG"]]  # Features of model 2
+
+            # Top k predictions, decoded to the original sourcer_code
+            with phase("predict", rows=len(inference_2)):
+                pred_y = model_no_comp.predict_proba(inference_2)
+            with phase("top_k", rows=len(inference_2)):
+                pred_top_k = top_k_frame(pred_y, sourcer_code_lookup, classes=model_no_comp.classes_, k=args.top_k)
+            result = inference_raw.loc[inference_2.index, :].reset_index(drop=True)
+
+            result_2 = pd.concat([result, pred_top_k], axis=1)
+
+        # Combine case 1 and case 2
+        return pd.concat([result_1, result_2], axis=0)
 
     # Read inference data
     myLogger.info("Reading inference data...")
-    dataset = Dataset.get_by_name(workspace=ws, name=f"{args.plant}_inference_data")
-    inference_raw = dataset.to_pandas_dataframe()
-    inference = inference_raw.copy()
-
-    # Read label encoding mappings
-    def_blob_store.download(target_path=f'.', prefix=f"label_encoding/{args.plant}_encoding_mappings.npy", overwrite=True)
-    encoding_mappings = np.load(f"label_encoding/{args.plant}_encoding_mappings.npy", allow_pickle=True).item()
-
-    # Apply label encoding using the loaded mappings, if not mapped then apply -1
-    myLogger.info("Label encoding inference data...")
-    for column in encoding_mappings.keys():
-        inference[column] = inference[column].apply(lambda x: encoding_mappings[column].get(x, -1))
-
-    # Split inference if columns colA, colB are NAs
-    inference_1 = inference[(inference["colA"]!=-1) & (inference["colB"]!=-1)]
-    inference_2 = inference[(inference["colA"]==-1) & (inference["colB"]==-1)]
-
-    # Create empty dataframe
-    result_1 = pd.DataFrame()
-    result_2 = pd.DataFrame()
-
-    # Predict: case 1 - with colA, colB
-    if not inference_1.empty:
-        myLogger.info("Loading model with component types...")
-        path = Model.get_model_path(f"{args.plant}_model.joblib", _workspace=ws) 
-        model = joblib.load(path+f"/{args.plant}_model.joblib")
-
-        myLogger.info("Predicting case 1 - with colA, colB...")
-        inference_1 = inference_1[["colA", "colB", "colC", "colD", "colE"]]  # Features of model 1
-
-        # Top 3 predictions
-        pred_y = model.predict_proba(inference_1)
-        pred_top3 = pd.DataFrame(np.argsort(pred_y, axis=1)[:, -3:][:, ::-1], columns=[f"prediction{i+1}" for i in range(3)])
-        result = inference_raw.iloc[inference_1.index, :].copy().reset_index(drop=True)
-        print(result.head())
-
-        result_1 = pd.concat([result, pred_top3], axis=1)
-
-    # Predict: case 2 - no colA, colB
-    if not inference_2.empty:
-        myLogger.info("Loading model without component types...")
-        path = Model.get_model_path(f"{args.plant}_model_no_comp.joblib", _workspace=ws) 
-        model_no_comp = joblib.load(path+f"/{args.plant}_model_no_comp.joblib")
-
-        myLogger.info("Predicting case 2 - no colA, colB...")
-        inference_2 = inference_2[["colC", "colD", "colE", "colF", "colG"]]  # Features of model 2
-
-        # Top 3 predictions
-        pred_y = model_no_comp.predict_proba(inference_2)
-        pred_top3 = pd.DataFrame(np.argsort(pred_y, axis=1)[:, -3:][:, ::-1], columns=[f"prediction{i+1}" for i in range(3)])
-        result = inference_raw.iloc[inference_2.index, :].copy().reset_index(drop=True)
-        print(result.head())
-
-        result_2 = pd.concat([result, pred_top3], axis=1)
-
-    # Combine case 1 and case 2
-    myLogger.info("Final result:")
-    final_result = pd.concat([result_1, result_2], axis=0)
-
-    # Replace sourcer_code with the original value using encoding_mappings, from values to keys
-    reverse_mapping = {v: k for k, v in encoding_mappings["sourcer_code"].items()}  # Reverse dictionary
-
-    for col in ["prediction1", "prediction2", "prediction3"]:
-        final_result[col] = final_result[col].replace(reverse_mapping)
-    myLogger.info(final_result.head())
-
-    # Save to data/result
-    os.makedirs("./data/result", exist_ok=True)
-    path = f"./data/result/{args.plant}_result.csv"
-    final_result.to_csv(path, index=False)
-
-    # Upload to blob storage
-    def_blob_store.upload_files(files=[path], target_path="result", overwrite=True)
-
-    # Register dataset
-    tabular = Dataset.Tabular.from_delimited_files(def_blob_store.path(f"./result/{args.plant}_result.csv"))  # Different with local path
-    df_register = tabular.register(workspace=ws, name=f"{args.plant}_result", create_new_version=True)
+    result_columns = [c.strip() for c in config.get('data', 'result_columns', fallback='').split(",") if c.strip()]
+    columns = list(dict.fromkeys(FEATURE_COLUMNS + result_columns)) if result_columns else None  # Features and the columns kept in the result
+    path = local_path("result", args.plant)
+
+    if args.inference_mode == "chunked":
+        # Predict batch by batch and append each result to the output file, so memory does not grow with the plant size
+        batches = iter_frames(download_frame(def_blob_store, "inference", args.plant), columns=columns, chunksize=args.chunksize)
+        raw_columns = columns
+        with FrameWriter(path) as writer:
+            for i, inference_raw in enumerate(batches):
+                raw_columns = list(inference_raw.columns)
+                start = time.perf_counter()
+                result = predict_batch(inference_raw)
+                if not result.empty:  # Batches without predictable rows would write a header without columns
+                    with phase("write", rows=len(result)):
+                        writer.write(result)
+                elapsed = time.perf_counter() - start
+                myLogger.info(f"Batch {i}: {len(inference_raw)} rows in {elapsed:.2f} sec ({len(inference_raw) / max(elapsed, 1e-9):,.0f} rows/sec), {writer.rows} result rows so far")
+
+            if writer.rows == 0:  # No predictable rows: an empty result, with the header (CSV) or the schema (Parquet) of a result
+                writer.write(pd.DataFrame(columns=(raw_columns or []) + prediction_columns(args.top_k)))
+
+    else:
+        with phase("load_data") as p:
+            inference_raw = load_frame(ws, def_blob_store, f"{args.plant}_inference_data", "inference", args.plant, columns=columns)
+            p["rows"] = len(inference_raw)
+
+        myLogger.info("Final result:")
+        final_result = predict_batch(inference_raw)
+        frame_memory("result", final_result)
+        myLogger.info(final_result.head())
+
+        # Save to data/result
+        with phase("write", rows=len(final_result)):
+            write_frame(final_result, path)
+        hand_over(f"{args.plant}_result", final_result)  # Fused steps: output_db uploads it without downloading
+
+    # Upload to blob storage and register dataset
+    register_frame(ws, def_blob_store, path, "result", f"{args.plant}_result")
 
     myLogger.info("Predicted data have been stored.")
-    conn.update_ai_process(series_id, "Predicting inference done")
\ No newline at end of file
+    myLogger.info(get_cache().stats())
+    conn.update_ai_process(series_id, "Predicting inference done")
+finally:
+    conn.close_session()
+    metrics.finish()
@@ -1,14 +1,26 @@
 #!/usr/bin/python3
 import json
+import numpy as np
 import os
 import pandas as pd
 import logger
 from argparse import ArgumentParser
-from azureml.core import Dataset
-from azureml.core.run import Run
+from configparser import ConfigParser
 from datetime import datetime
 from datetime import timedelta
-from utils.connection import Connection
+from utils.connection import shared_connection
+from utils.data_io import FEATURE_COLUMNS
+from utils.data_io import FrameWriter
+from utils.data_io import UploadPipeline
+from utils.data_io import local_path
+from utils.dtypes import categorical
+from utils.fingerprint import frame_fingerprint
+from utils.fingerprint import row_hashes
+from utils.fingerprint import write_fingerprint
+from utils.handoff import hand_over
+from utils.instrumentation import StepMetrics
+from utils.instrumentation import frame_memory
+from utils.instrumentation import phase
 
 # Run this file with command: python -m pipeline.read_data --plant <plant_code>
 
@@ -17,20 +29,110 @@ parser = ArgumentParser()
 parser.add_argument('--plant', required=True)
 parser.add_argument("--series_id", required=True)
 parser.add_argument('--mode', required=True)
+parser.add_argument('--fetch_mode', default="full", choices=["full", "stream"])  # Fetch the whole table at once or in chunks through a server-side cursor
+parser.add_argument('--profile', default="none", choices=["none", "cprofile", "pyinstrument"])  # Profile the step, saved in ./logs/profiles
 args = parser.parse_args()
 
 # Logger
 myLogger = logger.getLogger(__name__)
 
-# Connect to Workspace
-run = Run.get_context().parent
-ws = run.experiment.workspace
+# Phase metrics of this step, sent to the run once the workspace is connected
+metrics = StepMetrics("read_data", args.plant, profile=args.profile).start()
 
-# Connect to Azure Blob Storage
-def_blob_store = ws.get_default_datastore()
+# Connect to DB, holding one connection for all queries and status updates of this step
+conn = shared_connection(args.mode)
+conn.open_session()
 
-# Connect to DB
-conn = Connection(args.mode)
+# Read config
+config = ConfigParser()
+config.read('config.ini')
+
+
+def connect_workspace():
+    """Connect to the workspace and its blob storage, only when there are new data (azureml is slow to import)"""
+
+    global ws, def_blob_store
+    from utils.backend import Run
+
+    # Connect to Workspace
+    run = Run.get_context()
+    ws = run.parent.experiment.workspace
+    metrics.run = run
+
+    # Connect to Azure Blob Storage
+    def_blob_store = ws.get_default_datastore()
+
+
+def preprocess(mrp_sourcer_code: pd.DataFrame, date: str) -> pd.DataFrame:
+    """Data preprocessing step, applied to the whole table or to one chunk of it"""
+
+    # ...
+    mrp_preprocessed = ...
+
+    return mrp_preprocessed
+
+
+def split_train_inference(mrp_preprocessed: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    """Split into training and inference data (sourcer code is not NULL)"""
+
+    train = mrp_preprocessed.loc[mrp_preprocessed["sourcer_code"] != '', :].copy()
+    inference = mrp_preprocessed.loc[mrp_preprocessed["sourcer_code"] == '', :]
+
+    # Keep the first sourcer code only
+    train.loc[:, "sourcer_code"] = train["sourcer_code"].apply(lambda x: x.split(";")[0])
+
+    return train, inference
+
+
+def stream_prepare_data(plant, mrp_run_date, batch_id, post_datetime, date) -> int:
+    """Fetch, preprocess and split chunk by chunk, appending each chunk to the output files. Return the number of inference rows."""
+
+    columns = [c.strip() for c in config.get('data', 'columns', fallback='').split(",") if c.strip()]
+    chunksize = config.getint('data', 'chunksize', fallback=100000)
+    writers = {kind: FrameWriter(local_path(kind, plant)) for kind in ["preprocessed", "train", "inference"]}
+
+    n_rows = 0
+    train_hashes = []
+    chunks = conn.stream_mrp_sourcer_code_table(plant, mrp_run_date, batch_id, post_datetime, columns=columns, chunksize=chunksize)
+    for i, chunk in enumerate(chunks):
+        # Continue the row numbers of the previous chunks, as reset_index() of the whole table would
+        chunk.index = pd.RangeIndex(n_rows, n_rows + len(chunk))
+        n_rows += len(chunk)
+
+        with phase("preprocessing", rows=len(chunk)):
+            mrp_preprocessed = preprocess(chunk, date).reset_index()
+            train, inference = split_train_inference(mrp_preprocessed)
+        frame_memory("chunk", mrp_preprocessed)
+
+        with phase("write", rows=len(mrp_preprocessed)):
+            writers["preprocessed"].write(mrp_preprocessed)
+            writers["train"].write(train)
+            train_hashes.append(row_hashes(train))
+            writers["inference"].write(inference)
+
+        myLogger.info(f"Chunk {i}: {n_rows} rows processed")
+
+    for writer in writers.values():
+        writer.close()
+
+    # No rows streamed, so no file was written: the next steps are skipped, as for an empty control table
+    if n_rows == 0:
+        myLogger.info("There is no new data.")
+        with open(args.series_id + "/series_id.txt", 'w') as f:
+            f.write("-1")
+        return 0
+
+    # Fingerprint of the training data for train.py
+    write_fingerprint(args.series_id, frame_fingerprint(np.concatenate(train_hashes) if train_hashes else np.empty(0, dtype=np.uint64)))
+
+    # Upload and register the three files in parallel
+    with UploadPipeline(ws, def_blob_store) as uploads:
+        uploads.register(writers["preprocessed"].path, "preprocessed", f"{plant}_preprocessed_data")
+        uploads.register(writers["train"].path, "train", f"{plant}_training_data")
+        uploads.register(writers["inference"].path, "inference", f"{plant}_inference_data")
+        uploads.wait()
+
+    return writers["inference"].rows
 
 # Find unfinished jobs in analysis_console by plant
 myLogger.info("Check analysis console status...")
@@ -51,6 +153,7 @@ if control_table is not None:  # If no error occurred while fetching control_tab
 
     else:  # If there exists new data
         try:
+            connect_workspace()
             myLogger.info(f"control table: \n{control_table.head()}")
             series_id = control_table.iloc[0]['id']
             plant = control_table.iloc[0]['plant']
@@ -65,11 +168,18 @@ if control_table is not None:  # If no error occurred while fetching control_tab
 
             # Read data from mrp_sourcer_code_analysis
             myLogger.info(f'id: {series_id}, plant: {plant}, mrp_run_date : {mrp_run_date}, batch_id: {batch_id}, post_datetime : {post_datetime}')
-            mrp_sourcer_code = conn.fetch_mrp_sourcer_code_table(plant, mrp_run_date, batch_id, post_datetime)
+            if args.fetch_mode == "stream":
+                # Only count rows here, the data are streamed after the check
+                n_records = conn.count_mrp_sourcer_code_table(plant, mrp_run_date, batch_id, post_datetime)
+            else:
+                with phase("db_fetch") as p:
+                    mrp_sourcer_code = conn.fetch_mrp_sourcer_code_table(plant, mrp_run_date, batch_id, post_datetime)
+                    n_records = p["rows"] = len(mrp_sourcer_code)
+                frame_memory("mrp_sourcer_code", mrp_sourcer_code)
 
             # Check if length of control table recorded data and length of real data are different
-            if len(mrp_sourcer_code) != control_table.iloc[0]['total_record']:
-                myLogger.info(f"mrp_sourcer_code: {len(mrp_sourcer_code)}")
+            if n_records != control_table.iloc[0]['total_record']:
+                myLogger.info(f"mrp_sourcer_code: {n_records}")
                 myLogger.info(f"control_table: {control_table.iloc[0]['total_record']}")
                 myLogger.exception("Data lengths are different")
                 conn.update_ai_process(series_id, "Data lengths are different")
@@ -77,7 +187,7 @@ if control_table is not None:  # If no error occurred while fetching control_tab
                 myLogger.info(f"Start predicting sourcer code, ID: {series_id}")
                 cur_time = datetime.now()
                 myLogger.info(f"Start prepare_data, current_time: {cur_time}")
-                conn.update_ai_process(series_id, "Preparing data")
+                conn.update_ai_process(series_id, "Preparing data", critical=False)  # Progress, written in the background
 
                 # Fetch date within 1 day
                 date = mrp_run_date - timedelta(days=1)
@@ -88,54 +198,50 @@ if control_table is not None:  # If no error occurred while fetching control_tab
                 # ...
                 try:
                     conn.update_analysis_console(series_id, "ai_process_start_datetime", datetime.now())
-                    
-                    # ...
-                    mrp_preprocessed = ...
-                    mrp_preprocessed = mrp_preprocessed.reset_index()
 
-                    myLogger.info(mrp_preprocessed.head())
+                    if args.fetch_mode == "stream":
+                        # db_fetch of stream mode: stream_prepare_data minus its other phases
+                        with phase("stream_prepare_data", rows=n_records):
+                            n_inference = stream_prepare_data(plant, mrp_run_date, batch_id, post_datetime, date)
+                    else:
+                        with phase("preprocessing", rows=len(mrp_sourcer_code)):
+                            mrp_preprocessed = preprocess(mrp_sourcer_code, date)
+                            mrp_preprocessed = mrp_preprocessed.reset_index()
+                            del mrp_sourcer_code  # Not needed after preprocessing
 
-                    # Export preprocessed data
-                    path = f"./data/preprocessed/{plant}_preprocessed.csv"
-                    mrp_preprocessed.to_csv(path, index=False)
+                            # Features as categoricals, shared by the preprocessed, training and inference frames
+                            categorical(mrp_preprocessed, FEATURE_COLUMNS)
+                        frame_memory("mrp_preprocessed", mrp_preprocessed)
 
-                    # Upload to blob storage
-                    def_blob_store.upload_files(files=[path], target_path="preprocessed", overwrite=True)
+                        myLogger.info(mrp_preprocessed.head())
 
-                    # Register dataset
-                    tabular = Dataset.Tabular.from_delimited_files(def_blob_store.path(f"./preprocessed/{plant}_preprocessed.csv"))
-                    df_register = tabular.register(workspace=ws, name=f"{plant}_preprocessed_data", create_new_version=True)
-                    
-                    # Split into training and inference data (sourcer code is not NULL)
-                    train = mrp_preprocessed.loc[mrp_preprocessed["sourcer_code"] != '', :]
-                    inference = mrp_preprocessed.loc[mrp_preprocessed["sourcer_code"] == '', :]
+                        # Export preprocessed, training and inference data: each file is written, uploaded and registered
+                        # in the background while the next one is prepared
+                        with UploadPipeline(ws, def_blob_store) as uploads:
+                            uploads.write_and_register(mrp_preprocessed, local_path("preprocessed", plant), "preprocessed", f"{plant}_preprocessed_data")
 
-                    # Keep the first sourcer code only
-                    train.loc[:, "sourcer_code"] = train["sourcer_code"].apply(lambda x: x.split(";")[0])
+                            # Split into training and inference data
+                            with phase("preprocessing"):
+                                train, inference = split_train_inference(mrp_preprocessed)
+                            frame_memory("train", train)
+                            frame_memory("inference", inference)
 
-                    # Export training and inference dataset
-                    path = f"./data/train/{plant}_train.csv"
-                    train.to_csv(path, index=False)
+                            uploads.write_and_register(train, local_path("train", plant), "train", f"{plant}_training_data")
+                            uploads.write_and_register(inference, local_path("inference", plant), "inference", f"{plant}_inference_data")
 
-                    # Upload to blob storage
-                    def_blob_store.upload_files(files=[path], target_path="train", overwrite=True)
+                            # Fused steps: train and predict take the frames from memory instead of downloading them
+                            hand_over(f"{plant}_training_data", train)
+                            hand_over(f"{plant}_inference_data", inference)
 
-                    # Register dataset
-                    tabular = Dataset.Tabular.from_delimited_files(def_blob_store.path(f"./train/{plant}_train.csv")) # Different with local path
-                    df_register = tabular.register(workspace=ws, name=f"{plant}_training_data", create_new_version=True)
+                            with phase("fingerprint", rows=len(train)):
+                                write_fingerprint(args.series_id, frame_fingerprint(row_hashes(train)))  # Fingerprint of the training data for train.py
 
-                    path = f"./data/inference/{plant}_inference.csv"
-                    inference.to_csv(path, index=False)
+                            uploads.wait()
 
-                    # Upload to blob storage
-                    def_blob_store.upload_files(files=[path], target_path="inference", overwrite=True)
-
-                    # Register dataset
-                    tabular = Dataset.Tabular.from_delimited_files(def_blob_store.path(f"./inference/{plant}_inference.csv")) # Different with local path
-                    df_register = tabular.register(workspace=ws, name=f"{plant}_inference_data", create_new_version=True)
+                        n_inference = len(inference)
 
                     # If no inference data exists
-                    if inference.empty:
+                    if n_inference == 0:
                         myLogger.info("There is no inference data.")
                         conn.update_ai_process(series_id, "No inference data")
                 except:
@@ -145,4 +251,7 @@ if control_table is not None:  # If no error occurred while fetching control_tab
                 myLogger.info(f"prepare_data DONE. ID: {series_id}")
                 myLogger.info(f"prepare_data DONE. Time consumption: {(datetime.now() - cur_time).total_seconds()} sec")
         except:
-            myLogger.exception(f"An error occurred while analyzing {plant}")
\ No newline at end of file
+            myLogger.exception(f"An error occurred while analyzing {plant}")
+
+conn.close_session()
+metrics.finish()
@@ -1,8 +1,6 @@
 import logger
+import sys
 from argparse import ArgumentParser
-from azureml.core import Dataset
-from azureml.core import Model
-from azureml.core.run import Run
 
 # Run this file with command: python -m pipeline.register_model --plant <plant_code>
 
@@ -22,19 +20,35 @@ with open(args.series_id + "/series_id.txt") as f:
         series_id = int(line.split("\n")[0])
         break
 
-# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process
-if series_id != -1:
-      # Connect to Workspace
-      run = Run.get_context().parent
-      ws = run.experiment.workspace
+# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process,
+# so the no-new-data path exits before the heavy imports and the workspace connection
+if series_id == -1:
+    myLogger.info("There is no new data.")
+    sys.exit(0)
 
-      # Model names
-      model_name = f"{args.plant}_model.joblib"
-      model_name_no_comp = f"{args.plant}_model_no_comp.joblib"
+from utils.backend import Dataset
+from utils.backend import Model
+from utils.backend import Run
+from utils.fingerprint import read_fingerprint
 
-      # Read training data
-      dataset = Dataset.get_by_name(ws, f"{args.plant}_training_data", version="latest")
+# Connect to Workspace
+run = Run.get_context().parent
+ws = run.experiment.workspace
 
+# Model names
+model_name = f"{args.plant}_model.joblib"
+model_name_no_comp = f"{args.plant}_model_no_comp.joblib"
+
+# Fingerprint of the training data, written by train.py
+fingerprint = read_fingerprint(args.model_file)
+
+# Read training data
+dataset = Dataset.get_by_name(ws, f"{args.plant}_training_data", version="latest")
+
+if fingerprint.get("cache_hit"):
+      myLogger.info(f"Training data unchanged (fingerprint {fingerprint['fingerprint']}), registered models are kept.")
+
+else:
       # Register model 1
       model = Model.register(workspace=ws,
                              model_path=args.model_file,
@@ -43,7 +57,10 @@ if series_id != -1:
                                    "tag1": "mytag1",
                                    "tag2": "mytag2",
                                    "pipeline_id": run.id,
-                                   "dataset": f"{args.plant}_training_data: {dataset.version}"
+                                   "dataset": f"{args.plant}_training_data: {dataset.version}",
+                                   "dataset_version": str(dataset.version),
+                                   "fingerprint": fingerprint.get("fingerprint", ""),
+                                   "accuracy": str(fingerprint.get("accuracy", {}).get(model_name, ""))
                                   },
                              properties={
                                          "accuracy_bottomline": 0.8,
@@ -62,7 +79,10 @@ if series_id != -1:
                                      "tag1": "mytag1",
                                      "tag2": "mytag2",
                                      "pipeline_id": run.id,
-                                     "dataset": f"{args.plant}_training_data: {dataset.version}"
+                                     "dataset": f"{args.plant}_training_data: {dataset.version}",
+                                     "dataset_version": str(dataset.version),
+                                     "fingerprint": fingerprint.get("fingerprint", ""),
+                                     "accuracy": str(fingerprint.get("accuracy", {}).get(model_name_no_comp, ""))
                                     },
                                properties={
                                            "accuracy_bottomline": 0.8,
@@ -71,4 +91,4 @@ if series_id != -1:
                                description="My description for model 2")
 
       myLogger.info(f"Name of Model 2: {model_2.name}")
-      myLogger.info(f"Version of Model 2: {model_2.version}")
\ No newline at end of file
+      myLogger.info(f"Version of Model 2: {model_2.version}")
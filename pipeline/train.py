@@ -1,16 +1,7 @@
 #!/usr/bin/python3
-import joblib
 import logger
-import numpy as np
-import os
-from azureml.core import Dataset
-from azureml.core.run import Run
+import sys
 from argparse import ArgumentParser
-from datetime import datetime 
-from sklearn.model_selection import train_test_split
-from utils.connection import Connection
-from utils.label_encoding import frequency_encoding
-from utils.model import xgboost_model
 
 # Run this file with command: python -m pipeline.train --plant <plant_code>
 
@@ -20,10 +11,25 @@ parser.add_argument('--plant', required=True)
 parser.add_argument("--series_id", required=True)
 parser.add_argument("--model_file", required=True)
 parser.add_argument("--mode", required=True)
+parser.add_argument("--search", default="grid", choices=["grid", "staged"])  # Hyperparameter search engine
+parser.add_argument("--n_jobs", type=int, default=1)  # Parallel fits during the search
+parser.add_argument("--train_mode", default="sequential", choices=["sequential", "concurrent", "external"])  # Train model 1 and model 2 one after the other, at the same time, or out of core
+parser.add_argument("--search_rows", type=int, default=100000)  # External mode: rows sampled for the hyperparameter search in memory
+parser.add_argument("--chunk_dir", default=None)  # External mode: directory of the encoded chunks and XGBoost's cache (default: a temporary directory)
+parser.add_argument("--n_cores", type=int, default=None)  # Core budget of the train step (default: all cores)
+parser.add_argument("--force_retrain", action="store_true")  # Train even if the training data did not change
+parser.add_argument("--incremental", action="store_true")  # Continue boosting the registered models on new rows instead of a full retrain, when possible
+parser.add_argument("--incremental_rounds", type=int, default=20)  # Boosting rounds added by an incremental training
+parser.add_argument("--encoding_mode", default="full", choices=["full", "chunked"])  # Load and encode the training data at once or in chunks (raw strings never held whole)
+parser.add_argument("--chunksize", type=int, default=100000)  # Rows per chunk in chunked mode
+parser.add_argument("--encoding_jobs", type=int, default=1)  # Chunks counted and encoded at the same time in chunked mode
+parser.add_argument('--profile', default="none", choices=["none", "cprofile", "pyinstrument"])  # Profile the step, saved in ./logs/profiles
 args = parser.parse_args()
 
-# Connect to DB
-conn = Connection(args.mode)
+if args.incremental and args.encoding_mode == "chunked":
+    parser.error("--incremental compares the raw training rows, use --encoding_mode full")
+if args.incremental and args.train_mode == "external":
+    parser.error("--incremental compares the raw training rows, use --train_mode sequential or concurrent")
 
 # Load series ID
 with open(args.series_id + "/series_id.txt") as f:
@@ -32,71 +38,410 @@ with open(args.series_id + "/series_id.txt") as f:
         series_id = int(line.split("\n")[0])
         break
 
-# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process
-if series_id != -1:
-    myLogger = logger.getLogger(__name__)
+myLogger = logger.getLogger(__name__)
+
+# Only if series_id != -1 (There are new data to be analyzed) will we continue the remaining process,
+# so the no-new-data path exits before the heavy imports and the workspace and DB connections
+if series_id == -1:
+    myLogger.info("There is no new data.")
+    sys.exit(0)
+
+import joblib
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import time
+import xgboost as xgb
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime 
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+from utils.backend import Dataset
+from utils.backend import Model
+from utils.backend import Run
+from utils.connection import shared_connection
+from utils.data_io import download_frame
+from utils.data_io import iter_frames
+from utils.data_io import load_frame
+from utils.dtypes import categorical
+from utils.fingerprint import is_cached
+from utils.fingerprint import read_fingerprint
+from utils.fingerprint import row_hashes
+from utils.fingerprint import training_cache_key
+from utils.fingerprint import write_fingerprint
+from utils.handoff import hand_over
+from utils.handoff import take
+from utils.instrumentation import StepMetrics
+from utils.instrumentation import frame_memory
+from utils.instrumentation import phase
+from utils.label_encoding import ENCODING_VERSION
+from utils.label_encoding import EncodingMappings
+from utils.label_encoding import FrequencyEncoder
+from utils.label_encoding import download_mappings
+from utils.label_encoding import fit_frequency_encoder
+from utils.label_encoding import frequency_encoding
+from utils.label_encoding import upload_mappings
+from utils.model import EXTERNAL_MEMORY
+from utils.model import PARAM_GRID
+from utils.model import continue_training
+from utils.model import external_memory_model
+from utils.model import save_chunk
+from utils.model import save_model
+from utils.model import xgboost_model
+
+# Out of core training needs xgboost >= 1.5 (DataIter), training in memory instead would defeat its purpose
+if args.train_mode == "external" and not EXTERNAL_MEMORY:
+    parser.error(f"--train_mode external needs xgboost >= 1.5 (DataIter), installed: {xgb.__version__} (env/conda_env.yml pins 1.3.3)")
+
+# Connect to DB
+conn = shared_connection(args.mode)
+
+
+def load_previous_training(ws, def_blob_store, train):
+    """
+        Registered models, their encoding mappings and a mask of the rows of train that are not in their training data.
+        None (with the reason logged) if a full retrain is needed: no registered model, unknown categories or new classes.
+    """
+
+    lst_cols = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
+    model_names = [f"{args.plant}_model.joblib", f"{args.plant}_model_no_comp.joblib"]
+
+    try:
+        # Training data version of the registered models
+        previous_version = Model(ws, name=model_names[0]).tags["dataset_version"]
+        previous_train = Dataset.get_by_name(ws, f"{args.plant}_training_data", version=previous_version).keep_columns(lst_cols).to_pandas_dataframe()
+
+        models, accuracy = {}, {}
+        for model_name in model_names:
+            path = Model.get_model_path(model_name, _workspace=ws)
+            models[model_name] = joblib.load(path+f"/{model_name}")
+            recorded = Model(ws, name=model_name).tags.get("accuracy")  # Validation accuracy at registration, if recorded
+            if recorded:
+                accuracy[model_name] = float(recorded)
+
+        # Encoding mappings of the registered models
+        mappings = download_mappings(def_blob_store, args.plant)
+    except Exception:
+        myLogger.exception("No registered models to continue from, full retrain")
+        return None
+
+    if mappings.encoding_version != ENCODING_VERSION:
+        myLogger.info(f"Encoding mappings of version {mappings.encoding_version}, current version {ENCODING_VERSION}, full retrain")
+        return None
+
+    new_rows = ~np.isin(row_hashes(train, lst_cols), row_hashes(previous_train, lst_cols))
+    myLogger.info(f"{new_rows.sum()} new rows since training data version {previous_version}")
+
+    for col in lst_cols:
+        values = train.loc[new_rows, col]
+        if ((mappings.encode(col, values) == -1) & values.notna()).any():
+            myLogger.info(f"New categories in {col}, full retrain")
+            return None
+
+    labels = mappings.encode("sourcer_code", train.loc[new_rows, "sourcer_code"])
+    for model_name, model in models.items():
+        if not np.isin(labels, model.classes_).all():
+            myLogger.info(f"New sourcer_code classes for {model_name}, full retrain")
+            return None
+
+    return {"models": models, "mappings": mappings, "new_rows": new_rows, "accuracy": accuracy}
+
+def continue_previous_training(previous, train):
+    """
+        Continue boosting the registered models on the rows added since their training data, 10% of them held out for validation.
+        {model_name: (model, accuracy)}, or None (with the reason logged) if a full retrain is needed: too few new rows to validate,
+        or a continued model less accurate than its recorded accuracy (else than the registered model on the same rows).
+    """
+
+    new_rows = previous["mappings"].transform(train.loc[previous["new_rows"], lst_cols].copy(), columns=lst_cols, unseen=np.nan)
+    if len(new_rows) < 10:
+        myLogger.info(f"{len(new_rows)} new rows, too few to validate continued models, full retrain")
+        return None
+
+    fit_index, val_index = train_test_split(np.arange(len(new_rows)), test_size=0.1, random_state=597)
+    y = new_rows["sourcer_code"].to_numpy()
+
+    continued = {}
+    for model_name, (description, columns) in model_features.items():
+        model = previous["models"][model_name]
+        x = new_rows[features_all[columns]]
+        x_val, y_val = x.iloc[val_index], y[val_index]
+        baseline = previous["accuracy"].get(model_name)
+        if baseline is None:
+            baseline = accuracy_score(y_val, model.predict(x_val))
+
+        start = time.perf_counter()
+        with phase("fit", rows=len(fit_index)):
+            model = continue_training(model, x.iloc[fit_index], y[fit_index], args.incremental_rounds)
+        accuracy = accuracy_score(y_val, model.predict(x_val))
+        myLogger.info(f"Model {description} continued on {len(fit_index)} new rows in {time.perf_counter() - start:.1f} sec, "
+                      f"accuracy {accuracy:.4f} on {len(val_index)} held out new rows (previous model: {baseline:.4f})")
+
+        if accuracy < baseline:
+            myLogger.warning(f"Continued model {description} is less accurate than the previous model, full retrain")
+            return None
+        continued[model_name] = (model, accuracy)
+
+    return continued
+
+def training_source():
+    """Frame handed over by read_data (fused steps), else the path of the downloaded training file"""
 
-    # Connect to Workspace
-    run = Run.get_context().parent
-    ws = run.experiment.workspace
+    train = take(f"{args.plant}_training_data")
 
-    # Connect to Azure Blob Storage
-    def_blob_store = ws.get_default_datastore()
+    return train if train is not None else download_frame(def_blob_store, "train", args.plant)
 
-    myLogger.info(f"Start training model, current_time: {datetime.now()}")
-    conn.update_ai_process(series_id, "Training model")
+def training_chunks(source, columns):
+    """Training data in chunks of --chunksize rows: slices of the handed over frame, else read from the downloaded file"""
 
-    # Read training data from registered data assets
-    dataset = Dataset.get_by_name(workspace=ws, name=f"{args.plant}_training_data")
-    train = dataset.to_pandas_dataframe()
-    myLogger.info(f"Sample of training data: {len(train)}")
+    if isinstance(source, pd.DataFrame):
+        return (source.iloc[start:start + args.chunksize][columns].copy() for start in range(0, len(source), args.chunksize))
+
+    return iter_frames(source, columns=columns, chunksize=args.chunksize)
+
+def save_training_chunks(encoder, chunks, directory, n_rows):
+    """
+        Encode each chunk and save its training and validation rows (10%, seeded) for ChunkIter,
+        return their paths and a uniform sample of --search_rows training rows for the hyperparameter search
+    """
+
+    rng = np.random.default_rng(597)
+    sample_ratio = min(1.0, args.search_rows / max(n_rows, 1))
+    files = {"train": [], "val": []}
+    sample = []
+
+    for i, chunk in enumerate(chunks):
+        encoded = encoder.transform(categorical(chunk, encoder.columns))
+        frame_memory("train_chunk", encoded)
+        x = encoded[encoder.columns[:-1]].to_numpy(dtype=np.float32)
+        y = encoded[encoder.columns[-1]].to_numpy()
+
+        val = rng.random(len(encoded)) < 0.1
+        for kind, rows in [("train", ~val), ("val", val)]:
+            if rows.any():
+                files[kind].append(save_chunk(os.path.join(directory, f"{kind}_{i:05d}.npz"), x[rows], y[rows]))
+        sample.append(encoded[~val & (rng.random(len(encoded)) < sample_ratio)])
+
+    return files, pd.concat(sample, ignore_index=True) if sample else pd.DataFrame(columns=encoder.columns)
+
+# Connect to Workspace
+run = Run.get_context().parent
+ws = run.experiment.workspace
+
+# Connect to Azure Blob Storage
+def_blob_store = ws.get_default_datastore()
+
+# Phase metrics of this step
+metrics = StepMetrics("train", args.plant, run=Run.get_context(), profile=args.profile).start()
+
+myLogger.info(f"Start training model, current_time: {datetime.now()}")
+conn.open_session()  # Hold one DB connection for all status updates of this step
+try:
+    conn.update_ai_process(series_id, "Training model", critical=False)  # Progress, written in the background
+
+    # Skip training if the training data (fingerprinted by read_data.py) and the encoding are those of the registered models,
+    # checked before the data is loaded and encoded. Without a data fingerprint the data may have changed: no lookup,
+    # and an empty fingerprint is registered, so no later run matches it
+    fingerprint = training_cache_key(read_fingerprint(args.series_id).get("fingerprint", ""), f"encoding_version={ENCODING_VERSION}")
+    cache_hit = not args.force_retrain and is_cached(ws, fingerprint, [f"{args.plant}_model.joblib", f"{args.plant}_model_no_comp.joblib"])
+    if fingerprint:
+        myLogger.info(f"Training data fingerprint: {fingerprint}, cache {'hit' if cache_hit else 'miss'}{' (forced retraining)' if args.force_retrain else ''}")
+    else:
+        myLogger.warning("No training data fingerprint from read_data.py, cache miss")
+    write_fingerprint(args.model_file, fingerprint, cache_hit=cache_hit)  # For register_model.py
+
+    if cache_hit:
+        myLogger.info("Training data unchanged, the registered models are kept.")
+        take(f"{args.plant}_training_data")  # Fused steps: the frame handed over by read_data is not needed
+        conn.update_ai_process(series_id, "Training model done")
+        sys.exit(0)
+
+    # Read training data from registered data assets, only the features and the label
+    lst_cols = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
+
+    # Features of each model, model 1 uses colA-colE and model 2 uses colC-colG
+    features_all = ["colA", "colB", "colC", "colD", "colE", "colF", "colG"]
+    model_features = {
+        f"{args.plant}_model.joblib": ("with component types", slice(0, 5)),
+        f"{args.plant}_model_no_comp.joblib": ("without component types", slice(2, 7)),
+    }
+
+    with phase("load_data") as p:
+        if args.train_mode == "external":
+            # Out of core, first pass over the chunks: count the categories, no chunk is kept
+            source = training_source()
+            encoder = FrequencyEncoder(lst_cols)
+            n_train = 0
+            for chunk in training_chunks(source, lst_cols):
+                encoder.partial_fit(categorical(chunk, lst_cols))
+                n_train += len(chunk)
+            p["rows"] = n_train
+        elif args.encoding_mode == "chunked":
+            # Each chunk is converted to categoricals as it is read, so the raw strings of the whole data are never held
+            train_chunks = []
+            for chunk in training_chunks(training_source(), lst_cols):
+                train_chunks.append(categorical(chunk, lst_cols))
+                frame_memory("train_chunk", chunk)
+            n_train = p["rows"] = sum(len(chunk) for chunk in train_chunks)
+        else:
+            train = load_frame(ws, def_blob_store, f"{args.plant}_training_data", "train", args.plant, columns=lst_cols)
+            n_train = p["rows"] = len(train)
+            frame_memory("train", train)
+    myLogger.info(f"Sample of training data: {n_train}")
     myLogger.info("Start label encoding...")
 
     # Create directory to store the label encoding mappings
     os.makedirs("./label_encoding", exist_ok=True)
 
-    # Apply frequency encoding to X and y
-    lst_cols = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
-    train_encoded, encoding_mappings = frequency_encoding(train, columns=lst_cols)
+    # Incremental training continues the registered models, if the new rows fit their encoding mappings and classes
+    # (loaded on a cache miss only, a hit ended the step) and the continued models keep their accuracy
+    with phase("load_previous_training"):
+        previous = load_previous_training(ws, def_blob_store, train) if args.incremental and not args.force_retrain else None
+    continued = continue_previous_training(previous, train) if previous is not None else None
+
+    with phase("encoding", rows=n_train):
+        if args.train_mode == "external":
+            # Second pass: encode the chunks and save them to disk, only the search sample is held
+            encoding_mappings, mappings = encoder.finalize(), encoder.mappings
+            chunk_dir = tempfile.TemporaryDirectory(prefix=f"{args.plant}_train_chunks_", dir=args.chunk_dir)
+            chunk_files, train_encoded = save_training_chunks(encoder, training_chunks(source, lst_cols), chunk_dir.name, n_train)
+            del source
+        elif args.encoding_mode == "chunked":
+            # Count the chunks in parallel, merged in row order, then encode them: same mappings and codes as frequency_encoding
+            encoder = fit_frequency_encoder(train_chunks, lst_cols, n_jobs=args.encoding_jobs)
+            with ThreadPoolExecutor(max_workers=args.encoding_jobs) as executor:
+                train = pd.concat(executor.map(encoder.transform, train_chunks), ignore_index=True) if train_chunks else pd.DataFrame(columns=lst_cols)
+            train_encoded, encoding_mappings, mappings = train, encoder.encoding_mappings, encoder.mappings
+            del train_chunks
+        elif continued is not None:
+            # The codes of the registered models, only the new rows were encoded
+            mappings = previous["mappings"]
+            train_encoded, encoding_mappings = None, mappings.to_dict()
+        else:
+            # Apply frequency encoding to X and y
+            train_encoded, encoding_mappings = frequency_encoding(train, columns=lst_cols)
+            mappings = EncodingMappings.from_dict(encoding_mappings)
+
+    # Codes are encoded in place, in the smallest int type, so train is train_encoded (external mode: the search sample)
+    if train_encoded is not None:
+        frame_memory("train_encoded", train_encoded)
 
-    # Save and upload the encoding mappings to Azure Blob
-    np.save(f"./label_encoding/{args.plant}_encoding_mappings.npy", encoding_mappings)
-    def_blob_store.upload_files(files=[f"./label_encoding/{args.plant}_encoding_mappings.npy"], target_path="label_encoding", overwrite=True)
     myLogger.info("Label encoding done.")
-        
-    # Split to x and y
-    X1 = train[["colA", "colB", "colC", "colD", "colE"]]  # Model 1
-    X2 = train[["colC", "colD", "colE", "colF", "colG"]]  # Model 2
-    y = train["sourcer_code"]
-
-    # Split into training and validation set
-    x_train1, x_val1, y_train1, y_val1 = train_test_split(X1, y, test_size=0.1, random_state=597)
-    x_train2, x_val2, y_train2, y_val2= train_test_split(X2, y, test_size=0.1, random_state=597)
-
-    # Define the parameter grid
-    param_grid = {
-        'max_depth': [3, 5, 7],
-        'learning_rate': [0.1, 0.05, 0.01, 0.001],
-        'n_estimators': [25, 50, 100, 200],
-    }
+    hand_over(f"{args.plant}_encoding_mappings", mappings)  # Fused steps: predict uses them without downloading
+
+    # Save and upload the encoding mappings to Azure Blob (sorted categories and codes, no pickle)
+    with phase("blob_upload"):
+        upload_mappings(def_blob_store, mappings, args.plant)
 
     # Create a directory to store models
     os.makedirs(args.model_file, exist_ok=True)
 
-    # Create XGBoost model 1
-    myLogger.info("Training model with component types...")
-    xgboost_model1, accuracy1 = xgboost_model(x_train1, y_train1, x_val1, y_val1)
-    myLogger.info(f"Model with component types training has been done, current_time: {datetime.now()}")
+    accuracies = {}  # Validation accuracy of each trained model, recorded at registration
+
+    def fit_and_save(model_name, x_train, y_train, x_val, y_val, n_threads=None):
+        """Train one model, save it and log its training time"""
+
+        description, _ = model_features[model_name]
+        myLogger.info(f"Training model {description}...")
+        start = time.perf_counter()
+        with phase("fit", rows=len(x_train)):
+            model, accuracy = xgboost_model(x_train, y_train, x_val, y_val, search=args.search, n_jobs=args.n_jobs, n_threads=n_threads)
+        accuracies[model_name] = accuracy
+        myLogger.info(f"Model {description} training has been done in {time.perf_counter() - start:.1f} sec, current_time: {datetime.now()}")
+
+        with phase("save_model"):
+            save_model(model, args.model_file, model_name)
+        hand_over(model_name, model)  # Fused steps: predict uses it without loading the registered model
+        myLogger.info(f"Model {description} had been saved!")
+
+        return model, accuracy
+
+    if continued is not None:
+        # The registered models continued on the new rows
+        for model_name, (description, _) in model_features.items():
+            model, accuracies[model_name] = continued[model_name]
+            save_model(model, args.model_file, model_name)
+            hand_over(model_name, model)
+            myLogger.info(f"Model {description} had been saved!")
+
+    elif args.train_mode == "external":
+        # Hyperparameters searched on the sample in memory, then each model boosted over all training chunks read from disk
+        y = train_encoded["sourcer_code"].to_numpy()
+        train_index, val_index = train_test_split(np.arange(len(train_encoded)), test_size=0.1, random_state=597)
+        n_classes = len(encoding_mappings["sourcer_code"])
+
+        for model_name, (description, columns) in model_features.items():
+            x = train_encoded[features_all[columns]]
+            myLogger.info(f"Searching hyperparameters of model {description} on {len(train_index)} sampled rows...")
+            with phase("search", rows=len(train_index)):
+                sample_model, _ = xgboost_model(x.iloc[train_index], y[train_index], x.iloc[val_index], y[val_index],
+                                                search=args.search, n_jobs=args.n_jobs, n_threads=args.n_cores)
+            params = {key: sample_model.get_params()[key] for key in PARAM_GRID}
+
+            myLogger.info(f"Training model {description} out of core on {len(chunk_files['train'])} chunks...")
+            start = time.perf_counter()
+            with phase("fit", rows=n_train):
+                model, accuracy = external_memory_model(chunk_files["train"], chunk_files["val"], columns, features_all[columns], n_classes, params,
+                                                        os.path.join(chunk_dir.name, f"cache_{model_name}"), n_threads=args.n_cores)
+            myLogger.info(f"Model {description} training has been done in {time.perf_counter() - start:.1f} sec, accuracy {accuracy:.4f}, current_time: {datetime.now()}")
+            accuracies[model_name] = accuracy
+
+            with phase("save_model"):
+                save_model(model, args.model_file, model_name)
+            hand_over(model_name, model)
+            myLogger.info(f"Model {description} had been saved!")
+
+        chunk_dir.cleanup()
+
+    elif args.train_mode == "concurrent":
+        # Split into training and validation set once (same rows as splitting X1 and X2 with the same seed)
+        train_index, val_index = train_test_split(np.arange(len(train)), test_size=0.1, random_state=597)
+        n_fit = len(train_index)
+
+        # Share one column-major matrix of colA-colG with the training rows first, then the validation rows:
+        # the training and validation sets of each model are views of adjacent rows and columns, not copies
+        order = np.concatenate([train_index, val_index])
+        features = np.empty((len(order), len(features_all)), dtype=np.float32, order="F")
+        for j, col in enumerate(features_all):
+            features[:, j] = train[col].to_numpy()[order]
+        y = train["sourcer_code"].to_numpy()[order]
+
+        # Both models run at the same time, so each gets half of the cores
+        n_threads = max(1, (args.n_cores or os.cpu_count() or 1) // len(model_features))
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=len(model_features)) as executor:
+            futures = []
+            for model_name, (_, columns) in model_features.items():
+                x_train = pd.DataFrame(features[:n_fit, columns], columns=features_all[columns], copy=False)
+                x_val = pd.DataFrame(features[n_fit:, columns], columns=features_all[columns], copy=False)
+                futures.append(executor.submit(fit_and_save, model_name, x_train, y[:n_fit], x_val, y[n_fit:], n_threads))
+
+            for future in futures:
+                future.result()
+
+        myLogger.info(f"Concurrent training of {len(model_features)} models done in {time.perf_counter() - start:.1f} sec")
+
+    else:
+        y = train["sourcer_code"].to_numpy()
+
+        # Split into training and validation set once (same rows as splitting X1 and X2 with the same seed)
+        train_index, val_index = train_test_split(np.arange(len(train)), test_size=0.1, random_state=597)
 
-    joblib.dump(xgboost_model1, f"{args.model_file}/{args.plant}_model.joblib")
-    myLogger.info("Model with component types had been saved!")
+        # Model 1 (colA-colE), then model 2 (colC-colG): the split of a model is selected just before its training
+        # and freed after it, so only one copy of the features is held besides train
+        for model_name, (_, columns) in model_features.items():
+            positions = train.columns.get_indexer(features_all[columns])
+            x_train, x_val = train.iloc[train_index, positions], train.iloc[val_index, positions]
+            frame_memory("x_train", x_train)
 
-    # Create XGBoost model 2
-    myLogger.info("Training model without component types...")
-    xgboost_model2, accuracy2 = xgboost_model(x_train2, y_train2, x_val2, y_val2)
-    myLogger.info(f"Model without component types training has been done, current_time: {datetime.now()}")
+            fit_and_save(model_name, x_train, y[train_index], x_val, y[val_index], n_threads=args.n_cores)
+            del x_train, x_val
 
-    joblib.dump(xgboost_model2, f"{args.model_file}/{args.plant}_model_no_comp.joblib")
-    myLogger.info("Model without component types had been saved!")
+    write_fingerprint(args.model_file, fingerprint, cache_hit=False, accuracy=accuracies)  # For register_model.py
 
-    conn.update_ai_process(series_id, "Training model done")
\ No newline at end of file
+    conn.update_ai_process(series_id, "Training model done")
+finally:
+    conn.close_session()
+    metrics.finish()
@@ -0,0 +1,57 @@
+import os
+import pytest
+
+os.environ.setdefault("PIPELINE_BACKEND", "local")  # The cache itself needs no workspace, the local stand-ins are enough
+
+from utils.artifact_cache import ArtifactCache
+
+
+def fill(size):
+    def fetch(folder):
+        with open(os.path.join(folder, "artifact.bin"), "wb") as f:
+            f.write(b"x" * size)
+
+    return fetch
+
+
+def test_least_recently_used_artifacts_are_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=250)
+
+    a = cache.get("a", fill(100))
+    b = cache.get("b", fill(100))
+    os.utime(b, (1, 1))  # b used long ago, a since
+    os.utime(a, (2, 2))
+    cache.get("c", fill(100))
+
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    assert cache.get("a", fill(100)) == a
+    assert cache.hits == 1
+
+
+def test_failed_fetch_leaves_no_partial_artifact(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+
+    def fetch(folder):
+        fill(10)(folder)
+        raise ConnectionError("download interrupted")
+
+    with pytest.raises(ConnectionError):
+        cache.get("model", fetch)
+
+    assert os.listdir(tmp_path) == []
+    assert os.path.exists(os.path.join(cache.get("model", fill(10)), "artifact.bin"))
+
+
+def test_artifact_cached_meanwhile_by_another_run_is_kept(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+
+    def fetch(folder):
+        fill(10)(folder)
+        ArtifactCache(str(tmp_path)).get("model", fill(20))  # Another run caches it while this one downloads
+
+    path = cache.get("model", fetch)
+
+    assert os.listdir(tmp_path) == ["model"]
+    assert os.path.getsize(os.path.join(path, "artifact.bin")) == 20
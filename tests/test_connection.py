@@ -0,0 +1,167 @@
+import pytest
+import sqlalchemy
+import time
+from sqlalchemy import event
+from sqlalchemy import text
+from utils import connection
+
+# utils/connection.py against a SQLite stand-in of the DB, with the sourcer schema as an attached database
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    def sqlite_engine(url, **kwargs):
+        engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'main.db'}", isolation_level="AUTOCOMMIT")
+        event.listen(engine, "connect", lambda dbapi_connection, record: dbapi_connection.execute(f"ATTACH DATABASE '{tmp_path / 'sourcer.db'}' AS sourcer"))
+        return engine
+
+    monkeypatch.setattr(connection, "create_engine", sqlite_engine)
+    conn = connection.Connection("qas")
+    conn.async_status = True
+    conn.status_flush_interval = 60  # The tests flush or wake the background thread themselves
+
+    with conn.conn_engine.connect() as c:
+        c.execute(text("CREATE TABLE sourcer.analysis_console (id TEXT, ai_process TEXT, data_ready TEXT)"))
+        c.execute(text("INSERT INTO sourcer.analysis_console VALUES ('1', NULL, 'Y'), ('2', NULL, 'Y')"))
+
+    statements = []
+    event.listen(conn.conn_engine, "before_cursor_execute", lambda c, cursor, statement, params, *args: statements.append((statement, params)))
+    conn.statements = statements
+
+    yield conn
+    conn.close_session()
+
+
+def status(conn, id) -> tuple:
+    with conn.conn_engine.connect() as c:
+        return tuple(c.execute(text("SELECT ai_process, data_ready FROM sourcer.analysis_console WHERE id = :id"), {"id": str(id)}).one())
+
+
+def updates(conn) -> list:
+    return [(statement, params) for statement, params in conn.statements if statement.startswith("UPDATE")]
+
+
+def test_repeated_progress_updates_are_coalesced(conn, monkeypatch):
+    monkeypatch.setattr(conn, "_start_status_flusher", lambda: None)  # Buffered until flushed
+
+    for progress in ["Reading data", "Training model", "Predicting"]:
+        conn.update_ai_process(1, progress, critical=False)
+    conn.update_status(1, critical=False, data_ready="N")
+
+    assert conn._pending_status == {1: {"ai_process": "Predicting", "data_ready": "N"}}
+    assert updates(conn) == []
+
+    conn.flush_status()
+    assert len(updates(conn)) == 1
+    assert status(conn, 1) == ("Predicting", "N")
+
+
+def test_critical_update_writes_the_buffered_updates_of_its_id(conn, monkeypatch):
+    monkeypatch.setattr(conn, "_start_status_flusher", lambda: None)
+
+    conn.update_status(1, critical=False, data_ready="N")
+    conn.update_status(2, critical=False, ai_process="Training model")
+    conn.update_ai_process(1, "Y")
+
+    assert len(updates(conn)) == 1
+    assert status(conn, 1) == ("Y", "N")
+    assert conn._pending_status == {2: {"ai_process": "Training model"}}
+
+
+def test_values_are_bound_parameters(conn):
+    value = "done'); DROP TABLE sourcer.analysis_console; --"
+    conn.update_ai_process(1, value)
+
+    (statement, params), = updates(conn)
+    assert value not in statement
+    assert value in params
+    assert status(conn, 1) == (value, "Y")
+
+
+def test_background_thread_writes_buffered_updates(conn):
+    conn.update_ai_process(1, "Training model", critical=False)
+
+    deadline = time.time() + 5
+    while status(conn, 1)[0] is None and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert status(conn, 1)[0] == "Training model"
+
+
+@pytest.mark.parametrize("close", ["close_session", "stop_status_flusher"])
+def test_buffered_updates_are_flushed_on_close(conn, close):
+    conn.open_session()
+    conn._start_status_flusher()
+    conn._status_event.clear()
+    with conn._pending_lock:  # Buffered without waking the background thread
+        conn._pending_status[1] = {"ai_process": "Predicting"}
+
+    getattr(conn, close)()
+
+    assert conn._status_thread is None
+    assert conn._pending_status == {}
+    assert status(conn, 1)[0] == "Predicting"
+
+
+@pytest.mark.parametrize("column", ["ai_process = 'Y' --", "ai_process;", "1column", "a.b.c"])
+def test_invalid_column_identifiers_are_rejected(conn, column):
+    with pytest.raises(ValueError):
+        conn.update_status(1, **{column: "Y"})
+
+    assert updates(conn) == []
+
+
+@pytest.mark.parametrize("table", ["sourcer.result; DROP TABLE x", "sourcer.result --", "sourcer.sub.result"])
+def test_invalid_table_identifiers_are_rejected(conn, table):
+    import pandas as pd
+
+    with pytest.raises(ValueError):
+        conn.upsert_dataframe(pd.DataFrame({"series_id": [1]}), table)
+
+
+def test_critical_update_is_retried_on_a_fresh_connection(conn):
+    conn.open_session()
+    lost = conn._session
+    lost.connection.dbapi_connection.close()  # Dropped by the server while the step was busy
+
+    conn.update_ai_process(1, "Training model done")
+
+    assert conn._session is not lost
+    assert status(conn, 1)[0] == "Training model done"
+
+
+def test_stopping_a_stream_early_is_not_logged_as_an_error(conn, monkeypatch):
+    import pandas as pd
+
+    with conn.conn_engine.connect() as c:
+        c.execute(text("CREATE TABLE sourcer.mrp_sourcer_code_analysis (plant TEXT, mrp_run_date TEXT, batch_id TEXT, post_datetime TEXT, colA TEXT)"))
+        c.execute(text("INSERT INTO sourcer.mrp_sourcer_code_analysis VALUES ('P1', 'd', 'b', 't', 'x'), ('P1', 'd', 'b', 't', 'y')"))
+
+    errors = []
+    monkeypatch.setattr(connection._logger(), "exception", lambda msg, *args, **kwargs: errors.append(msg))
+
+    chunks = conn.stream_mrp_sourcer_code_table("P1", "d", "b", "t", columns=["colA"], chunksize=1)
+    assert isinstance(next(chunks), pd.DataFrame)
+    chunks.close()  # The consumer stops after the first chunk
+
+    assert errors == []
+
+
+def test_recent_logs_of_the_log_file_and_its_backups_are_uploaded(conn, tmp_path, monkeypatch):
+    import datetime
+    import logger
+
+    now = datetime.datetime.now()
+    stamp = lambda minutes: (now - datetime.timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S +0000")
+    monkeypatch.setattr(logger, "LOG_DIR", str(tmp_path))
+    (tmp_path / "predict_classification.log.1").write_text(f"{stamp(30)} old record\n{stamp(10)} rotated record\n")
+    (tmp_path / "predict_classification.log").write_text(f"{stamp(5)} failed\nTraceback (most recent call last):\n{stamp(1)} last record\n")
+
+    with conn.conn_engine.connect() as c:
+        c.execute(text("CREATE TABLE sourcer.log_message (update_time TEXT, plant TEXT, message TEXT, source_file TEXT, status TEXT)"))
+
+    conn.read_log_file_and_upload_to_DB("P1", minutes=15)
+
+    with conn.conn_engine.connect() as c:
+        message, = c.execute(text("SELECT message FROM sourcer.log_message WHERE plant = 'P1'")).one()
+    assert message.splitlines() == [f"{stamp(10)} rotated record", f"{stamp(5)} failed", "Traceback (most recent call last):", f"{stamp(1)} last record"]
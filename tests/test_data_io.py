@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+from utils.data_io import FrameWriter
+from utils.data_io import read_frame
+from utils.prediction import prediction_columns
+
+
+def test_parquet_chunks_with_a_column_empty_in_the_first_chunk(tmp_path):
+    path = str(tmp_path / "data" / "result.parquet")
+    chunks = [
+        pd.DataFrame({"colA": ["a", "b"], "sourcer_code": ["S1", "S2"], "comment": [None, None]}),
+        pd.DataFrame({"colA": ["c"], "sourcer_code": [None], "comment": ["late value"]}),
+    ]
+
+    with FrameWriter(path, "parquet") as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    df = read_frame(path, "parquet")
+    assert writer.rows == 3
+    assert df["colA"].astype(str).tolist() == ["a", "b", "c"]
+    assert df["comment"].tolist()[2] == "late value"
+    assert df["comment"].isna().tolist() == [True, True, False]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_empty_result_keeps_its_columns(tmp_path, fmt):
+    path = str(tmp_path / "data" / f"result.{fmt}")
+    columns = ["colA", "sourcer_code"] + prediction_columns(3)
+
+    with FrameWriter(path, fmt) as writer:
+        writer.write(pd.DataFrame(columns=columns))
+
+    df = read_frame(path, fmt)
+    assert writer.rows == 0
+    assert df.empty
+    assert list(df.columns) == columns
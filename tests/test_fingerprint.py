@@ -0,0 +1,38 @@
+import pandas as pd
+from utils import fingerprint
+from utils.fingerprint import TRAIN_COLUMNS
+from utils.fingerprint import frame_fingerprint
+from utils.fingerprint import is_cached
+from utils.fingerprint import row_hashes
+from utils.fingerprint import training_cache_key
+
+
+def test_missing_data_fingerprint_is_a_cache_miss(monkeypatch):
+    # Models registered by a run without a data fingerprint carry an empty fingerprint tag
+    monkeypatch.setattr(fingerprint, "registered_fingerprint", lambda ws, model_name: "")
+
+    key = training_cache_key("", "encoding_version=2")
+    assert key == ""
+    assert not is_cached(None, key, ["model.joblib", "model_no_comp.joblib"])
+
+
+def test_cache_hit_needs_every_model_with_the_key(monkeypatch):
+    key = training_cache_key("data", "encoding_version=2")
+    tags = {"model.joblib": key, "model_no_comp.joblib": key}
+    monkeypatch.setattr(fingerprint, "registered_fingerprint", lambda ws, model_name: tags.get(model_name))
+
+    assert is_cached(None, key, list(tags))
+    assert not is_cached(None, training_cache_key("data", "encoding_version=3"), list(tags))
+    assert not is_cached(None, key, [*tags, "other_model.joblib"])
+
+
+def test_fingerprint_does_not_depend_on_the_row_order():
+    df = pd.DataFrame({col: [f"{col}{i % 7}" for i in range(50)] for col in TRAIN_COLUMNS})
+    shuffled = df.sample(frac=1, random_state=0)
+
+    assert frame_fingerprint(row_hashes(shuffled)) == frame_fingerprint(row_hashes(df))
+    assert frame_fingerprint(row_hashes(df.astype("category"))) == frame_fingerprint(row_hashes(df))
+
+    changed = df.copy()
+    changed.loc[0, "sourcer_code"] = "other"
+    assert frame_fingerprint(row_hashes(changed)) != frame_fingerprint(row_hashes(df))
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.label_encoding import ENCODING_VERSION
+from utils.label_encoding import EncodingMappings
+from utils.label_encoding import FrequencyEncoder
+from utils.label_encoding import convert_legacy_mappings
+from utils.label_encoding import frequency_encoding
+
+
+def baseline_mapping(values: pd.Series) -> dict:
+    """Mapping of the former frequency_encoding (encoding version 1)"""
+
+    return {k: i for i, k in enumerate(values.value_counts().sort_values().index.tolist())}
+
+
+def tie_groups(mapping: dict, counts: pd.Series) -> list:
+    """Categories of each count, in code order: the same for two mappings that differ only in the order of ties"""
+
+    groups = {}
+    for category in sorted(mapping, key=mapping.get):
+        groups.setdefault(counts[category], set()).add(category)
+
+    return list(groups.items())
+
+
+def test_codes_match_the_baseline_up_to_the_order_of_ties():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "uniform": rng.permutation(np.repeat([f"u{i}" for i in range(294)], 4)),  # All counts tie
+        "distinct": rng.permutation(np.repeat([f"d{i}" for i in range(48)], np.arange(1, 49))),  # No ties, 1176 rows as well
+    })
+
+    _, mappings = frequency_encoding(df.copy(), columns=["uniform", "distinct"])
+
+    for col in df.columns:
+        baseline = baseline_mapping(df[col])
+        counts = df[col].value_counts()
+        assert set(mappings[col]) == set(baseline)
+        assert sorted(mappings[col].values()) == sorted(baseline.values())
+        assert tie_groups(mappings[col], counts) == tie_groups(baseline, counts)
+
+    # Without ties the codes are those of the baseline
+    assert mappings["distinct"] == baseline_mapping(df["distinct"])
+
+
+def test_ties_in_order_of_first_appearance():
+    df = pd.DataFrame({"col": ["b", "a", "c", "a", "c", "b", "d"]})
+    _, mappings = frequency_encoding(df, columns=["col"])
+
+    assert mappings["col"] == {"d": 0, "b": 1, "a": 2, "c": 3}
+
+
+def test_encoding_version_is_saved_and_former_mappings_are_version_1(tmp_path):
+    mappings = EncodingMappings.from_dict({"col": {"a": 0, "b": 1}})
+    mappings.save(str(tmp_path / "current"))
+    assert EncodingMappings.load(str(tmp_path / "current")).encoding_version == ENCODING_VERSION
+
+    # Compact mappings saved before the version was recorded
+    manifest = tmp_path / "current" / "manifest.json"
+    manifest.write_text(manifest.read_text().replace(f'"encoding_version": {ENCODING_VERSION}, ', ""))
+    assert EncodingMappings.load(str(tmp_path / "current")).encoding_version == 1
+
+    # Pickled mappings of the former format
+    np.save(str(tmp_path / "legacy.npy"), {"col": {"a": 0, "b": 1}})
+    assert convert_legacy_mappings(str(tmp_path / "legacy.npy"), str(tmp_path / "converted")).encoding_version == 1
+    assert EncodingMappings.load(str(tmp_path / "converted")).encoding_version == 1
+
+
+def test_mixed_key_types_are_rejected():
+    with pytest.raises(ValueError):
+        EncodingMappings.from_dict({"col": {5: 0, "5": 1}})
+
+    assert EncodingMappings.from_dict({"col": {5: 0, 7.5: 1}}).encode("col", [7.5, 5, "x"]).tolist() == [1, 0, -1]
+
+
+def test_saved_mappings_encode_unseen_values_as_unseen(tmp_path):
+    df = pd.DataFrame({"colA": ["x", "y", "y", "z", "z", "z"], "colB": [3, 1, 1, 2, 2, 2]})
+    _, encoding_mappings = frequency_encoding(df.copy(), columns=["colA", "colB"])
+    EncodingMappings.from_dict(encoding_mappings).save(str(tmp_path))
+
+    mappings = EncodingMappings.load(str(tmp_path))
+    assert mappings.to_dict() == encoding_mappings
+
+    new = pd.DataFrame({"colA": ["z", "unseen", None, "x"], "colB": [2, 9, np.nan, 3]})
+    encoded = mappings.transform(new.copy())
+    assert encoded["colA"].tolist() == [2, -1, -1, 0]
+    assert encoded["colB"].tolist() == [2, -1, -1, 0]
+    assert np.isnan(mappings.transform(new.copy(), unseen=np.nan)["colA"].iloc[1])
+    assert mappings.label_lookup("colA").tolist() == ["x", "y", "z"]
+
+
+def test_chunks_fitted_and_merged_in_row_order_match_fit_transform():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "colA": rng.choice([f"a{i}" for i in range(30)], 1000),
+        "colB": rng.choice(np.array([f"b{i}" for i in range(5)] + [None], dtype=object), 1000),
+    })
+    columns = ["colA", "colB"]
+
+    whole = FrequencyEncoder(columns)
+    expected = whole.fit_transform(df.copy())
+
+    # Two workers, each fitted on consecutive chunks, merged in row order
+    first, second = FrequencyEncoder(columns), FrequencyEncoder(columns)
+    for start in range(0, 500, 100):
+        first.partial_fit(df.iloc[start:start + 100])
+        second.partial_fit(df.iloc[500 + start:600 + start])
+    encoder = first.merge(second)
+    assert encoder.finalize() == whole.encoding_mappings == frequency_encoding(df.copy(), columns=columns)[1]
+
+    encoded = pd.concat([encoder.transform(df.iloc[start:start + 100].copy()) for start in range(0, 1000, 100)])
+    pd.testing.assert_frame_equal(encoded, expected)
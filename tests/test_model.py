@@ -0,0 +1,44 @@
+import numpy as np
+import xgboost as xgb
+from utils.model import BoosterPredictor
+from utils.model import continue_training
+from utils.model import save_model
+
+
+def data(n_classes, n_rows=300, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.integers(0, 20, size=(n_rows, 4)).astype(np.float32)
+    x[rng.random(x.shape) < 0.05] = np.nan  # Unseen categories
+    y = (np.nan_to_num(x[:, 0]) + rng.integers(0, 2, n_rows)).astype(int) % n_classes
+
+    return x, y
+
+
+def test_booster_predictor_matches_the_classifier(tmp_path):
+    for n_classes in [2, 4]:
+        x, y = data(n_classes)
+        model = xgb.XGBClassifier(n_estimators=10, max_depth=3).fit(x, y)
+
+        save_model(model, str(tmp_path), f"model_{n_classes}.joblib")
+        for predictor in [BoosterPredictor.from_classifier(model, n_threads=1), BoosterPredictor.load(str(tmp_path / f"model_{n_classes}.joblib"))]:
+            np.testing.assert_allclose(predictor.predict_proba(x), model.predict_proba(x), rtol=1e-6)
+            assert predictor.classes_.tolist() == model.classes_.tolist()
+
+
+def test_continue_training_adds_rounds_fitted_on_the_new_rows():
+    x, y = data(3)
+    model = xgb.XGBClassifier(n_estimators=5, max_depth=3).fit(x, y)
+    x_new, y_new = data(3, seed=1)
+    before = model.predict_proba(x_new)
+
+    continue_training(model, x_new, y_new, n_rounds=20)
+
+    assert model.get_params()["n_estimators"] == 25
+    assert model.get_booster().num_boosted_rounds() == 25
+    after = model.predict_proba(x_new)
+    assert after.shape == (len(x_new), 3)
+    np.testing.assert_allclose(after.sum(axis=1), 1, rtol=1e-5)
+
+    # Closer to the new labels than before
+    rows = np.arange(len(y_new))
+    assert np.log(after[rows, y_new]).mean() > np.log(before[rows, y_new]).mean()
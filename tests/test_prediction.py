@@ -0,0 +1,38 @@
+import numpy as np
+from utils.prediction import prediction_columns
+from utils.prediction import top_k
+from utils.prediction import top_k_frame
+
+
+def test_result_columns_are_grouped_predictions_then_probabilities():
+    proba = np.array([[0.1, 0.6, 0.3], [0.5, 0.2, 0.3]])
+    lookup = np.array(["S0", "S1", "S2"], dtype=object)
+
+    df = top_k_frame(proba, lookup, k=2)
+
+    assert list(df.columns) == ["prediction1", "prediction2", "probability1", "probability2"] == prediction_columns(2)
+    assert df["prediction1"].tolist() == ["S1", "S0"]
+    assert df["probability2"].tolist() == [0.3, 0.3]
+
+
+def test_columns_of_proba_are_mapped_through_classes():
+    # A model trained on 3 of the 5 encoded labels: its proba columns are the codes 4, 0, 2
+    proba = np.array([[0.2, 0.5, 0.3], [0.7, 0.1, 0.2]])
+    lookup = np.array(["S0", "S1", "S2", "S3", "S4"], dtype=object)
+
+    df = top_k_frame(proba, lookup, classes=np.array([4, 0, 2]), k=3)
+
+    assert df[prediction_columns(3)[:3]].values.tolist() == [["S0", "S2", "S4"], ["S4", "S2", "S0"]]
+    assert df["probability1"].tolist() == [0.5, 0.7]
+
+
+def test_top_k_is_sorted_and_capped_at_the_number_of_classes():
+    rng = np.random.default_rng(0)
+    proba = rng.random((100, 8))
+
+    indices, probabilities = top_k(proba, k=3)
+    np.testing.assert_array_equal(indices, np.argsort(-proba, axis=1)[:, :3])
+    np.testing.assert_array_equal(probabilities, -np.sort(-proba, axis=1)[:, :3])
+
+    indices, _ = top_k(proba[:, :2], k=3)
+    assert indices.shape == (100, 2)
@@ -0,0 +1,190 @@
+import joblib
+import os
+import re
+import shutil
+import uuid
+from configparser import ConfigParser
+from utils.backend import Model
+from utils.label_encoding import EncodingMappings
+from utils.label_encoding import download_mappings
+from utils.label_encoding import mappings_directory
+from utils.model import BoosterPredictor
+
+# Local cache of registered models and encoding mappings, so repeated predict runs on a node skip downloads and deserialization.
+# On disk: one folder per artifact, keyed by name, version and hash, evicted least recently used first above a size cap.
+# In process: loaded objects are memoized, for several plants predicted by one worker.
+
+# Read config
+config = ConfigParser()
+config.read('config.ini')
+
+CACHE_DIR = config.get('cache', 'directory', fallback='./.artifact_cache')
+CACHE_MAX_MB = config.getint('cache', 'max_size_mb', fallback=2048)
+
+
+def _directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, file)) for directory, _, files in os.walk(path) for file in files)
+
+
+def _find_file(directory: str, filename: str) -> str:
+    """Path of the first file named filename under directory"""
+
+    for root, _, files in os.walk(directory):
+        if filename in files:
+            return os.path.join(root, filename)
+
+    raise FileNotFoundError(f"{filename} not found in {directory}")
+
+
+class ArtifactCache:
+    """On-disk LRU cache of artifact folders, plus an in-process memo of the objects loaded from them"""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0  # Found on disk
+        self.misses = 0  # Fetched
+        self.memo_hits = 0  # Already loaded in this process
+        self._memo = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Folder name of an artifact, e.g. key("model", name, version, hash)"""
+
+        return "-".join(re.sub(r"[^A-Za-z0-9_.]", "_", str(part)) for part in parts)
+
+    def get(self, key: str, fetch) -> str:
+        """Folder of an artifact, filled by fetch(folder) on a miss"""
+
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            self.hits += 1
+            os.utime(path)  # Last use, for the LRU eviction
+            return path
+
+        self.misses += 1
+
+        # Fetch into a temporary folder first, so concurrent runs and failures never leave a partial artifact
+        tmp = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        try:
+            fetch(tmp)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+            # Another run cached it meanwhile
+
+        self.evict(keep=key)
+
+        return path
+
+    def evict(self, keep: str = None):
+        """Remove the least recently used artifacts until the cache fits in max_bytes"""
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != keep and not name.startswith(".tmp-") and os.path.isdir(path):
+                entries.append((os.path.getmtime(path), _directory_size(path), path))
+
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += _directory_size(os.path.join(self.directory, keep))
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def memoize(self, key: str, load):
+        """Object loaded by load(), once per process"""
+
+        if key in self._memo:
+            self.memo_hits += 1
+        else:
+            self._memo[key] = load()
+
+        return self._memo[key]
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        return f"artifact cache: {self.hits}/{lookups} disk hits ({hit_rate:.0%}), {self.memo_hits} in-process hits"
+
+
+_cache = None
+
+def get_cache() -> ArtifactCache:
+    """Cache shared by all the steps run in this process"""
+
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache()
+
+    return _cache
+
+
+def _model_artifact(ws, model_name: str) -> (str, object):
+    """Cache key of the latest registered version of a model, and a function returning the path of its joblib file"""
+
+    cache = get_cache()
+    registered = Model(ws, name=model_name)
+    key = cache.key("model", model_name, registered.version, registered.tags.get("fingerprint", ""))
+
+    def fetch(folder):
+        path = Model.get_model_path(model_name, version=registered.version, _workspace=ws)
+        if os.path.isdir(path):
+            shutil.copytree(path, os.path.join(folder, "model"))
+        else:
+            shutil.copy(path, folder)
+
+    return key, lambda: _find_file(cache.get(key, fetch), model_name)
+
+
+def cached_model(ws, model_name: str):
+    """Latest registered version of a model, cached by name, version and fingerprint tag"""
+
+    key, path = _model_artifact(ws, model_name)
+
+    return get_cache().memoize(key, lambda: joblib.load(path()))
+
+
+def cached_predictor(ws, model_name: str, n_threads: int = None) -> BoosterPredictor:
+    """BoosterPredictor of the latest registered version of a model, cached as cached_model"""
+
+    key, path = _model_artifact(ws, model_name)
+
+    return get_cache().memoize(f"{key}-predictor", lambda: BoosterPredictor.load(path(), n_threads))
+
+
+def cached_mappings(ws, datastore, plant: str, model_name: str = None) -> EncodingMappings:
+    """
+        Encoding mappings of a plant, cached by the fingerprint tag of the model trained with them.
+        Downloaded every time if the model has no fingerprint (registered by a former version).
+    """
+
+    cache = get_cache()
+    try:
+        fingerprint = Model(ws, name=model_name or f"{plant}_model.joblib").tags.get("fingerprint")
+    except Exception:
+        fingerprint = None
+
+    if not fingerprint:
+        return download_mappings(datastore, plant)
+
+    key = cache.key("mappings", plant, fingerprint)
+
+    def fetch(folder):
+        download_mappings(datastore, plant)
+        shutil.copytree(mappings_directory(plant), os.path.join(folder, "mappings"))
+
+    return cache.memoize(key, lambda: EncodingMappings.load(os.path.join(cache.get(key, fetch), "mappings")))
@@ -0,0 +1,14 @@
+import os
+
+# Azure ML classes used by the pipeline steps, or their local stand-ins (utils/local_backend.py) when PIPELINE_BACKEND=local
+
+BACKEND = os.environ.get("PIPELINE_BACKEND", "azure")
+
+if BACKEND == "local":
+    from utils.local_backend import Dataset
+    from utils.local_backend import Model
+    from utils.local_backend import Run
+else:
+    from azureml.core import Dataset
+    from azureml.core.model import Model
+    from azureml.core.run import Run
@@ -1,29 +1,54 @@
 import datetime
+import io
 import logger
+import os
 import pandas as pd
 import re
+import threading
 from configparser import ConfigParser
-from file_read_backwards import FileReadBackwards
+from contextlib import contextmanager
+from functools import lru_cache
 from sqlalchemy import create_engine 
+from sqlalchemy import event
 from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 
-# Logger
-myLogger = logger.getLogger(__name__)
+# config.ini and the logger are loaded on first use, so importing this module stays cheap
 
-# Read config
-config = ConfigParser()
-config.read('config.ini')
+@lru_cache(maxsize=None)
+def get_config() -> ConfigParser:
+    config = ConfigParser()
+    config.read('config.ini')
+
+    return config
+
+def _logger():
+    return logger.getLogger(__name__)
 
 
 class Connection:
     def __init__(self, mode):
         self.mode = mode
+        self.handshakes = 0  # Number of new DB connections opened by the engine
+        self._session = None  # Connection held by open_session() for all the calls of a step
         self.conn_engine = self.create_sqlache_config()
+        config = get_config()
+
+        # Non-critical status updates, buffered per id and written by a background thread (see update_status)
+        self.async_status = config.getboolean('status', 'async', fallback=False)
+        self.status_flush_interval = config.getfloat('status', 'flush_interval', fallback=2.0)
+        self._pending_status = {}  # id -> {column: value}, later values replace earlier ones
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Keeps the order of buffered and direct writes
+        self._status_event = threading.Event()
+        self._status_thread = None
 
     def create_sqlache_config(self):
         """
             Connect to different database environment with respect to mode
         """
+
+        config = get_config()
         if self.mode == "prd":
             HOST = config.get('database', 'host')
             DATABASE = config.get('database', 'database')
@@ -38,23 +63,107 @@ class Connection:
             USER = config.get('database_QAS', 'user')
             PASSWORD = config.get('database_QAS', 'password')
 
-        # Create a connection engine
+        # Create a connection engine, with pool sizing, pre-ping and TCP keepalive from config
         engine_config = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}"
-        conn_engine = create_engine(engine_config)
+        conn_engine = create_engine(engine_config,
+                                    pool_size=config.getint('database_pool', 'pool_size', fallback=5),
+                                    max_overflow=config.getint('database_pool', 'max_overflow', fallback=10),
+                                    pool_timeout=config.getint('database_pool', 'pool_timeout', fallback=30),
+                                    pool_recycle=config.getint('database_pool', 'pool_recycle', fallback=-1),
+                                    pool_pre_ping=config.getboolean('database_pool', 'pool_pre_ping', fallback=False),
+                                    connect_args={
+                                        "keepalives": 1,
+                                        "keepalives_idle": config.getint('database_pool', 'keepalives_idle', fallback=60),
+                                        "keepalives_interval": config.getint('database_pool', 'keepalives_interval', fallback=10),
+                                        "keepalives_count": config.getint('database_pool', 'keepalives_count', fallback=5),
+                                    })
+
+        # Count handshakes, i.e. new DBAPI connections (pooled check-outs are not counted)
+        event.listen(conn_engine, "connect", self._count_handshake)
 
         return conn_engine
+
+    def _count_handshake(self, dbapi_connection, connection_record):
+        self.handshakes += 1
+
+    @contextmanager
+    def connect(self):
+        """
+            Yield the connection held by open_session(), or check out one from the pool
+        """
+
+        if self._session is not None and (self._session.closed or self._session.invalidated):  # Reconnect if the held connection was lost
+            self._release_session()
+            self.open_session()
+
+        if self._session is not None:
+            yield self._session
+        else:
+            with self.conn_engine.connect() as conn:
+                yield conn
+
+    def open_session(self):
+        """
+            Hold one connection for all following calls until close_session().
+            If the DB cannot be reached, the error is logged and the calls check out pooled connections instead.
+        """
+
+        if self._session is None:
+            try:
+                self._session = self.conn_engine.connect()
+            except:
+                _logger().exception("open_session connection failed, using pooled connections")
+                self._session = None
+
+    def _release_session(self):
+        """
+            Close the held connection, even if it was lost
+        """
+
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                session.close()
+            except:
+                _logger().exception("Closing the held connection failed")
+
+    def close_session(self):
+        """
+            Release the held connection and log the number of handshakes so far
+        """
+
+        self.stop_status_flusher()
+        self._release_session()
+        _logger().info(f"DB connection handshakes: {self.handshakes}")
+
+    @contextmanager
+    def session(self):
+        """
+            Scope in which all calls share one connection
+        """
+
+        opened = self._session is None
+        self.open_session()
+        try:
+            yield self
+        finally:
+            if opened:
+                self.close_session()
     
-    def execute_sql(self, command):
+    def execute_sql(self, command, params=None):
         """
-            Execute SQL command
+            Execute SQL command, with optional bound parameters of a text() command
         """
         
         try: 
-            with self.conn_engine.connect() as conn:
-                conn.execute(command)
+            with self.connect() as conn:
+                if params is None:
+                    conn.execute(command)
+                else:
+                    conn.execute(command, params)
 
         except:
-            myLogger.exception("execute_sql connection failed")
+            _logger().exception("execute_sql connection failed")
 
             
     def fetch_control_table(self, plant) -> pd.DataFrame:
@@ -65,104 +174,326 @@ class Connection:
         command = f"""SELECT * FROM sourcer.analysis_console WHERE (data_ready = 'Y' and ai_process is Null and plant = '{plant}') ORDER BY mrp_run_date DESC LIMIT 1"""
         
         try: 
-            with self.conn_engine.connect() as conn:
+            with self.connect() as conn:
                 df_control_table = pd.read_sql(sql=command, con=conn)
                 
             return df_control_table
 
         except:
-            myLogger.exception("fetch_control_table connection failed")
+            _logger().exception("fetch_control_table connection failed")
+
+
+    def _mrp_sourcer_code_query(self, select, plant, mrp_run_date, batch_id, post_datetime):
+        """
+            Build a parameterized query on mrp_sourcer_code_analysis for one batch
+        """
+
+        command = text(f"""SELECT {select} FROM sourcer.mrp_sourcer_code_analysis 
+                            WHERE plant = :plant 
+                            And mrp_run_date = :mrp_run_date
+                            And batch_id = :batch_id 
+                            And post_datetime = :post_datetime""")
+        params = {"plant": plant, "mrp_run_date": mrp_run_date, "batch_id": batch_id, "post_datetime": post_datetime}
+
+        return command, params
+
+    @staticmethod
+    def _identifier(name) -> str:
+        """
+            Validate a column or (schema.)table name, only plain identifiers are accepted
+        """
+
+        if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?", name) is None:
+            raise ValueError(f"Invalid identifier: {name}")
+
+        return name
+
+    @staticmethod
+    def _projection(columns) -> str:
+        """
+            Column list for SELECT, only plain identifiers are accepted
+        """
 
+        if not columns:
+            return "*"
 
-    def fetch_mrp_sourcer_code_table(self, plant, mrp_run_date, batch_id, post_datetime) -> pd.DataFrame:
+        return ", ".join(Connection._identifier(column) for column in columns)
+
+    def fetch_mrp_sourcer_code_table(self, plant, mrp_run_date, batch_id, post_datetime, columns=None) -> pd.DataFrame:
         """
             Fetch data from mrp_sourcer_code_analysis table
         """
 
-        command = f"""SELECT * FROM sourcer.mrp_sourcer_code_analysis 
-                            WHERE plant = '{plant}' 
-                            And mrp_run_date = '{mrp_run_date}'
-                            And batch_id = '{batch_id}' 
-                            And post_datetime = '{post_datetime}'"""
+        command, params = self._mrp_sourcer_code_query(self._projection(columns), plant, mrp_run_date, batch_id, post_datetime)
 
         try: 
-            with self.conn_engine.connect() as conn:
-                df_mrp_sourcer_code = pd.read_sql(sql = command, con=conn)
+            with self.connect() as conn:
+                df_mrp_sourcer_code = pd.read_sql(sql = command, con=conn, params=params)
             
             return df_mrp_sourcer_code
 
         except:
-            myLogger.exception("fetch_mrp_sourcer_code_table connection failed")
+            _logger().exception("fetch_mrp_sourcer_code_table connection failed")
 
 
-    def update_analysis_console(self, id, column_name, value):
+    def count_mrp_sourcer_code_table(self, plant, mrp_run_date, batch_id, post_datetime) -> int:
         """
-            Update column_name status to value in analysis_console table
+            Count rows of one batch in mrp_sourcer_code_analysis table
         """
 
-        command = f"""UPDATE sourcer.analysis_console SET {column_name} = '{value}' 
-                      WHERE (id = '{id}')"""
-        
+        command, params = self._mrp_sourcer_code_query("COUNT(*)", plant, mrp_run_date, batch_id, post_datetime)
+
         try: 
-            with self.conn_engine.connect() as conn:
-                conn.execute(command)
+            with self.connect() as conn:
+                return conn.execute(command, params).scalar()
 
         except:
-            myLogger.exception("update_analysis_console connection failed")
+            _logger().exception("count_mrp_sourcer_code_table connection failed")
 
 
-    def update_ai_process(self, id, status):
+    def stream_mrp_sourcer_code_table(self, plant, mrp_run_date, batch_id, post_datetime, columns=None, chunksize=100000):
         """
-            Update AI process status in analysis_console table
+            Yield data from mrp_sourcer_code_analysis table in DataFrame chunks, read through a server-side cursor
         """
 
-        command = f"""UPDATE sourcer.analysis_console SET ai_process='{status}'
-                      WHERE (id='{id}')"""
-        
+        command, params = self._mrp_sourcer_code_query(self._projection(columns), plant, mrp_run_date, batch_id, post_datetime)
+
+        # A dedicated connection, so the held session stays usable while the cursor is open
         try: 
             with self.conn_engine.connect() as conn:
-                conn.execute(command)
+                conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+                for chunk in pd.read_sql(sql=command, con=conn, params=params, chunksize=chunksize):
+                    yield chunk
 
-        except:
-            myLogger.exception(f"update_analysis_console connection failed in step: {status}")
+        except Exception:  # Not GeneratorExit, raised here when the consumer stops early
+            _logger().exception("stream_mrp_sourcer_code_table connection failed")
+            raise
 
 
-    def read_log_file_and_upload_to_DB(self, plant, source_file="predict_classification.py"):
+    @staticmethod
+    def _copy_rows(cursor, df, table, columns, chunksize):
         """
-            Read a log file containing recent logs and upload them to Postgresql DB
+            Stream a DataFrame into a table with COPY FROM STDIN, one in-memory CSV buffer per chunk
+        """
+
+        command = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        for start in range(0, len(df), chunksize):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunksize].to_csv(buffer, index=False, header=False, na_rep='\\N')
+            buffer.seek(0)
+            cursor.copy_expert(command, buffer)
+
+    @staticmethod
+    def _execute_values_rows(cursor, df, table, columns, chunksize):
+        """
+            Insert a DataFrame into a table with batched multi-row INSERTs
         """
-        
-        filepath = "./logs/predict_classification.log"
-        # Fetch the most recent logs
-        list_uploads = []  # A list for gathering contents to be uploaded
 
-        # We use FileReadBackwards to read a log file in reverse order because we only need to read recent (latest) logs from the end of the file.
-        # What's more, we don't have to read the whole contents of the file in case the file size is getting larger and larger.
-        # https://stackoverflow.com/questions/2301789/how-to-read-a-file-in-reverse-order
+        from psycopg2 import extras
+
+        command = f"INSERT INTO {table} ({columns}) VALUES %s"
+        for start in range(0, len(df), chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            chunk = chunk.astype(object).where(chunk.notna(), None)  # Python values, NAs as NULL
+            extras.execute_values(cursor, command, chunk.itertuples(index=False, name=None), page_size=len(chunk))
+
+    def upsert_dataframe(self, df, table, key="series_id", method="copy", chunksize=100000) -> int:
+        """
+            Bulk load a DataFrame into a staging table, then replace the rows of the same key values in the target table
+            in one transaction, so re-running an upload is idempotent. method: "copy" (falls back to "execute_values")
+        """
+
+        table = self._identifier(table)
+        key = self._identifier(key)
+        columns = self._projection(list(df.columns))
+        loaders = {"copy": self._copy_rows, "execute_values": self._execute_values_rows}
+        methods = [method] if method == "execute_values" else ["copy", "execute_values"]
+
+        for i, name in enumerate(methods):
+            raw_conn = self.conn_engine.raw_connection()
+            try:
+                with raw_conn.cursor() as cursor:
+                    cursor.execute(f"CREATE TEMP TABLE upload_staging (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                    loaders[name](cursor, df, "upload_staging", columns, chunksize)
+                    cursor.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT DISTINCT {key} FROM upload_staging)")
+                    cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM upload_staging")
+                raw_conn.commit()
+                _logger().info(f"Uploaded {len(df)} rows to {table} with {name}")
+
+                return len(df)
+
+            except:
+                raw_conn.rollback()
+                if i + 1 < len(methods):
+                    _logger().exception(f"upsert_dataframe with {name} failed, falling back to {methods[i + 1]}")
+                else:
+                    _logger().exception(f"upsert_dataframe with {name} failed")
+
+            finally:
+                raw_conn.close()
+
+
+    def _write_status(self, id, columns, conn=None, retry=False):
+        """
+            One UPDATE of several analysis_console columns of an id, with bound parameters.
+            retry: on a DB error, write once more on a fresh connection (critical statuses, the held session may have been
+            dropped by the server while the step was busy, pre-ping and recycling only apply to check-outs)
+        """
+
+        assignments = ", ".join(f"{self._identifier(column)} = :value_{i}" for i, column in enumerate(columns))
+        command = text(f"""UPDATE sourcer.analysis_console SET {assignments} WHERE (id = :id)""")
+        params = {"id": str(id), **{f"value_{i}": value for i, value in enumerate(columns.values())}}
+
+        for attempt in range(2 if retry else 1):
+            try:
+                if conn is None:
+                    with self.connect() as c:
+                        c.execute(command, params)
+                else:
+                    conn.execute(command, params)
+                return
+
+            except DBAPIError:
+                if attempt == 0 and retry:
+                    _logger().warning(f"update_status failed for columns: {', '.join(columns)}, retrying on a fresh connection", exc_info=True)
+                    if self._session is not None:  # A lost pooled connection is invalidated, the next check-out is a fresh one
+                        self._release_session()
+                        self.open_session()
+                    conn = None
+                else:
+                    _logger().exception(f"update_status connection failed for columns: {', '.join(columns)}")
+
+            except:
+                _logger().exception(f"update_status connection failed for columns: {', '.join(columns)}")
+                return
+
+    def update_status(self, id, critical=True, **columns):
+        """
+            Update columns of analysis_console for an id in one statement, e.g. update_status(id, ai_process="Y", data_ready="Y").
+            With [status] async = true, non-critical updates (progress) are buffered and written by a background thread;
+            critical updates are written at once, together with the buffered updates of the same id.
+        """
+
+        if not critical and self.async_status:
+            with self._pending_lock:
+                self._pending_status.setdefault(id, {}).update(columns)
+            self._start_status_flusher()
+            self._status_event.set()
+            return
+
+        with self._flush_lock:
+            with self._pending_lock:
+                columns = {**self._pending_status.pop(id, {}), **columns}
+            self._write_status(id, columns, retry=True)
+
+    def flush_status(self, conn=None):
+        """
+            Write the buffered status updates, one statement per id
+        """
+
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending_status = self._pending_status, {}
+            for id, columns in pending.items():
+                self._write_status(id, columns, conn)
+
+    def _start_status_flusher(self):
+        if self._status_thread is None:
+            self._status_thread = threading.Thread(target=self._status_flusher, name="status-flusher", daemon=True)
+            self._status_thread.start()
+
+    def _status_flusher(self):
+        """
+            Background thread of the buffered status updates, using its own pooled connection (the held session is not thread-safe)
+        """
+
+        while self._status_thread is not None:
+            self._status_event.wait(self.status_flush_interval)
+            self._status_event.clear()
+            if self._pending_status:
+                try:
+                    with self.conn_engine.connect() as conn:
+                        self.flush_status(conn)
+                except:
+                    _logger().exception("Status flush failed")
+
+    def stop_status_flusher(self):
+        """
+            Stop the background thread and write what is still buffered
+        """
+
+        thread, self._status_thread = self._status_thread, None
+        if thread is not None:
+            self._status_event.set()
+            thread.join()
+        self.flush_status()
+
+    def update_analysis_console(self, id, column_name, value):
+        """
+            Update column_name status to value in analysis_console table
+        """
+
+        self.update_status(id, **{column_name: value})
+
+
+    def update_ai_process(self, id, status, critical=True):
+        """
+            Update AI process status in analysis_console table, critical=False for progress statuses that may be written asynchronously
+        """
+
+        self.update_status(id, critical=critical, ai_process=status)
+
+
+    def read_log_file_and_upload_to_DB(self, plant, source_file="predict_classification.py", minutes=15):
+        """
+            Read the recent logs (of every process writing the log file) and upload them to Postgresql DB in one parameterized insert
+        """
+
+        logger.flush()  # Records still queued are written to the file first
+        since = datetime.datetime.now() - datetime.timedelta(minutes=minutes)
+
+        # Read from the end of the file, so only the recent logs are read even if the file is large
+        list_uploads = []
         try:
-            with FileReadBackwards(filepath, encoding="utf-8") as f:
-                # Get lines by lines starting from the last line up
-                for line in f:
-                    # We use regular expression to get contents with matched datetime format in order to fetch recent logs (currently from now to up to 15 minutes ago)
-                    # https://docs.python.org/3/library/re.html
-                    m = re.match(r"\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d", line)
-                    if m is not None:  # If this line has a matched datetime format
-                        time = datetime.datetime.strptime(m[0], "%Y-%m-%d %H:%M:%S")
-                        if time > datetime.datetime.now() - datetime.timedelta(minutes=15):  # We only fetch recent logs, not others
-                            #print(f"Matched time: {time}")
-                            list_uploads.append(line)
-                        else:  # This line has outdated time stamp which we don't want
-                            break
-                    else:  # Perhaps this line does not contain a time stamp, but is actually followed by a line with matched time stamp
-                        list_uploads.append(line)
+            for line in _lines_backwards(os.path.join(logger.LOG_DIR, "predict_classification.log"), logger.BACKUP_COUNT):
+                m = re.match(r"\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d", line)
+                if m is None:  # A line without time stamp, e.g. of a traceback, is part of the record logged before it
+                    list_uploads.append(line)
+                elif datetime.datetime.strptime(m[0], "%Y-%m-%d %H:%M:%S") > since:
+                    list_uploads.append(line)
+                else:  # The first outdated record, the earlier ones are older
+                    break
         except:
-            myLogger.exception(f"An error while proceeding a log file.")
+            _logger().exception("An error while proceeding a log file.")
 
-        # Because contents in the list are appended in reverse order, we reverse them back to be in chronological order. 
-        # Then, we use 'newline' to join all contents to a string
-        str_uploads = '\n'.join(list(reversed(list_uploads)))
-        #print(f"str_uploads: {str_uploads}")
+        # Read in reverse order, joined in chronological order
+        str_uploads = '\n'.join(reversed(list_uploads))
 
         # We upload logs to Postgresql DB
-        command = f"""INSERT INTO sourcer.log_message (update_time, plant, message, source_file, status) VALUES ('{datetime.datetime.now()}', '{plant}', '{str_uploads}', '{source_file}', 'undone')"""
-        self.execute_sql(text(command))
\ No newline at end of file
+        command = text("""INSERT INTO sourcer.log_message (update_time, plant, message, source_file, status) VALUES (:update_time, :plant, :message, :source_file, 'undone')""")
+        self.execute_sql(command, {"update_time": datetime.datetime.now(), "plant": plant, "message": str_uploads, "source_file": source_file})
+
+
+def _lines_backwards(filepath, backup_count):
+    """
+        Lines of a log file from the last one up, followed by those of its rotated backups (filepath.1, filepath.2, ...)
+    """
+
+    from file_read_backwards import FileReadBackwards
+
+    for i in range(backup_count + 1):
+        path = filepath if i == 0 else f"{filepath}.{i}"
+        if not os.path.exists(path):
+            return
+
+        with FileReadBackwards(path, encoding="utf-8") as f:
+            yield from f
+
+
+@lru_cache(maxsize=None)
+def shared_connection(mode) -> Connection:
+    """
+        Connection of a mode shared by all the steps run in this process, so fused steps (pipeline/fused.py) reuse one engine and its pooled connections
+    """
+
+    return Connection(mode)
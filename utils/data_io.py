@@ -0,0 +1,233 @@
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from utils.handoff import take
+from utils.instrumentation import phase
+
+# Intermediate data passed between pipeline steps (preprocessed, train, inference, result) as CSV or Parquet
+
+# Read config
+config = ConfigParser()
+config.read('config.ini')
+
+FORMAT = config.get('data', 'format', fallback='csv')
+COMPRESSION = config.get('data', 'compression', fallback='snappy')
+UPLOAD_WORKERS = config.getint('data', 'upload_workers', fallback=3)
+
+EXTENSIONS = {"csv": "csv", "parquet": "parquet"}
+
+# Explicit dtypes of the intermediate data, so Parquet keeps them across steps
+FEATURE_COLUMNS = ["colA", "colB", "colC", "colD", "colE", "colF", "colG"]
+SCHEMA = {**{col: "category" for col in FEATURE_COLUMNS}, "sourcer_code": "object"}
+CSV_DTYPES = {col: str for col in SCHEMA}  # Read as strings, so "5" is not a number in some chunks and a string in others
+
+
+def local_path(kind: str, plant: str, fmt: str = FORMAT) -> str:
+    """Local path of an intermediate file, e.g. ./data/train/<plant>_train.parquet"""
+
+    return f"./data/{kind}/{plant}_{kind}.{EXTENSIONS[fmt]}"
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast the known columns to their intermediate dtypes"""
+
+    return df.astype({col: dtype for col, dtype in SCHEMA.items() if col in df.columns})
+
+
+def parquet_schema(schema):
+    """
+        Schema of a Parquet file written chunk by chunk, from the schema of its first chunk: the columns of SCHEMA are strings,
+        and columns without values in the first chunk (null type) are strings, so the values of later chunks fit
+    """
+
+    import pyarrow as pa
+
+    for i, field in enumerate(schema):
+        if field.name in SCHEMA or pa.types.is_null(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+
+    return schema
+
+
+class FrameWriter:
+    """Write a frame to one CSV or Parquet file, at once or chunk by chunk"""
+
+    def __init__(self, path: str, fmt: str = FORMAT):
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unknown data format: {fmt}")
+
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        self._writer = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, df: pd.DataFrame):
+        if self.fmt == "csv":
+            df.to_csv(self.path, index=False, mode='w' if self._writer is None else 'a', header=self._writer is None)
+            self._writer = self.path
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Categories of the chunks differ, so features are stored as strings and made categorical again by read_frame
+            df = df.astype({col: "object" for col, dtype in SCHEMA.items() if dtype == "category" and col in df.columns})
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, parquet_schema(table.schema), compression=COMPRESSION)
+
+            # Each chunk is cast to the schema of the file, e.g. a column without values in the first chunk
+            self._writer.write_table(table.cast(self._writer.schema))
+
+        self.rows += len(df)
+
+    def close(self):
+        if self.fmt == "parquet" and self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_frame(df: pd.DataFrame, path: str, fmt: str = FORMAT):
+    """Write a whole frame to CSV or Parquet"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if fmt == "parquet":
+        apply_schema(df).to_parquet(path, index=False, compression=COMPRESSION)
+    else:
+        with FrameWriter(path, fmt) as writer:
+            writer.write(df)
+
+
+def read_frame(path: str, fmt: str = FORMAT, columns: list = None) -> pd.DataFrame:
+    """Read a frame written by write_frame or FrameWriter, optionally only some of its columns"""
+
+    if fmt == "parquet":
+        return apply_schema(pd.read_parquet(path, columns=columns))
+    elif fmt == "csv":
+        return pd.read_csv(path, usecols=columns, dtype=CSV_DTYPES)
+    else:
+        raise ValueError(f"Unknown data format: {fmt}")
+
+
+def register_frame(ws, datastore, path: str, target_path: str, name: str, fmt: str = FORMAT):
+    """Upload a local file to blob storage and register it as a tabular dataset"""
+
+    # Upload to blob storage
+    with phase("blob_upload"):
+        datastore.upload_files(files=[path], target_path=target_path, overwrite=True)
+
+    # Register dataset
+    with phase("dataset_registration"):
+        from utils.backend import Dataset  # Imported on use, azureml is slow to import
+
+        blob_path = datastore.path(f"./{target_path}/{os.path.basename(path)}")  # Different with local path
+        if fmt == "parquet":
+            tabular = Dataset.Tabular.from_parquet_files(blob_path)
+        else:
+            tabular = Dataset.Tabular.from_delimited_files(blob_path)
+
+        return tabular.register(workspace=ws, name=name, create_new_version=True)
+
+
+class UploadPipeline:
+    """
+        Write, upload and register intermediate frames in a thread pool: the frames are serialized at the same time,
+        and the upload of one overlaps the serialization of the next
+    """
+
+    def __init__(self, ws, datastore, max_workers: int = UPLOAD_WORKERS, fmt: str = FORMAT):
+        self.ws = ws
+        self.datastore = datastore
+        self.fmt = fmt
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        self._futures = {}
+
+    def _write_and_register(self, df: pd.DataFrame, path: str, target_path: str, name: str):
+        with phase("write", rows=len(df)):
+            write_frame(df, path, self.fmt)
+
+        return register_frame(self.ws, self.datastore, path, target_path, name, self.fmt)
+
+    def write_and_register(self, df: pd.DataFrame, path: str, target_path: str, name: str):
+        """Write df to path, upload and register it in the background, df must not be modified meanwhile"""
+
+        self._futures[name] = self._executor.submit(self._write_and_register, df, path, target_path, name)
+
+        return self._futures[name]
+
+    def register(self, path: str, target_path: str, name: str):
+        """Upload and register an already written file in the background"""
+
+        self._futures[name] = self._executor.submit(register_frame, self.ws, self.datastore, path, target_path, name, self.fmt)
+
+        return self._futures[name]
+
+    def wait(self) -> dict:
+        """Registered dataset of each name, raise the first error"""
+
+        return {name: future.result() for name, future in self._futures.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown(wait=True)
+
+
+def iter_frames(path: str, fmt: str = FORMAT, columns: list = None, chunksize: int = 100000):
+    """Yield a file written by write_frame or FrameWriter in frames of at most chunksize rows, with a continuous row index"""
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        n_rows = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            df = apply_schema(batch.to_pandas())
+            df.index = pd.RangeIndex(n_rows, n_rows + len(df))
+            n_rows += len(df)
+            yield df
+    elif fmt == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=CSV_DTYPES)
+    else:
+        raise ValueError(f"Unknown data format: {fmt}")
+
+
+def download_frame(datastore, kind: str, plant: str, fmt: str = FORMAT) -> str:
+    """Download an intermediate file uploaded by register_frame, return its local path"""
+
+    path = local_path(kind, plant, fmt)
+    datastore.download(target_path="./data", prefix=f"{kind}/{os.path.basename(path)}", overwrite=True)
+
+    return path
+
+
+def load_frame(ws, datastore, name: str, kind: str, plant: str, fmt: str = FORMAT, columns: list = None) -> pd.DataFrame:
+    """
+        Load an intermediate frame written by another step, optionally only some of its columns.
+        Fused steps: the frame handed over in process by the previous step; else
+        csv: through the registered dataset; parquet: download the file and read it with its stored dtypes
+    """
+
+    df = take(name)
+    if df is not None:
+        if columns is not None:
+            df = df[columns]
+        return apply_schema(df) if fmt == "parquet" else df
+
+    if fmt == "parquet":
+        return read_frame(download_frame(datastore, kind, plant, fmt), fmt, columns=columns)
+
+    from utils.backend import Dataset
+
+    dataset = Dataset.get_by_name(workspace=ws, name=name)
+    if columns is not None:
+        dataset = dataset.keep_columns(columns)
+
+    return dataset.to_pandas_dataframe()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# Dtype policy of the frames of the pipeline steps, so larger plants fit in memory:
+# encoded codes use the smallest int type holding them (float32 if they have NaNs), raw string columns are categoricals
+
+INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+FLOAT32_EXACT = 2 ** 24  # Integers up to this value are exact in float32
+
+
+def smallest_int(min_value: int, max_value: int) -> np.dtype:
+    """Smallest signed int type holding min_value to max_value"""
+
+    for dtype in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return np.dtype(dtype)
+
+    raise OverflowError(f"No int type holds {min_value} to {max_value}")
+
+
+def float_codes(max_value: int) -> np.dtype:
+    """Float type of codes with NaNs up to max_value: float32 while exact"""
+
+    return np.dtype(np.float32) if max_value < FLOAT32_EXACT else np.dtype(np.float64)
+
+
+def compact_codes(codes) -> np.ndarray:
+    """
+        Codes in the smallest int type of their range (-1 for unseen values included).
+        Codes with NaNs (NA values, missing for XGBoost) stay float, as float32 while exact.
+    """
+
+    codes = np.asarray(codes)
+    if len(codes) == 0:
+        return codes.astype(np.int8)
+
+    if codes.dtype.kind == "f":
+        na = np.isnan(codes)
+        if na.any():
+            return codes.astype(float_codes(np.abs(codes[~na]).max() if not na.all() else 0))
+        codes = codes.astype(np.int64)
+
+    return codes.astype(smallest_int(codes.min(), codes.max()), copy=False)
+
+
+def categorical(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Convert the string (object) columns among columns to categoricals, in place"""
+
+    for col in columns:
+        if col in df.columns and pd.api.types.is_string_dtype(df[col].dtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+
+    return df
+
+
+def memory_mb(df: pd.DataFrame) -> float:
+    """Memory of a frame in MB, strings included"""
+
+    return df.memory_usage(index=True, deep=True).sum() / 1024 ** 2
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+
+# Content fingerprints of the training data, used to skip retraining when the data did not change
+
+FINGERPRINT_VERSION = "1"  # Bump when the training step changes in a way that requires retraining
+TRAIN_COLUMNS = ["colA", "colB", "colC", "colD", "colE", "colF", "colG", "sourcer_code"]
+
+
+def row_hashes(df: pd.DataFrame, columns: list = TRAIN_COLUMNS) -> np.ndarray:
+    """One uint64 hash per row of the given columns, the same for object and categorical columns"""
+
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def frame_fingerprint(hashes: np.ndarray, columns: list = TRAIN_COLUMNS) -> str:
+    """sha256 of the sorted row hashes, so the fingerprint does not depend on the row order of the query"""
+
+    h = hashlib.sha256()
+    h.update(FINGERPRINT_VERSION.encode())
+    h.update(json.dumps(columns).encode())
+    h.update(np.sort(hashes).astype("<u8").tobytes())
+
+    return h.hexdigest()
+
+
+def combine_fingerprints(*fingerprints) -> str:
+    return hashlib.sha256("|".join(fingerprints).encode()).hexdigest()
+
+
+def training_cache_key(data_fingerprint: str, *parts) -> str:
+    """Cache key of trained models: the data fingerprint combined with parts (e.g. the encoding version), "" without a data fingerprint"""
+
+    if not data_fingerprint:
+        return ""
+
+    return combine_fingerprints(data_fingerprint, *(str(part) for part in parts))
+
+
+def is_cached(ws, key: str, model_names: list) -> bool:
+    """Whether all models are registered with the cache key, never for an empty key (data fingerprint unknown)"""
+
+    return bool(key) and all(registered_fingerprint(ws, model_name) == key for model_name in model_names)
+
+
+def write_fingerprint(directory: str, fingerprint: str, **info):
+    """Save a fingerprint with extra information (e.g. cache_hit) as <directory>/fingerprint.json"""
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "fingerprint.json"), "w") as f:
+        json.dump({"fingerprint": fingerprint, **info}, f)
+
+
+def read_fingerprint(directory: str) -> dict:
+    """Load <directory>/fingerprint.json, or an empty dict if there is none"""
+
+    path = os.path.join(directory, "fingerprint.json")
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def registered_fingerprint(ws, model_name: str) -> str:
+    """Fingerprint tag of the latest registered version of a model, None if there is no such model or tag"""
+
+    from utils.backend import Model  # Imported on use, azureml is slow to import
+
+    try:
+        return Model(ws, name=model_name).tags.get("fingerprint")
+    except Exception:
+        return None
@@ -0,0 +1,44 @@
+import logger
+
+# In-process handoff of frames, models and encoding mappings between pipeline steps fused in one process (pipeline/fused.py),
+# so a step takes what the previous one produced instead of downloading it again.
+# Disabled when a step runs on its own: nothing is kept, and every step loads its inputs from the workspace.
+
+myLogger = logger.getLogger(__name__)
+
+_enabled = False
+_objects = {}  # key (dataset, model or mappings name) -> object handed over by a previous step
+
+
+def enable():
+    """Keep the objects handed over from now on, called by pipeline/fused.py before the first step"""
+
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def hand_over(key: str, obj):
+    """Make obj available to the next steps of this process, once, under key"""
+
+    if _enabled:
+        _objects[key] = obj
+
+
+def take(key: str):
+    """Object handed over under key by a previous step (removed, so it is freed with its user), None if there is none"""
+
+    obj = _objects.pop(key, None)
+    if obj is not None:
+        myLogger.info(f"{key} handed over in process")
+
+    return obj
+
+
+def clear():
+    """Drop the objects not taken, e.g. the models of a plant whose predict step did not run"""
+
+    _objects.clear()
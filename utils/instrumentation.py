@@ -0,0 +1,172 @@
+import json
+import logger
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextlib import nullcontext
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-step phase metrics (wall time, CPU time, peak RSS, rows) and frame memory, emitted to the log, to the Azure ML run and to ./logs/metrics/<step>_<plant>_<time>.json
+# Optional profile of the whole step with cProfile or pyinstrument, saved in ./logs/profiles
+
+myLogger = logger.getLogger(__name__)
+
+METRICS_DIR = "./logs/metrics"
+PROFILES_DIR = "./logs/profiles"
+
+_active = None  # StepMetrics of the running step, used by phase()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far, in MB (None if unknown)"""
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+class StepMetrics:
+    """Metrics of the phases of one pipeline step, phases with the same name (e.g. per chunk) are summed"""
+
+    def __init__(self, step: str, plant: str, run=None, profile: str = "none"):
+        self.step = step
+        self.plant = plant
+        self.run = run  # Azure ML run of the step, metrics are sent with run.log
+        self.profile = profile  # none, cprofile or pyinstrument
+        self.phases = {}
+        self.frames = {}  # Memory of the main frames of the step, the largest of each name (e.g. per batch)
+        self._lock = threading.Lock()  # Phases of threads (e.g. concurrent training) update the same records
+        self._profiler = None
+        self._start = None
+
+    def start(self):
+        """Start timing the step (and profiling it), and make it the target of phase()"""
+
+        global _active
+        _active = self
+        self._start = (time.perf_counter(), time.process_time())
+
+        if self.profile == "cprofile":
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.profile == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+                self._profiler = Profiler()
+                self._profiler.start()
+            except ImportError:
+                myLogger.warning("pyinstrument is not installed, the step is not profiled")
+
+        return self
+
+    @contextmanager
+    def phase(self, name: str, rows: int = None):
+        """Time a block, rows can also be set through the yielded dict: with metrics.phase("fetch") as p: p["rows"] = len(df)"""
+
+        info = {"rows": rows}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield info
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu  # CPU time of the whole process, all threads
+            with self._lock:
+                record = self.phases.setdefault(name, {"calls": 0, "wall_sec": 0.0, "cpu_sec": 0.0, "rows": None})
+                record["calls"] += 1
+                record["wall_sec"] += wall
+                record["cpu_sec"] += cpu
+                record["peak_rss_mb"] = peak_rss_mb()
+                if info["rows"] is not None:
+                    record["rows"] = (record["rows"] or 0) + info["rows"]
+
+            rows = f", {info['rows']} rows ({info['rows'] / max(wall, 1e-9):,.0f} rows/sec)" if info["rows"] is not None else ""
+            myLogger.info(f"[{self.step}] {name}: {wall:.2f} sec wall, {cpu:.2f} sec CPU, peak RSS {record['peak_rss_mb'] or 0:.0f} MB{rows}")
+
+    def frame(self, name: str, df):
+        """Record the memory of a frame, and log it with its dtypes"""
+
+        from utils.dtypes import memory_mb
+
+        mb = memory_mb(df)
+        dtypes = df.dtypes.astype(str).value_counts().to_dict()
+        with self._lock:
+            record = self.frames.get(name)
+            if record is None or mb >= record["memory_mb"]:
+                self.frames[name] = {"rows": len(df), "memory_mb": mb, "dtypes": dtypes}
+
+        myLogger.info(f"[{self.step}] frame {name}: {len(df)} rows, {mb:.1f} MB ({', '.join(f'{n} {dtype}' for dtype, n in dtypes.items())})")
+
+    def _log_run(self, name: str, value):
+        if self.run is None or value is None:
+            return
+
+        try:
+            self.run.log(name, value)
+        except Exception:
+            myLogger.warning(f"Could not log metric {name} to the run", exc_info=True)
+
+    def finish(self) -> str:
+        """Stop the profiler, send the metrics to the run and save them as JSON, return the JSON path"""
+
+        global _active
+        if _active is self:
+            _active = None
+
+        total = {"wall_sec": time.perf_counter() - self._start[0], "cpu_sec": time.process_time() - self._start[1], "peak_rss_mb": peak_rss_mb()}
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+
+        if self._profiler is not None:
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            if self.profile == "cprofile":
+                self._profiler.disable()
+                path = f"{PROFILES_DIR}/{self.step}_{self.plant}_{timestamp}.prof"
+                self._profiler.dump_stats(path)
+            else:
+                self._profiler.stop()
+                path = f"{PROFILES_DIR}/{self.step}_{self.plant}_{timestamp}.html"
+                with open(path, "w") as f:
+                    f.write(self._profiler.output_html())
+            myLogger.info(f"[{self.step}] profile saved to {path}")
+
+        for name, record in self.phases.items():
+            for key in ["wall_sec", "cpu_sec", "peak_rss_mb", "rows"]:
+                self._log_run(f"{name}_{key}", record[key])
+        for name, record in self.frames.items():
+            self._log_run(f"{name}_memory_mb", record["memory_mb"])
+        for key, value in total.items():
+            self._log_run(f"{self.step}_{key}", value)
+
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = f"{METRICS_DIR}/{self.step}_{self.plant}_{timestamp}.json"
+        with open(path, "w") as f:
+            json.dump({"step": self.step, "plant": self.plant, "total": total, "phases": self.phases, "frames": self.frames}, f, indent=2)
+
+        myLogger.info(f"[{self.step}] done in {total['wall_sec']:.2f} sec wall, {total['cpu_sec']:.2f} sec CPU, peak RSS {total['peak_rss_mb'] or 0:.0f} MB, metrics saved to {path}")
+
+        return path
+
+
+def phase(name: str, rows: int = None):
+    """Time a block as a phase of the running step, does nothing outside of a step (e.g. in benchmarks)"""
+
+    if _active is None:
+        return nullcontext({"rows": rows})
+
+    return _active.phase(name, rows)
+
+
+def frame_memory(name: str, df):
+    """Record the memory of a frame of the running step, does nothing outside of a step"""
+
+    if _active is not None:
+        _active.frame(name, df)
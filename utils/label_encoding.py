@@ -1,21 +1,320 @@
+import json
+import numpy as np
+import os
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from utils.dtypes import compact_codes
+from utils.dtypes import float_codes
+from utils.dtypes import smallest_int
+
+# Codes of categories with equal counts: 1 in the order of pandas value_counts().sort_values() (former frequency_encoding),
+# 2 in order of first appearance (FrequencyEncoder). Models are retrained when the version of their mappings differs.
+ENCODING_VERSION = 2
 
 def frequency_encoding(df: pd.DataFrame, columns: list) -> (pd.DataFrame, dict):
-    """Frequency encoding function, order by frequency, from 0 to n"""
-    
-    encoding_mappings = {} # To store encoding mappings
-
-    for col in columns:
-        encoding = df[col].value_counts()
-        encoding = encoding.sort_values().index.tolist()
-    
-        # Create dictionary for mapping the categories to the encoding
-        ordinal_encoding = {k: i for i, k in enumerate(encoding, 0)}
-
-        # Save the encoding mappings for this column
-        encoding_mappings[col] = ordinal_encoding
-    
-    # Map the ordinal encoding to the dataframe
-        df[col] = df[col].map(ordinal_encoding)
-    
-    return df, encoding_mappings
\ No newline at end of file
+    """
+        Frequency encoding function, order by frequency, from 0 to n (ties in order of first appearance),
+        in the smallest int type (float32 if there are NAs, kept as NaN). Chunked data: FrequencyEncoder, same result.
+    """
+
+    encoder = FrequencyEncoder(columns)
+    df = encoder.fit_transform(df)
+
+    return df, encoder.encoding_mappings
+
+
+class EncodingMappings:
+    """
+        Compact, pickle-free encoding mappings: per column, the categories sorted (numpy strings or numbers) and their int32 codes.
+        Saved as one directory of .npy files plus manifest.json, loaded memory-mapped without allow_pickle.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, categories: dict, codes: dict, encoding_version: int = ENCODING_VERSION):
+        self.categories = categories  # column -> sorted categories
+        self.codes = codes  # column -> int32 code of each category
+        self.encoding_version = encoding_version  # Tie order of the codes, see ENCODING_VERSION
+
+    @property
+    def columns(self) -> list:
+        return list(self.categories.keys())
+
+    @classmethod
+    def from_dict(cls, encoding_mappings: dict, encoding_version: int = ENCODING_VERSION) -> "EncodingMappings":
+        """Convert {column: {category: code}} as returned by frequency_encoding (of encoding_version)"""
+
+        categories, codes = {}, {}
+        for col, mapping in encoding_mappings.items():
+            keys = list(mapping.keys())
+
+            # Categories are stored as numbers or as strings, so a column mixing both (e.g. 5 and "5") cannot be represented
+            kinds = {"bool" if isinstance(k, (bool, np.bool_)) else "number" if isinstance(k, (int, float, np.number)) else "string" for k in keys}
+            if len(kinds) > 1:
+                raise ValueError(f"Categories of {col} mix {' and '.join(sorted(kinds))} values")
+
+            if kinds == {"number"}:
+                keys = np.array(keys, dtype=np.float64 if any(isinstance(k, (float, np.floating)) for k in keys) else np.int64)
+            else:
+                keys = np.array([str(k) for k in keys], dtype=str)
+
+            order = np.argsort(keys, kind="stable")
+            categories[col] = keys[order]
+            codes[col] = np.array(list(mapping.values()), dtype=np.int32)[order]
+
+        return cls(categories, codes, encoding_version)
+
+    def to_dict(self) -> dict:
+        return {col: dict(zip(self.categories[col].tolist(), self.codes[col].tolist())) for col in self.columns}
+
+    def save(self, directory: str) -> list:
+        """Write <directory>/<column>.categories.npy, <column>.codes.npy and manifest.json, return the written files"""
+
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for col in self.columns:
+            for part, array in (("categories", self.categories[col]), ("codes", self.codes[col])):
+                path = os.path.join(directory, f"{col}.{part}.npy")
+                np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+                files.append(path)
+
+        manifest = {"version": self.FORMAT_VERSION, "encoding_version": self.encoding_version, "columns": {col: {"dtype": self.categories[col].dtype.str, "size": len(self.codes[col])} for col in self.columns}}
+        path = os.path.join(directory, "manifest.json")
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+        files.append(path)
+
+        return files
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "EncodingMappings":
+        """Load mappings written by save, memory-mapped by default"""
+
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest["version"] != cls.FORMAT_VERSION:
+            raise ValueError(f"Unknown encoding mappings version: {manifest['version']}")
+
+        mmap_mode = "r" if mmap else None
+        categories, codes = {}, {}
+        for col in manifest["columns"]:
+            categories[col] = np.load(os.path.join(directory, f"{col}.categories.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            codes[col] = np.load(os.path.join(directory, f"{col}.codes.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+
+        # Mappings saved before the version was recorded are of the former frequency_encoding
+        return cls(categories, codes, manifest.get("encoding_version", 1))
+
+    def _lookup(self, col: str, keys) -> np.ndarray:
+        """Codes of distinct keys by binary search in the sorted categories, -1 if not mapped"""
+
+        categories = self.categories[col]
+        if len(categories) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int32)
+
+        if categories.dtype.kind == "U":
+            keys = np.asarray(keys, dtype=object).astype(str)
+        else:
+            keys = pd.to_numeric(pd.Series(keys, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+        position = np.searchsorted(categories, keys).clip(max=len(categories) - 1)
+        found = categories[position] == keys
+
+        return np.where(found, self.codes[col][position], -1).astype(np.int32)
+
+    def encode(self, col: str, values) -> np.ndarray:
+        """Encode values of a column, if not mapped (or NA) then apply -1"""
+
+        # Look up each distinct value once, NAs are factorized to -1
+        if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+            inverse, uniques = np.asarray(values.cat.codes), values.cat.categories
+        else:
+            inverse, uniques = pd.factorize(np.asarray(values, dtype=object))
+
+        codes = np.append(self._lookup(col, uniques), np.int32(-1))  # inverse == -1 picks the last element
+
+        return codes[inverse]
+
+    def transform(self, df: pd.DataFrame, columns: list = None, unseen=-1) -> pd.DataFrame:
+        """Encode columns with one vectorized lookup each, unseen values are encoded as unseen (-1, or np.nan as frequency_encoding does for NAs), compact dtypes"""
+
+        if columns is None:
+            columns = self.columns
+
+        for col in columns:
+            codes = self.encode(col, df[col])
+            if unseen != -1 and (codes == -1).any():
+                codes = np.where(codes == -1, unseen, codes)
+            df[col] = compact_codes(codes)
+
+        return df
+
+    def label_lookup(self, col: str) -> np.ndarray:
+        """Array whose position i holds the category encoded as i"""
+
+        lookup = np.empty(len(self.codes[col]), dtype=self.categories[col].dtype)
+        lookup[self.codes[col]] = self.categories[col]
+
+        return lookup
+
+
+class FrequencyEncoder:
+    """
+        Frequency encoding fitted chunk by chunk: partial_fit counts the categories of a chunk, merge adds the counts of an encoder
+        fitted on the following rows (e.g. by another worker), finalize orders the categories by frequency, ties by first appearance.
+        Chunks fitted and merged in row order give the mappings and codes of frequency_encoding on the whole data.
+    """
+
+    def __init__(self, columns: list):
+        self.columns = list(columns)
+        self.categories = {col: pd.Index([], dtype=object) for col in self.columns}  # In order of first appearance
+        self.counts = {col: np.zeros(0, dtype=np.int64) for col in self.columns}
+        self.has_na = {col: False for col in self.columns}
+        self.encoding_mappings = None  # {column: {category: code}}, set by finalize
+        self.mappings = None  # EncodingMappings of encoding_mappings, used by transform
+
+    @staticmethod
+    def _count(values) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Codes of values (-1 for NAs), their distinct values in order of first appearance and the count of each"""
+
+        codes, uniques = pd.factorize(values)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+        return codes, np.asarray(uniques, dtype=object), counts
+
+    def _add(self, col: str, uniques: np.ndarray, counts: np.ndarray):
+        """Add counts of uniques, the new ones after the known categories"""
+
+        position = self.categories[col].get_indexer(uniques)
+        known = position >= 0
+        self.counts[col][position[known]] += counts[known]
+        self.categories[col] = self.categories[col].append(pd.Index(uniques[~known], dtype=object))
+        self.counts[col] = np.concatenate([self.counts[col], counts[~known]])
+
+    def partial_fit(self, chunk: pd.DataFrame) -> "FrequencyEncoder":
+        """Count the categories of a chunk, chunks in row order"""
+
+        for col in self.columns:
+            codes, uniques, counts = self._count(chunk[col])
+            self.has_na[col] |= bool((codes < 0).any())
+            self._add(col, uniques, counts)
+
+        return self
+
+    def merge(self, other: "FrequencyEncoder") -> "FrequencyEncoder":
+        """Add the counts of an encoder fitted on the rows following those of this one"""
+
+        for col in self.columns:
+            self._add(col, other.categories[col].to_numpy(dtype=object), other.counts[col])
+            self.has_na[col] |= other.has_na[col]
+
+        return self
+
+    def _order(self, col: str) -> np.ndarray:
+        """Positions of the categories from the least to the most frequent, ties in order of first appearance"""
+
+        return np.argsort(self.counts[col], kind="stable")
+
+    def _dtype(self, col: str) -> np.dtype:
+        """Dtype of the codes of a column in the whole data, as compact_codes gives"""
+
+        n = len(self.counts[col])
+        return float_codes(n - 1) if self.has_na[col] else smallest_int(0, n - 1)
+
+    def finalize(self) -> dict:
+        """Frequency-ordered mappings {column: {category: code}}, as returned by frequency_encoding"""
+
+        self.encoding_mappings = {col: {k: i for i, k in enumerate(self.categories[col][self._order(col)].tolist())} for col in self.columns}
+        self.mappings = EncodingMappings.from_dict(self.encoding_mappings)
+
+        return self.encoding_mappings
+
+    def transform(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Encode a chunk in place with the finalized mappings, NAs (and unseen values) as NaN, in the dtypes of the whole data"""
+
+        for col in self.columns:
+            codes = self.mappings.encode(col, chunk[col])
+            dtype = self._dtype(col)
+            if (codes == -1).any():
+                dtype = dtype if dtype.kind == "f" else float_codes(len(self.counts[col]) - 1)
+                codes = np.where(codes == -1, np.nan, codes)
+            chunk[col] = codes.astype(dtype)
+
+        return chunk
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Fit on a whole frame and encode it in place, factorizing each column once"""
+
+        if any(len(counts) for counts in self.counts.values()):
+            raise ValueError("fit_transform needs an encoder that is not fitted yet")
+
+        factorized = {}
+        for col in self.columns:
+            factorized[col], uniques, counts = self._count(df[col])
+            self.has_na[col] = bool((factorized[col] < 0).any())
+            self._add(col, uniques, counts)
+        self.finalize()
+
+        # Factorized codes are positions in the categories, their rank by frequency is the encoding
+        for col in self.columns:
+            rank = np.empty(len(self.counts[col]) + 1, dtype=np.int64)
+            rank[self._order(col)] = np.arange(len(self.counts[col]))
+            codes = rank[factorized[col]]  # -1 (NA) picks the last element, replaced below
+            if self.has_na[col]:
+                codes = np.where(factorized[col] < 0, np.nan, codes)
+            df[col] = codes.astype(self._dtype(col))
+
+        return df
+
+
+def fit_frequency_encoder(chunks, columns: list, n_jobs: int = 1) -> FrequencyEncoder:
+    """Fit a FrequencyEncoder on chunks in row order, n_jobs chunks at a time, merged in row order, and finalize it"""
+
+    encoder = FrequencyEncoder(columns)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for partial in executor.map(lambda chunk: FrequencyEncoder(columns).partial_fit(chunk), chunks):
+            encoder.merge(partial)
+    encoder.finalize()
+
+    return encoder
+
+
+def mappings_directory(plant: str) -> str:
+    return f"./label_encoding/{plant}_encoding_mappings"
+
+def upload_mappings(datastore, mappings: EncodingMappings, plant: str):
+    """Save the mappings of a plant and upload them to label_encoding/<plant>_encoding_mappings/ of the datastore"""
+
+    files = mappings.save(mappings_directory(plant))
+    datastore.upload_files(files=files, target_path=f"label_encoding/{plant}_encoding_mappings", overwrite=True)
+
+def convert_legacy_mappings(legacy_path: str, directory: str) -> EncodingMappings:
+    """Convert a pickled dict saved with np.save (the former format) to the compact format, only for trusted files"""
+
+    mappings = EncodingMappings.from_dict(np.load(legacy_path, allow_pickle=True).item(), encoding_version=1)
+    mappings.save(directory)
+
+    return mappings
+
+def download_mappings(datastore, plant: str) -> EncodingMappings:
+    """Download and load the mappings of a plant, converting the former .npy file if only that one exists"""
+
+    directory = mappings_directory(plant)
+    datastore.download(target_path='.', prefix=f"label_encoding/{plant}_encoding_mappings/", overwrite=True)
+    if not os.path.exists(os.path.join(directory, "manifest.json")):
+        datastore.download(target_path='.', prefix=f"label_encoding/{plant}_encoding_mappings.npy", overwrite=True)
+        convert_legacy_mappings(f"{directory}.npy", directory)
+
+    return EncodingMappings.load(directory)
+
+
+if __name__ == "__main__":
+    # Run this file with command: python -m utils.label_encoding --legacy <plant>_encoding_mappings.npy --output <directory>
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--legacy", required=True)  # .npy file of a pickled dict
+    parser.add_argument("--output", required=True)  # Directory of the compact mappings
+    args = parser.parse_args()
+
+    mappings = convert_legacy_mappings(args.legacy, args.output)
+    print(f"Converted {len(mappings.columns)} columns to {args.output}")
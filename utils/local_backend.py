@@ -0,0 +1,205 @@
+import json
+import os
+import pandas as pd
+import shutil
+import time
+import uuid
+
+# Local stand-ins of the Azure ML workspace, datastore, datasets, models and runs used by the pipeline steps.
+# Everything is stored under PIPELINE_LOCAL_ROOT (default ./local_backend), so the steps can run on one machine.
+
+ROOT = os.path.abspath(os.environ.get("PIPELINE_LOCAL_ROOT", "./local_backend"))
+
+# Simulated service latency (seconds per transfer or registration) and bandwidth (MB/s, 0: unlimited),
+# so that the effect of concurrent uploads and of skipped downloads can be measured offline
+LATENCY = float(os.environ.get("PIPELINE_LOCAL_LATENCY", "0"))
+BANDWIDTH = float(os.environ.get("PIPELINE_LOCAL_BANDWIDTH", "0"))
+
+
+def _simulate_transfer(n_bytes: int = 0):
+    seconds = LATENCY + (n_bytes / (BANDWIDTH * 1024 ** 2) if BANDWIDTH > 0 else 0)
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def _next_version(directory: str) -> (int, str):
+    """Create the next version folder of a registered asset, safe for concurrent processes"""
+
+    os.makedirs(directory, exist_ok=True)
+    version = len(os.listdir(directory)) + 1
+    while True:
+        path = os.path.join(directory, str(version))
+        try:
+            os.makedirs(path)
+            return version, path
+        except FileExistsError:
+            version += 1
+
+
+def _latest_version(directory: str) -> int:
+    versions = [int(v) for v in os.listdir(directory) if v.isdigit()] if os.path.isdir(directory) else []
+    if not versions:
+        raise KeyError(f"Nothing registered in {directory}")
+
+    return max(versions)
+
+
+class Datastore:
+    """Blob storage stand-in: a folder"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def upload_files(self, files, target_path=None, overwrite=False, **kwargs):
+        target = os.path.join(self.root, target_path or "")
+        os.makedirs(target, exist_ok=True)
+        for file in files:
+            destination = os.path.join(target, os.path.basename(file))
+            if overwrite or not os.path.exists(destination):
+                _simulate_transfer(os.path.getsize(file))
+                shutil.copyfile(file, destination)
+
+    def download(self, target_path, prefix=None, overwrite=False, **kwargs):
+        """Copy every file whose path relative to the datastore starts with prefix to target_path"""
+
+        count = 0
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                relative = os.path.relpath(os.path.join(directory, file), self.root).replace(os.sep, "/")
+                if prefix is None or relative.startswith(prefix):
+                    destination = os.path.join(target_path, relative)
+                    if overwrite or not os.path.exists(destination):
+                        os.makedirs(os.path.dirname(destination), exist_ok=True)
+                        _simulate_transfer(os.path.getsize(os.path.join(directory, file)))
+                        shutil.copyfile(os.path.join(directory, file), destination)
+                    count += 1
+
+        return count
+
+    def path(self, path):
+        return os.path.normpath(os.path.join(self.root, path))
+
+
+class Workspace:
+    def __init__(self, root: str = ROOT):
+        self.root = root
+        self.name = "local"
+        self.location = root
+        self._datastore = Datastore(os.path.join(root, "datastore"))
+
+    def get_default_datastore(self):
+        return self._datastore
+
+
+class _Experiment:
+    def __init__(self, workspace):
+        self.workspace = workspace
+
+
+class Run:
+    """Run stand-in, the parent of a step run is the same local run"""
+
+    def __init__(self, workspace=None):
+        self.id = os.environ.get("PIPELINE_RUN_ID", f"local_{uuid.uuid4().hex[:8]}")
+        self.experiment = _Experiment(workspace or Workspace())
+        self.parent = self
+
+    @classmethod
+    def get_context(cls):
+        return cls()
+
+    def log(self, name, value, description=""):
+        """Append a metric to <root>/runs/<run id>/metrics.jsonl"""
+
+        directory = os.path.join(self.experiment.workspace.root, "runs", self.id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "metrics.jsonl"), "a") as f:
+            f.write(json.dumps({"name": name, "value": value}) + "\n")
+
+
+class TabularDataset:
+    def __init__(self, path: str, fmt: str, columns: list = None, name: str = None, version: int = None):
+        self.path = path
+        self.fmt = fmt
+        self.columns = columns
+        self.name = name
+        self.version = version
+
+    def register(self, workspace, name, create_new_version=True, **kwargs):
+        _simulate_transfer()
+        version, directory = _next_version(os.path.join(workspace.root, "datasets", name))
+        path = os.path.join(directory, os.path.basename(self.path))
+        shutil.copyfile(self.path, path)
+        with open(os.path.join(directory, "dataset.json"), "w") as f:
+            json.dump({"name": name, "version": version, "path": path, "format": self.fmt}, f)
+
+        return TabularDataset(path, self.fmt, name=name, version=version)
+
+    def keep_columns(self, columns):
+        return TabularDataset(self.path, self.fmt, columns=list(columns), name=self.name, version=self.version)
+
+    def to_pandas_dataframe(self):
+        _simulate_transfer(os.path.getsize(self.path))
+        if self.fmt == "parquet":
+            return pd.read_parquet(self.path, columns=self.columns)
+
+        return pd.read_csv(self.path, usecols=self.columns)
+
+
+class _Tabular:
+    @staticmethod
+    def from_delimited_files(path, **kwargs):
+        return TabularDataset(path, "csv")
+
+    @staticmethod
+    def from_parquet_files(path, **kwargs):
+        return TabularDataset(path, "parquet")
+
+
+class Dataset:
+    Tabular = _Tabular
+
+    @staticmethod
+    def get_by_name(workspace, name, version="latest"):
+        directory = os.path.join(workspace.root, "datasets", name)
+        if version == "latest":
+            version = _latest_version(directory)
+        with open(os.path.join(directory, str(version), "dataset.json")) as f:
+            meta = json.load(f)
+
+        return TabularDataset(meta["path"], meta["format"], name=name, version=meta["version"])
+
+
+class Model:
+    """Model registry stand-in, a registered model is a copy of model_path"""
+
+    def __init__(self, workspace, name, version=None):
+        directory = os.path.join(workspace.root, "models", name)
+        version = version or _latest_version(directory)
+        with open(os.path.join(directory, str(version), "model.json")) as f:
+            meta = json.load(f)
+
+        self.name = name
+        self.version = meta["version"]
+        self.tags = meta["tags"]
+        self.properties = meta["properties"]
+        self.description = meta["description"]
+        self.path = os.path.join(directory, str(version), "model")
+
+    @classmethod
+    def register(cls, workspace, model_path, model_name, tags=None, properties=None, description=None, **kwargs):
+        version, directory = _next_version(os.path.join(workspace.root, "models", model_name))
+        if os.path.isdir(model_path):
+            shutil.copytree(model_path, os.path.join(directory, "model"))
+        else:
+            os.makedirs(os.path.join(directory, "model"))
+            shutil.copyfile(model_path, os.path.join(directory, "model", os.path.basename(model_path)))
+        with open(os.path.join(directory, "model.json"), "w") as f:
+            json.dump({"name": model_name, "version": version, "tags": tags or {}, "properties": properties or {}, "description": description}, f)
+
+        return cls(workspace, model_name, version)
+
+    @staticmethod
+    def get_model_path(model_name, version=None, _workspace=None):
+        return Model(_workspace or Workspace(), model_name, version).path
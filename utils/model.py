@@ -1,31 +1,107 @@
+import joblib
+import json
+import numpy as np
+import os
 import xgboost as xgb
 
+from itertools import product
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.metrics import accuracy_score
 from sklearn.model_selection import GridSearchCV, StratifiedKFold
 
-def xgboost_model(x_train, y_train, x_val, y_val) -> (xgb.XGBClassifier, int):
+# Define the parameter grid
+PARAM_GRID = {
+    'max_depth': [3, 5, 7],
+    'learning_rate': [0.1, 0.05, 0.01, 0.001],
+    'n_estimators': [50, 100, 200],
+}
 
-    # Define the parameter grid
-    param_grid = {
-        'max_depth': [3, 5, 7],
-        'learning_rate': [0.1, 0.05, 0.01, 0.001],
-        'n_estimators': [50, 100, 200],
-    }
+def thread_budget(n_jobs: int, n_threads: int = None) -> int:
+    """XGBoost threads per fit so that n_jobs parallel fits do not oversubscribe n_threads cores"""
+
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+
+    return max(1, n_threads // max(1, n_jobs))
+
+def predict_proba_at(model: xgb.XGBClassifier, x, n_estimators: int) -> np.ndarray:
+    """Predict probabilities using only the first n_estimators boosting rounds"""
+
+    try:
+        return model.predict_proba(x, iteration_range=(0, n_estimators))
+    except TypeError:  # xgboost < 1.4
+        return model.predict_proba(x, ntree_limit=n_estimators)
+
+def _rows(data, index):
+    """Select rows by position from a DataFrame, Series or array"""
+
+    return data.iloc[index] if hasattr(data, "iloc") else data[index]
+
+def _fit_staged(clf, params, n_estimators, x, y, train_index, test_index) -> list:
+    """Fit one fold with the largest n_estimators and score every smaller n_estimators on the same boosters"""
+
+    model = clone(clf).set_params(**params, n_estimators=max(n_estimators))
+    model.fit(_rows(x, train_index), _rows(y, train_index))
+
+    scores = []
+    for n in n_estimators:
+        proba = predict_proba_at(model, _rows(x, test_index), n)
+        scores.append(accuracy_score(_rows(y, test_index), model.classes_[np.argmax(proba, axis=1)]))
+
+    return scores
+
+def staged_search(clf, param_grid, cv, x_train, y_train, n_jobs=1) -> dict:
+    """Grid search that fits n_estimators once per (max_depth, learning_rate, fold) and scores its stages"""
+
+    n_estimators = sorted(param_grid['n_estimators'])
+    other_keys = [k for k in param_grid if k != 'n_estimators']
+    candidates = [dict(zip(other_keys, values)) for values in product(*(param_grid[k] for k in other_keys))]
+    folds = list(cv.split(x_train, y_train))
+
+    fold_scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_staged)(clf, params, n_estimators, x_train, y_train, train_index, test_index)
+        for params in candidates for train_index, test_index in folds
+    )
+
+    # Average over folds, shape: (candidates, folds, n_estimators)
+    mean_scores = np.asarray(fold_scores).reshape(len(candidates), len(folds), len(n_estimators)).mean(axis=1)
+    best_candidate, best_stage = np.unravel_index(np.argmax(mean_scores), mean_scores.shape)
+
+    return {**candidates[best_candidate], 'n_estimators': n_estimators[best_stage]}
+
+def xgboost_model(x_train, y_train, x_val, y_val, search="grid", n_jobs=1, n_threads=None) -> (xgb.XGBClassifier, int):
+    """
+        Search hyperparameters with cross validation and evaluate the best model on the validation set.
+        search: "grid" (exhaustive GridSearchCV) or "staged" (one fit per n_estimators path, scored at each stage)
+        n_jobs: parallel fits, n_threads: total cores shared by those fits (default: all cores)
+    """
 
     # Specify StratifiedKFold as the cross-validator
     cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
 
     # Create XGBoost model 1
-    clf = xgb.XGBClassifier(enable_categorical=True)
-    grid_search_model = GridSearchCV(estimator=clf, param_grid=param_grid, cv=cv, scoring='accuracy')
-    grid_search_model.fit(x_train, y_train)
+    clf = xgb.XGBClassifier(enable_categorical=True, n_jobs=thread_budget(n_jobs, n_threads))
 
-    # Get the best parameters
-    best_params = grid_search_model.best_params_
-    print(best_params)
+    if search == "grid":
+        grid_search_model = GridSearchCV(estimator=clf, param_grid=PARAM_GRID, cv=cv, scoring='accuracy', n_jobs=n_jobs)
+        grid_search_model.fit(x_train, y_train)
 
-    best_model = xgb.XGBClassifier(**best_params, enable_categorical=True)
-    best_model.fit(x_train, y_train)
+        # Get the best parameters, the best estimator is already refitted on the whole training set
+        best_params = grid_search_model.best_params_
+        best_model = grid_search_model.best_estimator_
+
+    elif search == "staged":
+        best_params = staged_search(clf, PARAM_GRID, cv, x_train, y_train, n_jobs=n_jobs)
+
+        # Refit once on the whole training set, using all cores of the budget
+        best_model = clone(clf).set_params(**best_params, n_jobs=thread_budget(1, n_threads))
+        best_model.fit(x_train, y_train)
+
+    else:
+        raise ValueError(f"Unknown search: {search}")
+
+    print(best_params)
 
     # Make predictions on the test set
     y_pred = best_model.predict(x_val)
@@ -34,4 +110,179 @@ def xgboost_model(x_train, y_train, x_val, y_val) -> (xgb.XGBClassifier, int):
     accuracy = accuracy_score(y_val, y_pred)
     print(f"Best Model Accuracy: {accuracy}")
 
-    return best_model, accuracy
\ No newline at end of file
+    return best_model, accuracy
+
+def continue_training(model: xgb.XGBClassifier, x, y, n_rounds: int) -> xgb.XGBClassifier:
+    """Warm start: add n_rounds boosting rounds fitted on (x, y) to a trained classifier, y must be within model.classes_"""
+
+    # Labels as positions in the classes of the model, as used by its booster
+    labels = np.searchsorted(model.classes_, np.asarray(y))
+
+    # fit of older xgboost (e.g. 1.3.3) does not keep its multiclass objective in the estimator params, so it is set from the classes
+    params = model.get_xgb_params()
+    if len(model.classes_) > 2:
+        params.update(objective="multi:softprob", num_class=len(model.classes_))
+    else:
+        params["objective"] = "binary:logistic"
+
+    booster = xgb.train(params, xgb.DMatrix(x, label=labels), num_boost_round=n_rounds, xgb_model=model.get_booster())
+
+    model._Booster = booster
+    model.set_params(n_estimators=model.get_params()["n_estimators"] + n_rounds)
+
+    return model
+
+XGB_VERSION = tuple(int(v) for v in xgb.__version__.split(".")[:2])
+
+# Native booster format: UBJSON loads about 10x faster than JSON but needs xgboost >= 1.6
+NATIVE_FORMAT = "ubj" if XGB_VERSION >= (1, 6) else "json"
+
+# External memory DMatrix built from a DataIter: xgboost >= 1.5
+EXTERNAL_MEMORY = XGB_VERSION >= (1, 5) and hasattr(xgb, "DataIter")
+
+def save_chunk(path: str, x: np.ndarray, y: np.ndarray) -> str:
+    """Save the features (float32, NaN: missing) and labels of a training chunk for ChunkIter, return its path"""
+
+    np.savez(path, x=np.ascontiguousarray(x, dtype=np.float32), y=np.asarray(y))
+
+    return path
+
+def load_chunk(path: str) -> (np.ndarray, np.ndarray):
+    """Features and labels of a chunk saved by save_chunk"""
+
+    with np.load(path) as chunk:
+        return chunk["x"], chunk["y"]
+
+class ChunkIter(getattr(xgb, "DataIter", object)):
+    """Chunks saved by save_chunk, passed one at a time to XGBoost, which caches them on disk under cache_prefix"""
+
+    def __init__(self, files: list, columns: slice, feature_names: list, cache_prefix: str):
+        self.files = files
+        self.columns = columns  # Features of the model among those of the chunks
+        self.feature_names = feature_names
+        self._position = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:
+        if self._position == len(self.files):
+            return 0
+
+        x, y = load_chunk(self.files[self._position])
+        input_data(data=np.ascontiguousarray(x[:, self.columns]), label=y, feature_names=self.feature_names)
+        self._position += 1
+
+        return 1
+
+    def reset(self):
+        self._position = 0
+
+def chunk_accuracy(booster: xgb.Booster, files: list, columns: slice) -> float:
+    """Accuracy of a booster trained on labels 0..n_classes-1 over chunks saved by save_chunk"""
+
+    correct, total = 0, 0
+    for path in files:
+        x, y = load_chunk(path)
+        proba = booster.inplace_predict(np.ascontiguousarray(x[:, columns]))
+        y_pred = (proba > 0.5).astype(int) if proba.ndim == 1 else np.argmax(proba, axis=1)
+        correct += int((y_pred == y).sum())
+        total += len(y)
+
+    return correct / max(total, 1)
+
+def external_memory_model(train_files: list, val_files: list, columns: slice, feature_names: list, n_classes: int, params: dict,
+                          cache_prefix: str, n_threads: int = None) -> (xgb.XGBClassifier, float):
+    """
+        Train a classifier with params (e.g. the best of xgboost_model on a sample) over chunks saved by save_chunk,
+        through an external memory DMatrix and the hist tree method: only one chunk is held in memory at a time.
+        Labels are the codes 0..n_classes-1, accuracy is evaluated chunk by chunk on val_files.
+    """
+
+    if not EXTERNAL_MEMORY:
+        raise RuntimeError(f"External memory training needs xgboost >= 1.5, installed: {xgb.__version__}")
+
+    model = xgb.XGBClassifier(**params, tree_method="hist", n_jobs=thread_budget(1, n_threads))
+    train_params = model.get_xgb_params()
+    if n_classes > 2:
+        train_params.update(objective="multi:softprob", num_class=n_classes)
+    else:
+        train_params["objective"] = "binary:logistic"
+
+    dtrain = xgb.DMatrix(ChunkIter(train_files, columns, feature_names, cache_prefix), missing=np.nan)
+    booster = xgb.train(train_params, dtrain, num_boost_round=model.get_params()["n_estimators"])
+    del dtrain
+
+    # Classifier of the booster, saved and predicted as the in-memory ones (classes_ is derived from n_classes_ in xgboost >= 2)
+    model._Booster = booster
+    model.n_classes_ = n_classes
+    if not isinstance(getattr(type(model), "classes_", None), property):
+        model.classes_ = np.arange(n_classes)
+
+    accuracy = chunk_accuracy(booster, val_files, columns)
+    print(f"External memory model accuracy: {accuracy}")
+
+    return model, accuracy
+
+def save_model(model: xgb.XGBClassifier, directory: str, model_name: str):
+    """
+        Save a classifier as <model_name> (joblib) and, for BoosterPredictor, its booster in XGBoost's native format
+        with the classes and feature names in <name>.meta.json
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    joblib.dump(model, os.path.join(directory, model_name))
+
+    base = os.path.join(directory, os.path.splitext(model_name)[0])
+    booster_file = f"{os.path.basename(base)}.{NATIVE_FORMAT}"
+    model.get_booster().save_model(os.path.join(directory, booster_file))
+    with open(f"{base}.meta.json", "w") as f:
+        json.dump({"booster": booster_file, "classes": np.asarray(model.classes_).tolist(), "feature_names": model.get_booster().feature_names}, f)
+
+class BoosterPredictor:
+    """predict_proba of a trained classifier straight from its Booster, on contiguous float32 arrays with explicit threads"""
+
+    def __init__(self, booster: xgb.Booster, classes, feature_names: list = None, n_threads: int = None):
+        self.booster = booster
+        self.classes_ = np.asarray(classes)
+        self.feature_names = feature_names
+        self.booster.set_param({"nthread": n_threads or os.cpu_count() or 1})
+
+    @classmethod
+    def from_classifier(cls, model: xgb.XGBClassifier, n_threads: int = None) -> "BoosterPredictor":
+        booster = model.get_booster()
+        return cls(booster, model.classes_, booster.feature_names, n_threads)
+
+    @classmethod
+    def load(cls, path: str, n_threads: int = None) -> "BoosterPredictor":
+        """
+            Load a model saved by save_model, path: its joblib file.
+            The native booster is loaded if there is one, else the joblib classifier (saved by a former version).
+        """
+
+        meta_path = f"{os.path.splitext(path)[0]}.meta.json"
+        if not os.path.exists(meta_path):
+            return cls.from_classifier(joblib.load(path), n_threads)
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        booster = xgb.Booster()
+        booster.load_model(os.path.join(os.path.dirname(path), meta["booster"]))
+
+        return cls(booster, meta["classes"], meta["feature_names"], n_threads)
+
+    def predict_proba(self, x) -> np.ndarray:
+        """Class probabilities, columns in the order of classes_ as XGBClassifier.predict_proba"""
+
+        if hasattr(x, "columns") and self.feature_names:
+            x = x[self.feature_names]
+        data = np.ascontiguousarray(x, dtype=np.float32)
+
+        if hasattr(self.booster, "inplace_predict"):
+            proba = self.booster.inplace_predict(data)
+        else:  # xgboost < 1.1
+            proba = self.booster.predict(xgb.DMatrix(data, missing=np.nan, feature_names=self.feature_names))
+
+        # Binary models return the probability of the second class only
+        if proba.ndim == 1:
+            proba = np.column_stack([1 - proba, proba])
+
+        return proba
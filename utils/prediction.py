@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+def top_k(proba: np.ndarray, k: int = 3) -> (np.ndarray, np.ndarray):
+    """Column indices and probabilities of the k most probable classes per row, most probable first"""
+
+    n_rows, n_classes = proba.shape
+    k = min(k, n_classes)
+
+    # Select the k largest per row in O(C), then sort only those k
+    if k < n_classes:
+        candidates = np.argpartition(proba, n_classes - k, axis=1)[:, n_classes - k:]
+    else:
+        candidates = np.broadcast_to(np.arange(n_classes), (n_rows, n_classes))
+    candidate_proba = np.take_along_axis(proba, candidates, axis=1)
+
+    order = np.argsort(-candidate_proba, axis=1, kind="stable")
+
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_proba, order, axis=1)
+
+def prediction_columns(k: int = 3) -> list:
+    """Columns of top_k_frame, grouped as the former result layout: prediction1..k, then probability1..k"""
+
+    return [f"{name}{i+1}" for name in ["prediction", "probability"] for i in range(k)]
+
+def top_k_frame(proba: np.ndarray, lookup: np.ndarray, classes: np.ndarray = None, k: int = 3) -> pd.DataFrame:
+    """
+        Top k predictions as prediction1..k (original labels) and probability1..k.
+        classes: encoded label of each column of proba (model.classes_), default: column i is label i
+    """
+
+    indices, probabilities = top_k(proba, k)
+    codes = indices if classes is None else np.asarray(classes)[indices]
+    labels = lookup[codes]
+
+    result = {}
+    for i in range(indices.shape[1]):
+        result[f"prediction{i+1}"] = labels[:, i]
+        result[f"probability{i+1}"] = probabilities[:, i]
+
+    return pd.DataFrame(result, columns=prediction_columns(indices.shape[1]))